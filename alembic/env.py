@@ -5,7 +5,8 @@ from sqlalchemy import pool
 
 from alembic import context
 from database.db import DATABASE_URL, Base
-from database.models import Activity, Building, Organization, OrganizationActivity # noqa
+from database.models import (Activity, ActivityClosure, ActivityFacet, Building, EntityVersion, GeoCluster,  # noqa
+                             Organization, OrganizationActivity, OrganizationDocument)
 
 
 config = context.config
@@ -0,0 +1,65 @@
+"""initial
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'buildings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('address', sa.Text(), nullable=False),
+        sa.Column('coordinates', sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'activities',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['parent_id'], ['activities.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'organizations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('phones', sa.JSON(), nullable=True),
+        sa.Column('building_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['building_id'], ['buildings.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_organizations_name'), 'organizations', ['name'], unique=False)
+    op.create_table(
+        'organization_activities',
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id']),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id']),
+        sa.PrimaryKeyConstraint('organization_id', 'activity_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('organization_activities')
+    op.drop_index(op.f('ix_organizations_name'), table_name='organizations')
+    op.drop_table('organizations')
+    op.drop_table('activities')
+    op.drop_table('buildings')
@@ -0,0 +1,44 @@
+"""buildings lat lon
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('buildings', sa.Column('lat', sa.Float(), nullable=True))
+    op.add_column('buildings', sa.Column('lon', sa.Float(), nullable=True))
+
+    # Переносим координаты из JSON в колонки
+    op.execute(
+        "UPDATE buildings "
+        "SET lat = (coordinates->>'lat')::double precision, "
+        "    lon = (coordinates->>'lon')::double precision"
+    )
+
+    op.alter_column('buildings', 'lat', nullable=False)
+    op.alter_column('buildings', 'lon', nullable=False)
+    op.create_index('ix_buildings_lat_lon', 'buildings', ['lat', 'lon'], unique=False)
+    op.create_index(op.f('ix_organizations_building_id'), 'organizations', ['building_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_organizations_building_id'), table_name='organizations')
+    op.drop_index('ix_buildings_lat_lon', table_name='buildings')
+    op.drop_column('buildings', 'lon')
+    op.drop_column('buildings', 'lat')
@@ -0,0 +1,52 @@
+"""activity closure
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'activity_closure',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['activities.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['descendant_id'], ['activities.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+    )
+    op.create_index(op.f('ix_activity_closure_descendant_id'), 'activity_closure', ['descendant_id'], unique=False)
+    op.create_index(op.f('ix_organization_activities_activity_id'), 'organization_activities', ['activity_id'], unique=False)
+
+    # Заполняем замыкание по уже существующему дереву
+    op.execute(
+        "INSERT INTO activity_closure (ancestor_id, descendant_id, depth) "
+        "WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS ("
+        "    SELECT id, id, 0 FROM activities "
+        "    UNION ALL "
+        "    SELECT tree.ancestor_id, activities.id, tree.depth + 1 "
+        "    FROM tree JOIN activities ON activities.parent_id = tree.descendant_id"
+        ") "
+        "SELECT ancestor_id, descendant_id, depth FROM tree"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_organization_activities_activity_id'), table_name='organization_activities')
+    op.drop_index(op.f('ix_activity_closure_descendant_id'), table_name='activity_closure')
+    op.drop_table('activity_closure')
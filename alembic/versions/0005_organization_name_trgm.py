@@ -0,0 +1,33 @@
+"""organization name trigram index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # GiST, а не GIN: поиск отдаёт первые N по близости (ORDER BY name <<-> q LIMIT N) прямо из индекса,
+    # без сортировки всех совпадений; для миллионов строк индекс строится несколько минут
+    op.create_index(
+        'ix_organizations_name_trgm', 'organizations', ['name'], unique=False,
+        postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_organizations_name_trgm', table_name='organizations')
@@ -0,0 +1,95 @@
+"""organization documents read model
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 16:00:00.000000
+
+Документы существующих организаций собираются в самой миграции. Полная пересборка по-прежнему
+доступна отдельно: python -m services.document_service
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from pydantic import TypeAdapter
+
+from schemas.organization_schemas import OrganizationRead
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+DOCUMENT_ADAPTER = TypeAdapter(OrganizationRead)
+
+
+def backfill_documents(connection, documents) -> None:
+    # Модели приложения описывают схему последней ревизии, поэтому строки читаются через sa.table
+    # и собираются в тот же JSON, что пишет services.document_service, пачками по первичному ключу
+    organizations = sa.table('organizations', sa.column('id', sa.Integer), sa.column('name', sa.String),
+                             sa.column('phones', sa.JSON), sa.column('building_id', sa.Integer))
+    buildings = sa.table('buildings', sa.column('id', sa.Integer), sa.column('address', sa.Text),
+                         sa.column('coordinates', sa.JSON))
+    activities = sa.table('activities', sa.column('id', sa.Integer), sa.column('name', sa.String),
+                          sa.column('parent_id', sa.Integer), sa.column('level', sa.Integer))
+    relations = sa.table('organization_activities', sa.column('organization_id', sa.Integer),
+                         sa.column('activity_id', sa.Integer))
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(organizations).where(organizations.c.id > after_id).order_by(organizations.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        building_rows = connection.execute(
+            sa.select(buildings).where(buildings.c.id.in_({row.building_id for row in rows}))).all()
+        building_by_id = {row.id: dict(row._mapping) for row in building_rows}
+        activity_rows = connection.execute(
+            sa.select(relations.c.organization_id, activities)
+            .join(activities, activities.c.id == relations.c.activity_id)
+            .where(relations.c.organization_id.in_([row.id for row in rows]))
+            .order_by(relations.c.organization_id, activities.c.id)
+        ).all()
+        activities_by_organization = {}
+        for row in activity_rows:
+            activity = dict(row._mapping)
+            activities_by_organization.setdefault(activity.pop('organization_id'), []).append(activity)
+        values = [
+            {'organization_id': row.id, 'building_id': row.building_id,
+             'document': DOCUMENT_ADAPTER.dump_json(DOCUMENT_ADAPTER.validate_python({
+                 'id': row.id, 'name': row.name, 'phones': row.phones,
+                 'building': building_by_id[row.building_id],
+                 'activities': activities_by_organization.get(row.id, []),
+             })).decode()}
+            # Без здания документа нет, как и в приложении (бывает только без проверки внешних ключей)
+            for row in rows if row.building_id in building_by_id
+        ]
+        if values:
+            connection.execute(documents.insert(), values)
+        after_id = rows[-1].id
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    documents = op.create_table(
+        'organization_documents',
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('building_id', sa.Integer(), nullable=False),
+        sa.Column('document', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('organization_id'),
+    )
+    op.create_index(op.f('ix_organization_documents_building_id'), 'organization_documents', ['building_id'],
+                    unique=False)
+    backfill_documents(op.get_bind(), documents)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_organization_documents_building_id'), table_name='organization_documents')
+    op.drop_table('organization_documents')
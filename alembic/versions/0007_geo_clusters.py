@@ -0,0 +1,88 @@
+"""buildings geohash and geo clusters
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 18:00:00.000000
+
+Агрегаты для карты считаются в самой миграции по документам из 0006.
+Сверка и пересчёт отдельно: python -m services.cluster_service
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from utils import geohash
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10_000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('buildings', sa.Column('geohash', sa.String(length=12), nullable=True))
+
+    # geohash считается в Python (без PostGIS в базе его не посчитать): пачками по первичному ключу
+    connection = op.get_bind()
+    buildings = sa.table('buildings', sa.column('id', sa.Integer), sa.column('lat', sa.Float),
+                         sa.column('lon', sa.Float), sa.column('geohash', sa.String))
+    update = buildings.update().where(buildings.c.id == sa.bindparam('building_id')).values(
+        geohash=sa.bindparam('cell'))
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(buildings.c.id, buildings.c.lat, buildings.c.lon)
+            .where(buildings.c.id > after_id).order_by(buildings.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(update, [{'building_id': building_id, 'cell': geohash.encode(lat, lon)}
+                                    for building_id, lat, lon in rows])
+        after_id = rows[-1].id
+
+    op.alter_column('buildings', 'geohash', nullable=False)
+    op.create_index(op.f('ix_buildings_geohash'), 'buildings', ['geohash'], unique=False)
+
+    clusters = op.create_table(
+        'geo_clusters',
+        sa.Column('precision', sa.Integer(), nullable=False),
+        sa.Column('cell', sa.String(length=12), nullable=False),
+        sa.Column('organizations', sa.Integer(), nullable=False),
+        sa.Column('lat_sum', sa.Float(), nullable=False),
+        sa.Column('lon_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('precision', 'cell'),
+    )
+
+    # Как SQLAlchemyClusterRepository.rebuild: самые мелкие ячейки из документов, крупные - из мелких
+    documents = sa.table('organization_documents', sa.column('building_id', sa.Integer))
+    columns = ['precision', 'cell', 'organizations', 'lat_sum', 'lon_sum']
+    cell = sa.func.substr(buildings.c.geohash, 1, geohash.CLUSTER_PRECISION)
+    connection.execute(clusters.insert().from_select(columns, (
+        sa.select(sa.literal(geohash.CLUSTER_PRECISION), cell, sa.func.count(), sa.func.sum(buildings.c.lat),
+                  sa.func.sum(buildings.c.lon))
+        .select_from(documents)
+        .join(buildings, buildings.c.id == documents.c.building_id)
+        .group_by(cell)
+    )))
+    for precision in range(geohash.CLUSTER_PRECISION - 1, 0, -1):
+        cell = sa.func.substr(clusters.c.cell, 1, precision)
+        connection.execute(clusters.insert().from_select(columns, (
+            sa.select(sa.literal(precision), cell, sa.func.sum(clusters.c.organizations),
+                      sa.func.sum(clusters.c.lat_sum), sa.func.sum(clusters.c.lon_sum))
+            .where(clusters.c.precision == precision + 1)
+            .group_by(cell)
+        )))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('geo_clusters')
+    op.drop_index(op.f('ix_buildings_geohash'), table_name='buildings')
+    op.drop_column('buildings', 'geohash')
@@ -0,0 +1,51 @@
+"""activity facets
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 19:30:00.000000
+
+Счётчики считаются в самой миграции по связям организаций с документом из 0006.
+Сверка и пересчёт отдельно: python -m services.facet_service
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    facets = op.create_table(
+        'activity_facets',
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.Column('organizations', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('activity_id'),
+    )
+
+    # Как SQLAlchemyFacetRepository.count_facets: организация с деятельностью и её потомком
+    # считается у предка один раз, организации без документа не считаются
+    relations = sa.table('organization_activities', sa.column('organization_id', sa.Integer),
+                         sa.column('activity_id', sa.Integer))
+    closure = sa.table('activity_closure', sa.column('ancestor_id', sa.Integer),
+                       sa.column('descendant_id', sa.Integer))
+    documents = sa.table('organization_documents', sa.column('organization_id', sa.Integer))
+    op.get_bind().execute(facets.insert().from_select(['activity_id', 'organizations'], (
+        sa.select(closure.c.ancestor_id, sa.func.count(relations.c.organization_id.distinct()))
+        .join(closure, closure.c.descendant_id == relations.c.activity_id)
+        .join(documents, documents.c.organization_id == relations.c.organization_id)
+        .group_by(closure.c.ancestor_id)
+    )))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('activity_facets')
@@ -0,0 +1,33 @@
+"""organization version sequence
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Версии организаций берутся из общей последовательности: она не откатывается при TRUNCATE,
+    # поэтому ETag, выданный до перезаливки, не совпадёт с версией новой организации с тем же id
+    op.execute(sa.schema.CreateSequence(sa.Sequence('organization_version_seq')))
+    op.execute("SELECT setval('organization_version_seq', GREATEST((SELECT max(version) FROM organizations), 1))")
+    op.alter_column('organizations', 'version', server_default=sa.text("nextval('organization_version_seq')"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('organizations', 'version', server_default='1')
+    op.execute(sa.schema.DropSequence(sa.Sequence('organization_version_seq')))
@@ -1,26 +1,64 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from pydantic import TypeAdapter
 from typing import Annotated
 
-from schemas.activity_schemas import ActivityCreate, ActivityRead, ActivityUpdate
+from schemas.activity_schemas import ActivityCreate, ActivityFacet, ActivityRead, ActivityUpdate
 from services.activity_service import ActivityService
-from api.dependencies import activities_service
+from api.dependencies import activities_service, admission
+from utils.pagination import Limit, page_limit, ndjson_response, set_next_cursor
+from utils.serialization import json_response
+from utils.etag import etag_matches, make_etag, not_modified, set_etag
+from utils.query_budget import query_budget
 
 activity_router = APIRouter()
 
+activity_list_adapter = TypeAdapter(list[ActivityRead])
 
-@activity_router.get('/get_all_activities', response_model=list[ActivityRead])
-async def get_all_activities(activity_service: Annotated[ActivityService, Depends(activities_service)]):
-    return await activity_service.find_activities()
 
+@activity_router.get('/get_all_activities', response_model=list[ActivityRead], dependencies=[admission('lookup')])
+@query_budget(2)
+async def get_all_activities(request: Request,
+                             activity_service: Annotated[ActivityService, Depends(activities_service)],
+                             after_id: int | None = None,
+                             limit: Limit = None,
+                             stream: bool = False):
+    # Список отдаётся из дерева в памяти, ETag - по версии того же дерева
+    tree = await activity_service.activity_tree()
+    etag = make_etag('activities', tree.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-@activity_router.post('/create_activity')
+    if stream:
+        return set_etag(ndjson_response(await activity_service.find_activities(after_id), ActivityRead), etag)
+
+    limit = page_limit(after_id, limit)
+    activities = await activity_service.find_activities(after_id, limit)
+    response = json_response(activities, activity_list_adapter)
+    set_next_cursor(response, activities, limit)
+    return set_etag(response, etag)
+
+
+@activity_router.get('/facets', response_model=list[ActivityFacet], dependencies=[admission('expensive')])
+@query_budget(3)
+async def get_activity_facets(activity_service: Annotated[ActivityService, Depends(activities_service)],
+                              lat_min: float | None = None,
+                              lon_min: float | None = None,
+                              lat_max: float | None = None,
+                              lon_max: float | None = None):
+    # Без прямоугольника - готовые счётчики, с ним - подсчёт по организациям в прямоугольнике
+    return json_response(await activity_service.find_facets(lat_min, lon_min, lat_max, lon_max))
+
+
+@activity_router.post('/create_activity', dependencies=[admission('write')])
+@query_budget(6)
 async def create_activity(activity_in: ActivityCreate,
                           activity_service: Annotated[ActivityService, Depends(activities_service)]):
     activity_id = await activity_service.add_activity(activity_in)
     return {"ok": True, "created_id": activity_id}
 
 
-@activity_router.put('/{activity_id}')
+@activity_router.put('/{activity_id}', dependencies=[admission('write')])
+@query_budget(None)
 async def update_activity(activity_id: int,
                           activity_in: ActivityUpdate,
                           activity_service: Annotated[ActivityService, Depends(activities_service)]):
@@ -28,7 +66,8 @@ async def update_activity(activity_id: int,
     return {"ok": True, "updated_id": updated_id}
 
 
-@activity_router.delete('/{activity_id}')
+@activity_router.delete('/{activity_id}', dependencies=[admission('write')])
+@query_budget(None)
 async def delete_activity(activity_id: int,
                           activity_service: Annotated[ActivityService, Depends(activities_service)]):
     await activity_service.delete_activity(activity_id)
@@ -1,26 +1,50 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from typing import Annotated
 
 from schemas.buildings_schemas import BuildingCreate, BuildingRead
 from services.building_service import BuildingService
-from api.dependencies import buildings_service
+from api.dependencies import buildings_service, admission
+from utils.pagination import Limit, page_limit, ndjson_response, set_next_cursor
+from utils.serialization import json_response
+from utils.etag import etag_matches, make_etag, not_modified, set_etag
+from utils.query_budget import query_budget
 
 buildings_router = APIRouter()
 
 
-@buildings_router.get('/get_all_buildings', response_model=list[BuildingRead])
-async def get_all_buildings(building_service: Annotated[BuildingService, Depends(buildings_service)]):
-    return await building_service.find_buildings()
+@buildings_router.get('/get_all_buildings', response_model=list[BuildingRead], dependencies=[admission('expensive')])
+@query_budget(2)
+async def get_all_buildings(request: Request,
+                            building_service: Annotated[BuildingService, Depends(buildings_service)],
+                            after_id: int | None = None,
+                            limit: Limit = None,
+                            stream: bool = False):
+    # Версия читается раньше списка: список не старше версии в ETag
+    version = await building_service.version()
+    etag = make_etag('buildings', version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
+    if stream:
+        return set_etag(ndjson_response(building_service.stream_buildings(after_id), BuildingRead), etag)
 
-@buildings_router.post('/create_building')
+    limit = page_limit(after_id, limit)
+    buildings = await building_service.find_buildings(after_id, limit, version)
+    response = json_response(buildings)
+    set_next_cursor(response, buildings, limit)
+    return set_etag(response, etag)
+
+
+@buildings_router.post('/create_building', dependencies=[admission('write')])
+@query_budget(3)
 async def create_building(building_in: BuildingCreate,
                           building_service: Annotated[BuildingService, Depends(buildings_service)]):
     building_id = await building_service.add_building(building_in)
     return {"ok": True, "created_id": building_id}
 
 
-@buildings_router.delete('/{building_id}')
+@buildings_router.delete('/{building_id}', dependencies=[admission('write')])
+@query_budget(None)
 async def delete_building(building_id: int,
                           building_service: Annotated[BuildingService, Depends(buildings_service)]):
     await building_service.delete_building(building_id)
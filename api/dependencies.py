@@ -1,17 +1,76 @@
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Query, Request
+
 from services.activity_service import ActivityService
 from services.building_service import BuildingService
 from services.organization_service import OrganizationService
+from services.import_service import ImportService
+from schemas.organization_schemas import ORGANIZATION_RELATIONS
+from utils.unitofwork import UnitOfWork
+from utils.admission import Overloaded, admission_limiters
+from config import settings
 
 from database.models import Activity, Building, Organization
 
 
-def activities_service():
-    return ActivityService(Activity)
+# Методы, которые только читают: их запросы к БД можно отдать репликам
+READ_METHODS = {'GET', 'HEAD'}
+
+
+async def get_uow(request: Request):
+    # Пишущие запросы целиком работают с основной базой, включая проверки перед записью
+    uow = UnitOfWork.readonly() if request.method in READ_METHODS else UnitOfWork()
+    async with uow:
+        yield uow
+
+
+def activities_service(uow: Annotated[UnitOfWork, Depends(get_uow)]):
+    return ActivityService(Activity, uow)
+
+
+def buildings_service(uow: Annotated[UnitOfWork, Depends(get_uow)]):
+    return BuildingService(Building, uow)
+
+
+def organizations_service(uow: Annotated[UnitOfWork, Depends(get_uow)]):
+    return OrganizationService(Organization, uow)
+
+
+def imports_service(uow: Annotated[UnitOfWork, Depends(get_uow)]):
+    return ImportService(uow)
+
+
+def organization_include(include: Annotated[str | None, Query(
+        description="Связи через запятую: building, activities. Пустое значение - только id, name, phones")] = None):
+    if include is None:
+        return ORGANIZATION_RELATIONS
+    relations = {relation.strip() for relation in include.split(',') if relation.strip()}
+    unknown = relations - set(ORGANIZATION_RELATIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные связи в include: {unknown}")
+    return tuple(sorted(relations))
 
 
-def buildings_service():
-    return BuildingService(Building)
+def admission(route_class: str):
+    """
+    Зависимость маршрута: место в лимите класса route_class занимается до открытия сессии,
+    при перегрузке - сразу 503 с Retry-After. Указывается в dependencies=[...] декоратора маршрута.
+    """
+    limiter = admission_limiters[route_class]
 
+    async def admit():
+        if not settings.admission_enabled:
+            yield
+            return
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            raise HTTPException(status_code=503, detail=f"Сервис перегружен, повторите запрос позже ({e.reason})",
+                                headers={'Retry-After': str(e.retry_after)})
+        try:
+            yield
+        finally:
+            limiter.release()
 
-def organizations_service():
-    return OrganizationService(Organization)
\ No newline at end of file
+    return Depends(admit)
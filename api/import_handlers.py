@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends, Query, Request
+from typing import Annotated, Literal
+
+from services.import_service import ImportService
+from api.dependencies import imports_service, admission
+from utils.query_budget import query_budget
+
+import_router = APIRouter()
+
+
+@import_router.post('/{entity}', dependencies=[admission('bulk')])
+@query_budget(None)
+async def import_entities(entity: Literal['buildings', 'activities', 'organizations'],
+                          request: Request,
+                          import_service: Annotated[ImportService, Depends(imports_service)],
+                          format: Literal['ndjson', 'csv'] = 'ndjson',
+                          chunk_size: Annotated[int, Query(ge=1, le=10000)] = 1000):
+    # Тело читается потоком и пишется пачками по chunk_size строк, каждая пачка в своей транзакции
+    return await import_service.import_stream(entity, format, request.stream(), chunk_size)
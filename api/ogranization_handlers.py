@@ -1,125 +1,289 @@
-from fastapi import APIRouter, Depends, HTTPException
+import math
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
 from typing import Annotated, List
+from itertools import islice
 
-from schemas.organization_schemas import OrganizationCreate, OrganizationRead
-from services.organization_service import OrganizationService
+from schemas.organization_schemas import (OrganizationCreate, OrganizationRead, OrganizationBatchUpdate,
+                                          OrganizationClusters, OrganizationSparse, ORGANIZATION_RELATIONS,
+                                          ORGANIZATION_SCHEMAS)
+from services.organization_service import OrganizationService, ORGANIZATION_ADAPTERS
 from services.activity_service import ActivityService
 from services.building_service import BuildingService
-from api.dependencies import organizations_service, activities_service, buildings_service
+from api.dependencies import (organizations_service, activities_service, buildings_service, organization_include,
+                              admission)
+from utils.pagination import Limit, page_limit, ndjson_response, set_next_cursor, set_next_offset
+from utils.serialization import join_json, json_response, raw_json_response
+from utils.etag import etag_matches, make_etag, not_modified, set_etag
+from utils.query_budget import SELECTIN_CHUNK, query_budget
 
 organization_router = APIRouter()
 
+Include = Annotated[tuple[str, ...], Depends(organization_include)]
 
-@organization_router.get('/by_geo', response_model=List[OrganizationRead])
+
+def organization_response(organization) -> Response:
+    # Строка - готовый документ read-модели (полный include), словарь - урезанное представление
+    if isinstance(organization, str):
+        return raw_json_response(organization)
+    return json_response(organization)
+
+
+def organizations_response(organizations, include, adapter=None) -> Response:
+    if include == ORGANIZATION_RELATIONS:
+        return raw_json_response(join_json(
+            organization if isinstance(organization, str) else organization.document for organization in organizations))
+    return json_response(organizations, adapter)
+
+
+async def validate_references(organizations: list[OrganizationCreate],
+                              building_service: BuildingService,
+                              activity_service: ActivityService):
+    building_ids = {o.building_id for o in organizations}
+    buildings = await building_service.find_buildings_by_ids(list(building_ids))
+    missing_ids = building_ids - {b.id for b in buildings}
+    if missing_ids:
+        raise HTTPException(status_code=400, detail=f"Здание с таким id: {missing_ids} не найдено")
+
+    activity_ids = {activity_id for o in organizations for activity_id in o.activity_ids}
+    activities = await activity_service.find_activities_by_ids(list(activity_ids))
+    missing_ids = activity_ids - {a.id for a in activities}
+    if missing_ids:
+        raise HTTPException(status_code=400, detail=f"Активность с таким id: {missing_ids} не найдена")
+
+
+@organization_router.get('/by_geo', response_model=List[OrganizationSparse], response_model_exclude_unset=True,
+                         dependencies=[admission('expensive')])
+@query_budget(None)
 async def get_organizations_in_box(lat_min: float,
                                    lon_min: float,
                                    lat_max: float,
                                    lon_max: float,
                                    organization_service: Annotated[OrganizationService, Depends(organizations_service)],
-                                   building_service: Annotated[BuildingService, Depends(buildings_service)]):
-    
-    buildings = await building_service.find_buildings()
-    buildings_in_box = [
-        b for b in buildings
-        if lat_min <= b.coordinates['lat'] <= lat_max
-        and lon_min <= b.coordinates['lon'] <= lon_max
-    ]
-    if not buildings_in_box:
+                                   include: Include):
+    return organizations_response(
+        await organization_service.find_organizations_in_box(lat_min, lon_min, lat_max, lon_max, include), include)
+
+
+@organization_router.get('/clusters', response_model=OrganizationClusters, dependencies=[admission('lookup')])
+@query_budget(1)
+async def get_organization_clusters(lat_min: Annotated[float, Query(ge=-90, le=90)],
+                                    lon_min: Annotated[float, Query(ge=-180, le=180)],
+                                    lat_max: Annotated[float, Query(ge=-90, le=90)],
+                                    lon_max: Annotated[float, Query(ge=-180, le=180)],
+                                    zoom: Annotated[int, Query(ge=0, le=22, description="Масштаб веб-карты")],
+                                    organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
+    # Для мелких масштабов вместо /by_geo: число организаций и центр по ячейкам сетки
+    return json_response(await organization_service.find_clusters(lat_min, lon_min, lat_max, lon_max, zoom))
+
+
+@organization_router.get('/by_radius', response_model=List[OrganizationSparse], response_model_exclude_unset=True,
+                         dependencies=[admission('expensive')])
+@query_budget(None)
+async def get_organizations_in_radius(lat: float,
+                                      lon: float,
+                                      meters: Annotated[float, Query(gt=0)],
+                                      organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                      building_service: Annotated[BuildingService, Depends(buildings_service)],
+                                      include: Include):
+    buildings = await building_service.find_building_ids_in_radius(lat, lon, meters)
+    if not buildings:
         return []
 
-    building_ids = [b.id for b in buildings_in_box]
-    organizations = await organization_service.find_organizations_in_buildings(building_ids)
-    return organizations
+    distances = {building_id: distance for distance, building_id in buildings}
+    organizations = await organization_service.find_organizations_in_buildings(list(distances), include)
+    return organizations_response(sorted(organizations, key=lambda o: distances[o.building_id]), include,
+                                  ORGANIZATION_ADAPTERS[include])
+
+
+@organization_router.get('/nearest', response_model=List[OrganizationSparse], response_model_exclude_unset=True,
+                         dependencies=[admission('expensive')])
+@query_budget(64)
+async def get_nearest_organizations(lat: float,
+                                    lon: float,
+                                    organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                    building_service: Annotated[BuildingService, Depends(buildings_service)],
+                                    include: Include,
+                                    k: Annotated[int, Query(ge=1, le=100)] = 10):
+    nearest = await building_service.iter_nearest_buildings(lat, lon)
+    organizations = []
+    # Здания приходят по возрастанию расстояния, в зданиях может не быть организаций,
+    # поэтому добираем пачками, пока не наберётся k. Пачка растёт вдвое, чтобы число
+    # запросов было логарифмическим даже в районе, где почти нет организаций
+    batch_size = k
+    while len(organizations) < k:
+        batch = list(islice(nearest, batch_size))
+        if not batch:
+            break
+        batch_size *= 2
+        distances = {building_id: distance for distance, building_id in batch}
+        found = await organization_service.find_organizations_in_buildings(list(distances), include)
+        organizations.extend(sorted(found, key=lambda o: distances[o.building_id]))
+    return organizations_response(organizations[:k], include, ORGANIZATION_ADAPTERS[include])
 
 
-@organization_router.get('/get_all_organizations', response_model=List[OrganizationRead])
-async def get_all_organizations(organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
-    return await organization_service.find_organizations()
+@organization_router.get('/get_all_organizations', response_model=List[OrganizationSparse],
+                         response_model_exclude_unset=True, dependencies=[admission('expensive')])
+# Страница до 1000 строк: связи грузятся двумя пачками selectinload
+@query_budget(lambda after_id=None, limit=None, **_: 5 if page_limit(after_id, limit) else None)
+async def get_all_organizations(organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                include: Include,
+                                after_id: int | None = None,
+                                limit: Limit = None,
+                                stream: bool = False):
+    if stream:
+        return ndjson_response(organization_service.stream_organizations(after_id, include),
+                               ORGANIZATION_SCHEMAS[include])
 
+    limit = page_limit(after_id, limit)
+    organizations = await organization_service.find_organizations(after_id, limit, include)
+    response = organizations_response(organizations, include)
+    set_next_cursor(response, organizations, limit)
+    return response
 
-@organization_router.post('/create_organization')
+
+@organization_router.get('/batch', response_model=List[OrganizationSparse], response_model_exclude_unset=True,
+                         dependencies=[admission('lookup')])
+# До 1000 строк: связи грузятся двумя пачками selectinload
+@query_budget(5)
+async def get_organizations_batch(ids: Annotated[list[int], Query(min_length=1, max_length=1000)],
+                                  organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                  include: Include):
+    # Порядок как в ids, повторы и несуществующие id пропускаются
+    return organizations_response(await organization_service.find_organizations_by_ids(ids, include), include)
+
+
+@organization_router.get('/search', response_model=List[OrganizationSparse], response_model_exclude_unset=True,
+                         dependencies=[admission('expensive')])
+@query_budget(3)
+async def search_organizations(q: Annotated[str, Query(min_length=2, max_length=100, description="Часть названия, "
+                                                       "регистр и опечатки не важны")],
+                               organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                               include: Include,
+                               limit: Annotated[int, Query(ge=1, le=100)] = 20,
+                               offset: Annotated[int, Query(ge=0, le=10000)] = 0):
+    # Сначала самые похожие названия; следующая страница - со смещением из заголовка X-Next-Offset
+    organizations = await organization_service.search_organizations(' '.join(q.split()), limit, offset, include)
+    response = organizations_response(organizations, include)
+    set_next_offset(response, organizations, limit, offset)
+    return response
+
+
+@organization_router.post('/create_organization', dependencies=[admission('write')])
+@query_budget(14)
 async def create_organization(organization_in: OrganizationCreate,
                               organization_service: Annotated[OrganizationService, Depends(organizations_service)],
                               building_service: Annotated[BuildingService, Depends(buildings_service)],
                               activity_service: Annotated[ActivityService, Depends(activities_service)]):
     
-    building = await building_service.find_one_building(organization_in.building_id)
-    if not building:
-        raise HTTPException(status_code=400, detail=f"Здание с таким id: {organization_in.building_id} не найдено")
-
-    activities = await activity_service.find_activities_by_ids(organization_in.activity_ids)
-    found_ids = {a.id for a in activities}
-    missing_ids = set(organization_in.activity_ids) - found_ids
-    if missing_ids:
-        raise HTTPException(status_code=400, detail=f"Активность с таким id: {missing_ids} не найдена")
+    await validate_references([organization_in], building_service, activity_service)
 
     organization_id = await organization_service.add_organization_with_activities(organization_in)
     return {"ok": True, "created_id": organization_id}
 
 
-@organization_router.put('/update/{organization_id}', response_model=OrganizationRead)
+@organization_router.put('/update/{organization_id}', response_model=OrganizationRead,
+                         dependencies=[admission('write')])
+@query_budget(17)
 async def update_organization(organization_id: int,
                               organization_in: OrganizationCreate,
                               organization_service: Annotated[OrganizationService, Depends(organizations_service)],
                               building_service: Annotated[BuildingService, Depends(buildings_service)],
                               activity_service: Annotated[ActivityService, Depends(activities_service)]):
     
-    building = await building_service.find_one_building(organization_in.building_id)
-    if not building:
-        raise HTTPException(status_code=400, detail=f"Здание с таким id: {organization_in.building_id} не найдено")
-
-    activities = await activity_service.find_activities_by_ids(organization_in.activity_ids)
-    found_ids = {a.id for a in activities}
-    missing_ids = set(organization_in.activity_ids) - found_ids
-    if missing_ids:
-        raise HTTPException(status_code=400, detail=f"Активность с таким id: {missing_ids} не найдена")
+    await validate_references([organization_in], building_service, activity_service)
 
     updated_org = await organization_service.update_organization(organization_id, organization_in)
-    return updated_org
+    return raw_json_response(updated_org)
+
+
+@organization_router.put('/batch', dependencies=[admission('bulk')])
+# Проверки, запись каждой организации и пересборка документов пачками по SELECTIN_CHUNK
+@query_budget(lambda organizations_in, **_: 3 + 4 * len(organizations_in)
+              + 9 * math.ceil(len(organizations_in) / SELECTIN_CHUNK))
+async def update_organizations_batch(organizations_in: Annotated[list[OrganizationBatchUpdate], Body(min_length=1, max_length=1000)],
+                                     organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                     building_service: Annotated[BuildingService, Depends(buildings_service)],
+                                     activity_service: Annotated[ActivityService, Depends(activities_service)]):
+    ids = [o.id for o in organizations_in]
+    if len(ids) != len(set(ids)):
+        raise HTTPException(status_code=400, detail="В пакете есть повторяющиеся id организаций")
+
+    await validate_references(organizations_in, building_service, activity_service)
 
+    updated_ids = await organization_service.update_organizations(organizations_in)
+    return {"ok": True, "updated_ids": updated_ids}
 
-@organization_router.delete('/delete/{organization_id}')
+
+@organization_router.delete('/delete/{organization_id}', dependencies=[admission('write')])
+@query_budget(9)
 async def delete_organization(organization_id: int,
                               organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
     result = await organization_service.delete_organization(organization_id)
     return result
 
 
-@organization_router.get('/{organization_id}', response_model=OrganizationRead)
-async def get_organization_by_id(organization_id: int,
-                                 organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
-    org = await organization_service.find_one_organization(organization_id)
-    return org
+@organization_router.get('/{organization_id}', response_model=OrganizationSparse, response_model_exclude_unset=True,
+                         dependencies=[admission('lookup')])
+@query_budget(3)
+async def get_organization_by_id(request: Request,
+                                 organization_id: int,
+                                 organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                 include: Include):
+    # Версия - одна строка по первичному ключу; совпала с If-None-Match - документ не читается
+    version = await organization_service.find_organization_version(organization_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Организация с таким id: {organization_id} не найдена")
+    etag = make_etag('organization', organization_id, version, *include)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    org = await organization_service.find_one_organization(organization_id, include, version)
+    if org is None:
+        raise HTTPException(status_code=404, detail=f"Организация с таким id: {organization_id} не найдена")
+    return set_etag(organization_response(org), etag)
 
 
-@organization_router.get('/by_name/{name}', response_model=OrganizationRead)
+@organization_router.get('/by_name/{name}', response_model=OrganizationSparse, response_model_exclude_unset=True,
+                         dependencies=[admission('lookup')])
+@query_budget(3)
 async def get_organization_by_name(name: str,
-                                   organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
-    org = await organization_service.find_one_organization(name)
-    return org
+                                   organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                   include: Include):
+    org = await organization_service.find_one_organization(name, include)
+    if org is None:
+        raise HTTPException(status_code=404, detail=f"Организация с таким названием: {name} не найдена")
+    return organization_response(org)
 
 
-@organization_router.get('/by_activity_name/{activity_name}', response_model=List[OrganizationRead])
+@organization_router.get('/by_activity_name/{activity_name}', response_model=List[OrganizationSparse],
+                         response_model_exclude_unset=True, dependencies=[admission('expensive')])
+@query_budget(None)
 async def search_organizations_by_activity_tree(activity_name: str,
                                                 organization_service: Annotated[OrganizationService, Depends(organizations_service)],
-                                                activity_service: Annotated[ActivityService, Depends(activities_service)]):
+                                                activity_service: Annotated[ActivityService, Depends(activities_service)],
+                                                include: Include):
     activities = await activity_service.find_activities_by_name(activity_name)
     if not activities:
         return []
 
     activity_ids = [a.id for a in activities]
-    organizations = await organization_service.find_organizations_by_activity_ids(activity_ids)
-    return organizations
+    organizations = await organization_service.find_organizations_by_activity_ids(activity_ids, True, include)
+    return organizations_response(organizations, include)
 
 
-@organization_router.get('/by_activity_id/{activity_id}', response_model=List[OrganizationRead])
+@organization_router.get('/by_activity_id/{activity_id}', response_model=List[OrganizationSparse],
+                         response_model_exclude_unset=True, dependencies=[admission('expensive')])
+@query_budget(None)
 async def get_organizations_by_activity(activity_id: int,
-                                        organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
-    organizations = await organization_service.find_organizations_by_activity_ids([activity_id])
-    return organizations
+                                        organization_service: Annotated[OrganizationService, Depends(organizations_service)],
+                                        include: Include,
+                                        include_children: bool = False):
+    organizations = await organization_service.find_organizations_by_activity_ids([activity_id], include_children, include)
+    return organizations_response(organizations, include)
 
 
-@organization_router.get('/get_organizations_by_building/{building_id}')
+@organization_router.get('/get_organizations_by_building/{building_id}', dependencies=[admission('expensive')])
+@query_budget(1)
 async def get_organizations_by_building(building_id: int,
                                         organization_service: Annotated[OrganizationService, Depends(organizations_service)]):
     result = await organization_service.find_organizations_by_building_id(building_id)
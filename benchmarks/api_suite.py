@@ -0,0 +1,544 @@
+"""
+Нагрузочный прогон горячих эндпоинтов: приложение поднимается в этом же процессе (httpx.ASGITransport),
+база заполняется генератором данных, каждый сценарий гоняется с заданной конкуренцией.
+Для каждого сценария: пропускная способность, p50/p95/p99, запросов к БД на HTTP-запрос, пик памяти.
+
+    python -m benchmarks.api_suite --database-url sqlite+aiosqlite:////tmp/bench.db --profile small \\
+        --output results.json
+    python -m benchmarks.api_suite --skip-seed --baseline results.json --output current.json
+
+С --replica-urls GET-сценарии читают с реплик, данные туда доставляет репликация: генератор пишет
+только в основную базу (для SQLite - скопировать файл после заполнения и запускать с --skip-seed).
+
+Нужен httpx. С --baseline сравнивает результат с сохранённым и завершается с кодом 1 при регрессии.
+После сценариев, среди которых есть удаления, агрегаты карты и счётчики деятельностей сверяются
+с пересчётом (services.cluster_service, services.facet_service): расхождение - тоже код 1.
+Бюджеты запросов (utils.query_budget) проверяются в режиме raise: у каждого маршрута бюджет должен быть
+объявлен, полный прогон должен вызвать каждый маршрут (кроме NOT_EXERCISED), а превышение в любом
+сценарии тоже завершает прогон с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# Маршруты, которые прогон не вызывает: init_db пересоздаёт базу, а заполняет её прогон тем же generate()
+NOT_EXERCISED = {'POST /api/v1/init_db'}
+
+
+def build_scenarios(rnd: random.Random, organization_count: int, activity_names: list[str],
+                    building_count: int, activity_ids: list[int]):
+    """
+    Сценарий - функция, которая по номеру запроса возвращает (метод, url, тело): тело - JSON
+    или bytes для импорта. У сценариев удаления есть setup(client, count): до прогона он создаёт
+    через API столько записей, сколько сценарий удалит. max_concurrency ограничивает конкуренцию сценария.
+    """
+    from config import settings
+    from data_generator import CITIES, NAME_WORDS
+
+    def city_point():
+        _, lat, lon, spread, _ = rnd.choice(CITIES)
+        return rnd.gauss(lat, spread / 2), rnd.gauss(lon, spread)
+
+    def organization_body(name: str) -> dict:
+        return {
+            'name': name,
+            'phones': ['+70000000000'],
+            'building_id': rnd.randint(1, building_count),
+            'activity_ids': rnd.sample(activity_ids, min(2, len(activity_ids))),
+        }
+
+    async def create_all(client, url: str, bodies) -> list[int]:
+        ids = []
+        for body in bodies:
+            response = await client.post(url, json=body)
+            response.raise_for_status()
+            ids.append(response.json()['created_id'])
+        return ids
+
+    def by_geo(i):
+        lat, lon = city_point()
+        size = rnd.uniform(0.002, 0.02)
+        return 'GET', (f'/api/v1/organizations/by_geo?lat_min={lat - size}&lon_min={lon - size}'
+                       f'&lat_max={lat + size}&lon_max={lon + size}'), None
+
+    def by_radius(i):
+        lat, lon = city_point()
+        return 'GET', f'/api/v1/organizations/by_radius?lat={lat}&lon={lon}&meters={rnd.uniform(200, 2000)}', None
+
+    def nearest(i):
+        lat, lon = city_point()
+        return 'GET', f'/api/v1/organizations/nearest?lat={lat}&lon={lon}&k=10', None
+
+    def clusters(i):
+        # Карта города целиком, как её открывает пользователь
+        _, lat, lon, spread, _ = rnd.choice(CITIES)
+        zoom = rnd.randint(8, 12)
+        size = 180.0 / (1 << zoom) * 2
+        return 'GET', (f'/api/v1/organizations/clusters?lat_min={lat - size}&lon_min={lon - size * 2}'
+                       f'&lat_max={lat + size}&lon_max={lon + size * 2}&zoom={zoom}'), None
+
+    def by_activity_name(i):
+        return 'GET', f'/api/v1/organizations/by_activity_name/{rnd.choice(activity_names)}', None
+
+    def search(i):
+        word = rnd.choice(NAME_WORDS)
+        return 'GET', f'/api/v1/organizations/search?q={word[:rnd.randint(3, len(word))]}', None
+
+    def by_id(i):
+        return 'GET', f'/api/v1/organizations/{rnd.randint(1, organization_count)}', None
+
+    def organizations_batch(i):
+        ids = '&'.join(f'ids={rnd.randint(1, organization_count)}' for _ in range(20))
+        return 'GET', f'/api/v1/organizations/batch?{ids}', None
+
+    organization_names = []
+
+    def by_name(i):
+        return 'GET', f'/api/v1/organizations/by_name/{rnd.choice(organization_names)}', None
+
+    async def collect_names(client, count):
+        ids = '&'.join(f'ids={rnd.randint(1, organization_count)}' for _ in range(100))
+        response = await client.get(f'/api/v1/organizations/batch?{ids}')
+        organization_names.extend(organization['name'] for organization in response.json())
+
+    by_name.setup = collect_names
+
+    def by_activity_id(i):
+        return 'GET', f'/api/v1/organizations/by_activity_id/{rnd.choice(activity_ids)}', None
+
+    def by_building(i):
+        return 'GET', f'/api/v1/organizations/get_organizations_by_building/{rnd.randint(1, building_count)}', None
+
+    def all_organizations(i):
+        return 'GET', f'/api/v1/organizations/get_all_organizations?limit=100&after_id={rnd.randint(0, organization_count)}', None
+
+    def all_buildings(i):
+        return 'GET', f'/api/v1/buildings/get_all_buildings?limit=100&after_id={rnd.randint(0, building_count)}', None
+
+    def all_activities(i):
+        return 'GET', '/api/v1/activities/get_all_activities?limit=100', None
+
+    def activity_facets(i):
+        return 'GET', '/api/v1/activities/facets', None
+
+    def create_organization(i):
+        return 'POST', '/api/v1/organizations/create_organization', organization_body(f'Бенчмарк {i}')
+
+    def update_organization(i):
+        organization_id = rnd.randint(1, organization_count)
+        return 'PUT', f'/api/v1/organizations/update/{organization_id}', organization_body(f'Бенчмарк {organization_id}')
+
+    def update_organizations_batch(i):
+        ids = rnd.sample(range(1, organization_count + 1), min(20, organization_count))
+        return 'PUT', '/api/v1/organizations/batch', [
+            {'id': organization_id, **organization_body(f'Бенчмарк {organization_id}')} for organization_id in ids]
+
+    created_organizations = []
+
+    def delete_organization(i):
+        return 'DELETE', f'/api/v1/organizations/delete/{created_organizations.pop()}', None
+
+    async def create_organizations(client, count):
+        created_organizations.extend(await create_all(
+            client, '/api/v1/organizations/create_organization',
+            (organization_body(f'Бенчмарк удаление {i}') for i in range(count))))
+
+    delete_organization.setup = create_organizations
+
+    def create_activity(i):
+        return 'POST', '/api/v1/activities/create_activity', {'name': f'Бенчмарк {i}', 'parent_id': None}
+
+    # Переименование пересобирает документы всех организаций деятельности:
+    # переименовываются свои деятельности с несколькими организациями, а не самые массовые из данных
+    own_activities = []
+
+    def update_activity(i):
+        return 'PUT', f'/api/v1/activities/{rnd.choice(own_activities)}', {'name': f'Бенчмарк {i}'}
+
+    async def create_activities(client, count):
+        own_activities.extend(await create_all(
+            client, '/api/v1/activities/create_activity', ({'name': f'Бенчмарк {i}'} for i in range(10))))
+        await create_all(client, '/api/v1/organizations/create_organization', (
+            {**organization_body(f'Бенчмарк деятельность {i}'), 'activity_ids': [activity_id]}
+            for i, activity_id in enumerate(own_activities * 3)))
+
+    update_activity.setup = create_activities
+
+    created_activities = []
+
+    def delete_activity(i):
+        return 'DELETE', f'/api/v1/activities/{created_activities.pop()}', None
+
+    async def create_deleted_activities(client, count):
+        created_activities.extend(await create_all(
+            client, '/api/v1/activities/create_activity', ({'name': f'Бенчмарк удаление {i}'} for i in range(count))))
+
+    delete_activity.setup = create_deleted_activities
+
+    def building_body(i) -> dict:
+        lat, lon = city_point()
+        return {'address': f'Бенчмарк {i}', 'coordinates': {'lat': lat, 'lon': lon}}
+
+    def create_building(i):
+        return 'POST', '/api/v1/buildings/create_building', building_body(i)
+
+    created_buildings = []
+
+    def delete_building(i):
+        return 'DELETE', f'/api/v1/buildings/{created_buildings.pop()}', None
+
+    async def create_buildings(client, count):
+        created_buildings.extend(await create_all(
+            client, '/api/v1/buildings/create_building', (building_body(i) for i in range(count))))
+
+    delete_building.setup = create_buildings
+
+    def ndjson(rows) -> bytes:
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode()
+
+    def import_buildings(i):
+        return 'POST', '/api/v1/import/buildings', ndjson(building_body(i) for _ in range(20))
+
+    def import_activities(i):
+        return 'POST', '/api/v1/import/activities', ndjson({'name': f'Импорт {i}'} for _ in range(5))
+
+    def import_organizations(i):
+        return 'POST', '/api/v1/import/organizations', ndjson(organization_body(f'Импорт {i}') for _ in range(20))
+
+    def cache_stats(i):
+        return 'GET', '/api/v1/cache/stats', None
+
+    def singleflight_stats(i):
+        return 'GET', '/api/v1/singleflight/stats', None
+
+    def metrics(i):
+        return 'GET', '/metrics', None
+
+    def readiness(i):
+        return 'GET', '/api/v1/health/ready', None
+
+    # Пакетные маршруты пускает класс admission 'bulk': конкуренция выше его лимита - это 503, а не замер
+    bulk_concurrency = settings.admission_limits['bulk'][0]
+    for scenario in (update_organizations_batch, import_buildings, import_activities, import_organizations):
+        scenario.max_concurrency = bulk_concurrency
+
+    return {
+        'by_geo': by_geo,
+        'by_radius': by_radius,
+        'nearest': nearest,
+        'clusters': clusters,
+        'by_activity_name': by_activity_name,
+        'by_activity_id': by_activity_id,
+        'by_building': by_building,
+        'search': search,
+        'organization_by_id': by_id,
+        'organization_by_name': by_name,
+        'organizations_batch': organizations_batch,
+        'get_all_organizations': all_organizations,
+        'get_all_buildings': all_buildings,
+        'get_all_activities': all_activities,
+        'activity_facets': activity_facets,
+        'create_organization': create_organization,
+        'update_organization': update_organization,
+        'update_organizations_batch': update_organizations_batch,
+        'delete_organization': delete_organization,
+        'create_activity': create_activity,
+        'update_activity': update_activity,
+        'delete_activity': delete_activity,
+        'create_building': create_building,
+        'delete_building': delete_building,
+        'import_buildings': import_buildings,
+        'import_activities': import_activities,
+        'import_organizations': import_organizations,
+        'cache_stats': cache_stats,
+        'singleflight_stats': singleflight_stats,
+        'metrics': metrics,
+        'readiness': readiness,
+    }
+
+
+async def run_scenario(client, make_request, requests: int, concurrency: int, counter: QueryCounter,
+                       trace_memory: bool, requested: set) -> dict:
+    latencies = []
+    errors = 0
+    next_request = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in next_request:
+            method, url, body = make_request(i)
+            requested.add((method, url.split('?')[0]))
+            started = time.perf_counter()
+            if isinstance(body, bytes):
+                response = await client.request(method, url, content=body)
+            else:
+                response = await client.request(method, url, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    if trace_memory:
+        tracemalloc.start()
+    counter.count = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    peak_traced = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    latencies.sort()
+    result = {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries_per_request': round(counter.count / requests, 2),
+        # ru_maxrss в Linux - в килобайтах, пик за всё время процесса
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if peak_traced is not None:
+        result['peak_traced_mb'] = round(peak_traced / 2 ** 20, 2)
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    for key in ('dialect', 'replicas', 'profile', 'sizes', 'concurrency', 'cache'):
+        if current['meta'].get(key) != baseline.get('meta', {}).get(key):
+            print(f"warning: baseline differs in {key}: {baseline.get('meta', {}).get(key)} != {current['meta'].get(key)}")
+    regressions = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} rps")
+        # Небольшой разброс даёт кэш ответов; N+1 добавляет целые запросы
+        if result['queries_per_request'] > before['queries_per_request'] + 0.1:
+            regressions.append(f"{name}: queries/request {before['queries_per_request']} -> {result['queries_per_request']}")
+        if result['errors'] > before['errors']:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def missing_budgets(app) -> list[str]:
+    from fastapi.routing import APIRoute
+    return [f"{','.join(sorted(route.methods))} {route.path}" for route in app.routes
+            if isinstance(route, APIRoute) and not hasattr(route.endpoint, 'query_budget')]
+
+
+def unexercised_routes(app, requested: set) -> list[str]:
+    """Маршруты, бюджет которых прогон не проверил: ни один сценарий их не вызвал."""
+    from fastapi.routing import APIRoute
+    from starlette.routing import Match
+
+    routes = [route for route in app.routes if isinstance(route, APIRoute)]
+    exercised = set()
+    for method, path in requested:
+        # Первый подходящий маршрут, как при маршрутизации: /organizations/batch - не /{organization_id}
+        scope = {'type': 'http', 'method': method, 'path': path}
+        route = next((route for route in routes if route.matches(scope)[0] == Match.FULL), None)
+        if route is not None:
+            exercised.add(f'{method} {route.path}')
+    return [name for route in routes for name in (f'{method} {route.path}' for method in sorted(route.methods))
+            if name not in exercised and name not in NOT_EXERCISED]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    from data_generator import PROFILES, generate
+    from database.db import Base, engine, replica_engines
+    from services.cluster_service import check_clusters
+    from services.facet_service import check_facets
+    from utils.query_budget import query_budget_exceeded
+    import main
+
+    # Логирование каждого SQL-запроса искажает замеры
+    counter = QueryCounter()
+    for database in (engine, *replica_engines):
+        database.echo = False
+        event.listen(database.sync_engine, 'before_cursor_execute', counter)
+
+    if args.create_schema or engine.dialect.name == 'sqlite':
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    sizes = {**PROFILES[args.profile]}
+    if args.buildings:
+        sizes['buildings'] = args.buildings
+    if args.organizations:
+        sizes['organizations'] = args.organizations
+    if not args.skip_seed:
+        # На SQLite параллельные пачки только мешают друг другу
+        workers = 1 if engine.dialect.name == 'sqlite' else args.workers
+        report = await generate(args.profile, args.seed, workers, buildings=args.buildings,
+                                organizations=args.organizations)
+        print(f"seeded: {report}")
+
+    rnd = random.Random(args.seed)
+    results = {}
+    requested = set()
+    async with main.app.router.lifespan_context(main.app):
+        # Превышение бюджета в режиме raise - это 500, его надо посчитать, а не уронить прогон
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            activities = (await client.get('/api/v1/activities/get_all_activities?limit=1000')).json()
+            scenarios = build_scenarios(rnd, sizes['organizations'], [a['name'] for a in activities],
+                                        sizes['buildings'], [a['id'] for a in activities])
+            selected = args.scenarios or list(scenarios)
+
+            print(f"{'scenario':28} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6} {'err':>5}")
+            for name in selected:
+                concurrency = min(args.concurrency, getattr(scenarios[name], 'max_concurrency', args.concurrency))
+                warmup = min(args.requests, concurrency * 2)
+                setup = getattr(scenarios[name], 'setup', None)
+                if setup is not None:
+                    await setup(client, warmup + args.requests)
+                # Прогрев: первые запросы заполняют кэши и пул соединений
+                await run_scenario(client, scenarios[name], warmup, concurrency, counter, False, requested)
+                result = await run_scenario(client, scenarios[name], args.requests, concurrency, counter,
+                                            args.trace_memory, requested)
+                results[name] = result
+                print(f"{name:28} {result['throughput_rps']:9.1f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                      f"{result['p99_ms']:8.2f} {result['queries_per_request']:6.2f} {result['errors']:5}")
+
+        # Агрегаты ведутся приращениями при каждой записи, включая удаления: после прогона они
+        # должны совпасть с пересчётом по документам и связям
+        aggregates = {'clusters': await check_clusters(fix=False), 'facets': await check_facets(fix=False)}
+
+    for database in (engine, *replica_engines):
+        await database.dispose()
+    budget_violations = {name: int(count) for (name,), count in query_budget_exceeded.values.items()}
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'dialect': engine.dialect.name,
+            'replicas': len(replica_engines),
+            'profile': args.profile,
+            'sizes': sizes,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'cache': not args.no_cache,
+        },
+        'scenarios': results,
+        'aggregates': aggregates,
+        'budgets': {
+            'enforced': args.enforce_budgets,
+            'missing': missing_budgets(main.app),
+            # Выборочный прогон (--scenarios) и не должен покрывать все маршруты
+            'unexercised': unexercised_routes(main.app, requested) if not args.scenarios else [],
+            'violations': budget_violations,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', help='по умолчанию DATABASE_URL из окружения')
+    parser.add_argument('--replica-urls', help='по умолчанию DATABASE_REPLICA_URLS из окружения')
+    parser.add_argument('--create-schema', action='store_true', help='создать таблицы через metadata.create_all')
+    parser.add_argument('--profile', default='small')
+    parser.add_argument('--buildings', type=int)
+    parser.add_argument('--organizations', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--skip-seed', action='store_true', help='использовать уже заполненную базу')
+    parser.add_argument('--scenarios', nargs='*')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--no-cache', action='store_true', help='отключить кэш ответов')
+    parser.add_argument('--trace-memory', action='store_true', help='пик памяти по tracemalloc (медленнее)')
+    parser.add_argument('--output', help='куда сохранить результат в JSON')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое ухудшение p95 и rps')
+    parser.add_argument('--no-enforce-budgets', dest='enforce_budgets', action='store_false',
+                        help='не проверять бюджеты запросов')
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте приложения, поэтому окружение выставляется до него
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    if args.replica_urls is not None:
+        os.environ['DATABASE_REPLICA_URLS'] = args.replica_urls
+    if args.no_cache:
+        os.environ['CACHE_MAXSIZE'] = '0'
+    if args.enforce_budgets:
+        os.environ['QUERY_BUDGET_MODE'] = 'raise'
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    failed = False
+    for name, report in result['aggregates'].items():
+        if report['mismatched']:
+            print(f'AGGREGATES MISMATCH {name}: {report}')
+            failed = True
+    if args.enforce_budgets:
+        for route in result['budgets']['missing']:
+            print(f'NO BUDGET {route}')
+        for route in result['budgets']['unexercised']:
+            print(f'NOT EXERCISED {route}')
+        for name, count in result['budgets']['violations'].items():
+            print(f'BUDGET EXCEEDED {name}: {count} times')
+        failed = failed or bool(result['budgets']['missing'] or result['budgets']['unexercised']
+                                or result['budgets']['violations'])
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        failed = failed or bool(regressions)
+        if not regressions:
+            print('no regressions against baseline')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Задержка поиска организаций по названию (/organizations/search) для разных видов запросов:
+префикс, опечатка, слово из середины, номер. Кэш ответов не используется.
+
+    python -m benchmarks.search_bench --seed-profile large          # заполнить базу: 1 млн организаций
+    python -m benchmarks.search_bench --repeat 200 --concurrency 8 --explain
+
+На PostgreSQL нужен индекс из миграции 0005 (pg_trgm), без него каждый запрос - полный просмотр таблицы.
+На других базах поиск идёт подстрокой без индекса: цифры годятся только для сравнения между собой.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import text
+
+from data_generator import LEGAL_FORMS, NAME_WORDS, generate
+from database.db import engine
+from database.models import Organization
+from services.organization_service import OrganizationService
+from utils.unitofwork import UnitOfWork
+
+
+def typo(rnd: random.Random, word: str) -> str:
+    # Одна ошибка: пропущенная, лишняя или переставленная буква
+    i = rnd.randrange(1, len(word) - 1)
+    kind = rnd.choice(('drop', 'double', 'swap'))
+    if kind == 'drop':
+        return word[:i] + word[i + 1:]
+    if kind == 'double':
+        return word[:i] + word[i] + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def build_queries(rnd: random.Random, organization_count: int) -> dict[str, list[str]]:
+    words = [word for name in NAME_WORDS for word in name.split() if len(word) >= 4]
+    return {
+        'prefix': [word[:rnd.randint(3, len(word))] for word in rnd.choices(words, k=50)],
+        'prefix_lower': [word[:rnd.randint(3, len(word))].lower() for word in rnd.choices(words, k=50)],
+        'typo': [typo(rnd, word) for word in rnd.choices(words, k=50)],
+        'two_words': [f'{rnd.choice(LEGAL_FORMS)} {rnd.choice(words)}' for _ in range(50)],
+        'number': [f'№{rnd.randint(1, organization_count)}' for _ in range(50)],
+    }
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def measure(queries: list[str], repeat: int, concurrency: int, limit: int, include) -> dict:
+    timings = []
+    found = 0
+    pending = iter(range(repeat))
+
+    async def worker():
+        nonlocal found
+        for i in pending:
+            async with UnitOfWork() as uow:
+                service = OrganizationService(Organization, uow)
+                started = time.perf_counter()
+                # __wrapped__ - метод сервиса без кэша ответов
+                result = await OrganizationService.search_organizations.__wrapped__(
+                    service, queries[i % len(queries)], limit, 0, include)
+                timings.append((time.perf_counter() - started) * 1000)
+                found += bool(result)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        'rps': repeat / elapsed,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'hit_ratio': found / repeat,
+    }
+
+
+async def explain(query: str, limit: int):
+    async with engine.connect() as connection:
+        rows = await connection.execute(text(
+            "EXPLAIN (ANALYZE, BUFFERS) SELECT id FROM organizations WHERE :q <% name "
+            "ORDER BY :q <<-> name, id LIMIT :limit"), {'q': query, 'limit': limit})
+        print('\n'.join(row[0] for row in rows))
+
+
+async def run(args):
+    if args.seed_profile:
+        print(await generate(args.seed_profile, args.seed, args.workers, organizations=args.organizations))
+
+    async with engine.connect() as connection:
+        organization_count = (await connection.execute(text('SELECT count(*) FROM organizations'))).scalar_one()
+    print(f'{engine.dialect.name}, organizations: {organization_count}')
+
+    rnd = random.Random(args.seed)
+    include = tuple(args.include.split(',')) if args.include else ()
+    print(f"{'queries':14} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'found':>6}")
+    for name, queries in build_queries(rnd, max(organization_count, 1)).items():
+        result = await measure(queries, args.repeat, args.concurrency, args.limit, include)
+        print(f"{name:14} {result['rps']:8.1f} {result['p50']:8.2f} {result['p95']:8.2f} {result['p99']:8.2f} "
+              f"{result['hit_ratio']:6.0%}")
+        if args.explain and engine.dialect.name == 'postgresql':
+            await explain(queries[0], args.limit)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed-profile', help='перед замером заполнить базу генератором (small, medium, large, ...)')
+    parser.add_argument('--organizations', type=int)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--include', default='', help='связи в выдаче, по умолчанию только поля организации')
+    parser.add_argument('--explain', action='store_true', help='план первого запроса каждого вида (PostgreSQL)')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Стоимость сериализации одной организации: прежний путь через response_model FastAPI
+против TypeAdapter.dump_json / pydantic_core.to_json в сырой Response. Заодно проверяет,
+что байты ответа совпадают.
+
+    python -m benchmarks.serialization_bench --organizations 5000
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from schemas.organization_schemas import OrganizationSparse, ORGANIZATION_RELATIONS
+from services.organization_service import ORGANIZATION_ADAPTERS, dump_organizations
+from utils.serialization import json_response
+
+
+def make_organizations(count: int, seed: int):
+    rnd = random.Random(seed)
+    activities = [SimpleNamespace(id=i, name=f'Деятельность {i}', parent_id=None if i < 4 else i // 4, level=1 + (i >= 4))
+                  for i in range(1, 30)]
+    organizations = []
+    for organization_id in range(1, count + 1):
+        building = SimpleNamespace(id=organization_id, address=f'ул. Ленина, д.{organization_id}',
+                                   coordinates={'lat': round(rnd.uniform(54.6, 54.8), 6),
+                                                'lon': round(rnd.uniform(20.3, 20.7), 6)})
+        organizations.append(SimpleNamespace(
+            id=organization_id, name=f'Организация "{organization_id}"', phones=['+70001112233', '+70004445566'],
+            building_id=building.id, building=building, activities=rnd.sample(activities, 3)))
+    return organizations
+
+
+def measure(func, repeat: int, count: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat / count * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--organizations', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    organizations = make_organizations(args.organizations, args.seed)
+    cached = dump_organizations(organizations)
+    field = create_model_field('Response', List[OrganizationSparse], mode='serialization')
+
+    def fastapi_path(content):
+        # То, что делал FastAPI с response_model=List[OrganizationSparse] и exclude_unset
+        data = asyncio.run(serialize_response(field=field, response_content=content, exclude_unset=True))
+        return JSONResponse(data).body
+
+    adapter = ORGANIZATION_ADAPTERS[ORGANIZATION_RELATIONS]
+    paths = [
+        ('orm   response_model', lambda: fastapi_path(organizations)),
+        ('orm   TypeAdapter.dump_json', lambda: json_response(organizations, adapter).body),
+        ('cache response_model', lambda: fastapi_path(cached)),
+        ('cache to_json', lambda: json_response(cached).body),
+    ]
+
+    results = {}
+    for name, func in paths:
+        per_object_us, body = measure(func, args.repeat, args.organizations)
+        results[name] = body
+        print(f'{name:30} {per_object_us:8.2f} us/object')
+
+    assert results['orm   response_model'] == results['orm   TypeAdapter.dump_json']
+    assert results['cache response_model'] == results['cache to_json']
+    assert results['orm   response_model'] == results['cache to_json']
+    print('output identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Нагрузка на настоящий пул соединений (DATABASE_URL) при всплеске одинаковых чтений /organizations/by_geo,
+с single-flight и без него. Каждый запрос - своя единица работы, как в API: сначала версия зданий
+(обычное чтение в сессии запроса), затем документы организаций в прямоугольнике (склеиваемое чтение).
+Кэш ответов не используется. Считаются выдачи соединений из пула (событие checkout) и запросы к базе.
+
+    python -m benchmarks.singleflight_load --seed-profile small     # заполнить базу генератором
+    python -m benchmarks.singleflight_load --requests 500 --keys 5
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import event, select
+
+from data_generator import generate
+from database.db import AsyncSessionLocal, engine
+from database.models import Building, Organization
+from services.building_service import BuildingService
+from services.organization_service import OrganizationService
+from utils.singleflight import query_flight
+from utils.unitofwork import UnitOfWork
+
+
+class PoolCounter:
+    """Выдачи соединений из пула, одновременно занятые соединения и запросы к базе."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak = 0
+        self.queries = 0
+
+    def listen(self, sync_engine):
+        event.listen(sync_engine, 'checkout', self.checkout)
+        event.listen(sync_engine, 'checkin', self.checkin)
+        event.listen(sync_engine, 'before_cursor_execute', self.query)
+
+    def checkout(self, *args):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+
+    def checkin(self, *args):
+        self.in_use -= 1
+
+    def query(self, *args):
+        self.queries += 1
+
+
+async def load_boxes(rnd: random.Random, keys: int, size: float):
+    async with engine.connect() as connection:
+        rows = (await connection.execute(select(Building.lat, Building.lon).limit(1000))).all()
+    if not rows:
+        raise SystemExit('В базе нет зданий: заполните её, например --seed-profile small')
+    return [(lat - size, lon - size, lat + size, lon + size) for lat, lon in rnd.sample(rows, min(keys, len(rows)))]
+
+
+async def run(counter: PoolCounter, boxes, requests: int, spread_ms: float, coalesce: bool, seed: int):
+    rnd = random.Random(seed)
+    latencies = []
+
+    async def request(box, delay):
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        # Без single-flight - пишущая единица работы: её чтения не склеиваются с чужими
+        async with UnitOfWork(AsyncSessionLocal, read_only=coalesce) as uow:
+            await BuildingService(Building, uow).version()
+            # __wrapped__ - метод сервиса без кэша ответов
+            await OrganizationService.find_organizations_in_box.__wrapped__(
+                OrganizationService(Organization, uow), *box)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    counter.checkouts = counter.queries = counter.peak = 0
+    coalesced_before = query_flight.coalesced
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        request(rnd.choice(boxes), rnd.uniform(0, spread_ms / 1000))
+        for _ in range(requests)
+    ))
+    elapsed = (time.perf_counter() - started) * 1000
+    latencies.sort()
+    return {
+        'checkouts': counter.checkouts,
+        'queries': counter.queries,
+        'coalesced': query_flight.coalesced - coalesced_before,
+        'peak_connections': counter.peak,
+        'p50_ms': latencies[len(latencies) // 2],
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1],
+        'total_ms': elapsed,
+    }
+
+
+async def main_async(args):
+    if args.seed_profile:
+        print(await generate(args.seed_profile, args.seed, args.workers))
+
+    counter = PoolCounter()
+    counter.listen(engine.sync_engine)
+    boxes = await load_boxes(random.Random(args.seed), args.keys, args.box)
+    pool = engine.pool
+    print(f'{engine.dialect.name}, pool: {pool.__class__.__name__} {pool.status()}')
+
+    for coalesce in (False, True):
+        result = await run(counter, boxes, args.requests, args.spread_ms, coalesce, args.seed)
+        print(f"{'singleflight' if coalesce else 'baseline':12}  "
+              f"checkouts: {result['checkouts']:5} ({result['checkouts'] / args.requests:.2f}/req)  "
+              f"queries: {result['queries']:5}  coalesced: {result['coalesced']:5}  "
+              f"peak conn: {result['peak_connections']:3}  "
+              f"p50: {result['p50_ms']:7.1f} ms  p99: {result['p99_ms']:7.1f} ms  total: {result['total_ms']:7.1f} ms")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--keys', type=int, default=5, help='сколько разных прямоугольников запрашивают')
+    parser.add_argument('--box', type=float, default=0.01, help='полуширина прямоугольника в градусах')
+    parser.add_argument('--spread-ms', type=float, default=50.0, help='за какое время приходят все запросы')
+    parser.add_argument('--seed-profile', help='перед замером заполнить базу генератором (small, medium, ...)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Количество запросов и время выборок организаций для каждого набора include=.
+Кэш ответов не используется, данные берутся из базы по DATABASE_URL (заполните её заранее).
+
+    python -m benchmarks.sparse_fields_bench --limit 1000 --repeat 20
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from sqlalchemy import event
+
+from database.db import engine
+from database.models import Organization
+from schemas.organization_schemas import ORGANIZATION_RELATIONS
+from services.organization_service import OrganizationService
+from utils.unitofwork import UnitOfWork
+
+
+INCLUDES = [combination for size in range(len(ORGANIZATION_RELATIONS) + 1)
+            for combination in itertools.combinations(ORGANIZATION_RELATIONS, size)]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+async def measure(call, repeat: int, counter: QueryCounter):
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        counter.count = 0
+        async with UnitOfWork() as uow:
+            service = OrganizationService(Organization, uow)
+            started = time.perf_counter()
+            result = await call(service)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = counter.count
+    timings.sort()
+    return queries, timings[len(timings) // 2], len(result)
+
+
+async def run(limit: int, repeat: int, box):
+    counter = QueryCounter()
+    event.listen(engine.sync_engine, 'before_cursor_execute', counter)
+
+    # __wrapped__ - метод сервиса без кэша ответов
+    endpoints = {
+        'list': lambda include: lambda service: OrganizationService.find_organizations.__wrapped__(
+            service, None, limit, include),
+        'by_geo': lambda include: lambda service: OrganizationService.find_organizations_in_box.__wrapped__(
+            service, *box, include),
+    }
+    print(f"{'endpoint':10} {'include':22} {'queries':>7} {'p50 ms':>9} {'rows':>6}")
+    for name, make_call in endpoints.items():
+        for include in INCLUDES:
+            queries, p50, rows = await measure(make_call(include), repeat, counter)
+            print(f"{name:10} {','.join(include) or '-':22} {queries:7} {p50:9.2f} {rows:6}")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--box', type=float, nargs=4, default=(54.6, 20.3, 54.8, 20.7),
+                        metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'))
+    args = parser.parse_args()
+    asyncio.run(run(args.limit, args.repeat, args.box))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Сравнение сеточного индекса зданий с прежним перебором в get_organizations_in_box.
+
+    python -m benchmarks.spatial_index_bench --buildings 300000
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from utils.spatial_index import BuildingSpatialIndex, haversine_many
+
+
+def make_buildings(count: int, seed: int):
+    rnd = random.Random(seed)
+    buildings = []
+    for building_id in range(1, count + 1):
+        lat = rnd.gauss(54.71, 0.15)
+        lon = rnd.gauss(20.51, 0.25)
+        buildings.append(SimpleNamespace(id=building_id, coordinates={'lat': lat, 'lon': lon}))
+    return buildings
+
+
+def scan_box(buildings, lat_min, lon_min, lat_max, lon_max):
+    # Прежняя реализация: перебор всех зданий в Python
+    return [
+        b.id for b in buildings
+        if lat_min <= b.coordinates['lat'] <= lat_max
+        and lon_min <= b.coordinates['lon'] <= lon_max
+    ]
+
+
+def scan_radius(buildings, lat, lon, meters):
+    distances = haversine_many(lat, lon,
+                               [b.coordinates['lat'] for b in buildings],
+                               [b.coordinates['lon'] for b in buildings])
+    return sorted((d, b.id) for d, b in zip(distances, buildings) if d <= meters)
+
+
+def measure(func, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buildings', type=int, default=300_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    buildings = make_buildings(args.buildings, args.seed)
+    index = BuildingSpatialIndex()
+    started = time.perf_counter()
+    index.load((b.id, b.coordinates['lat'], b.coordinates['lon']) for b in buildings)
+    print(f'index build: {(time.perf_counter() - started) * 1000:.1f} ms for {len(index)} buildings')
+
+    box = (54.70, 20.50, 54.72, 20.53)
+    scan_ms, scan_ids = measure(lambda: scan_box(buildings, *box), args.repeat)
+    index_ms, index_ids = measure(lambda: index.query_box(*box), args.repeat)
+    assert sorted(scan_ids) == sorted(index_ids)
+    print(f'bbox   scan: {scan_ms:8.2f} ms  index: {index_ms:8.3f} ms  ({len(index_ids)} buildings)')
+
+    point = (54.71, 20.51, 1000.0)
+    scan_ms, scan_res = measure(lambda: scan_radius(buildings, *point), max(1, args.repeat // 5))
+    index_ms, index_res = measure(lambda: index.query_radius(*point), args.repeat)
+    assert [i for _, i in scan_res] == [i for _, i in index_res]
+    print(f'radius scan: {scan_ms:8.2f} ms  index: {index_ms:8.3f} ms  ({len(index_res)} buildings)')
+
+    nearest_ms, _ = measure(lambda: list(zip(range(10), index.iter_nearest(54.71, 20.51))), args.repeat)
+    print(f'nearest k=10 index: {nearest_ms:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
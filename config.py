@@ -0,0 +1,66 @@
+from typing import Literal
+
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+# .env подгружается в окружение целиком: из него же читают alembic и docker compose
+load_dotenv()
+
+
+class Settings(BaseSettings):
+    """Настройки приложения из переменных окружения (имена без учёта регистра)."""
+
+    model_config = SettingsConfigDict(extra='ignore')
+
+    database_url: str
+    # Реплики только для чтения через запятую; пусто - всё идёт в основную базу
+    database_replica_urls: str = ''
+    # round_robin - по очереди, least_load - реплика с наименьшим числом выданных соединений
+    database_replica_policy: Literal['round_robin', 'least_load'] = 'round_robin'
+    # Сколько секунд после записи чтения того же клиента идут в основную базу, пока реплики её догоняют
+    database_replica_max_lag: float = 1.0
+    # Логирование каждого SQL-запроса - только для отладки, для наблюдения есть /metrics
+    sql_echo: bool = False
+
+    # Пул соединений, одинаковый для основной базы и реплик
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # Сколько секунд ждать свободное соединение, прежде чем запрос упадёт с ошибкой
+    db_pool_timeout: float = 30
+    # Соединения старше этого числа секунд переоткрываются: их рвут балансировщики и pgbouncer
+    db_pool_recycle: int = 1800
+    # Проверка соединения перед выдачей из пула: один лишний round-trip против ошибки на мёртвом соединении
+    db_pool_pre_ping: bool = True
+    # Сколько соединений открыть при старте; None - pool_size
+    db_pool_prewarm: int | None = None
+
+    cache_backend: Literal['memory', 'redis'] = 'memory'
+    cache_url: str = 'redis://localhost:6379/0'
+    cache_maxsize: int = 10000
+    cache_ttl: float = 30
+
+    admission_enabled: bool = True
+    # Класс маршрутов -> (одновременно, мест в очереди, секунд ожидания в очереди); из окружения - JSON.
+    # Дорогие выборки и пакетные записи ограничены отдельно, чтобы не вытеснять поиск по id
+    admission_limits: dict[str, tuple[int, int, float]] = {
+        'lookup': (32, 128, 1.0),
+        'expensive': (8, 32, 2.0),
+        'write': (8, 32, 2.0),
+        'bulk': (2, 2, 5.0),
+    }
+
+    # raise - в тестах и разработке: превышение бюджета - ошибка со списком запросов;
+    # warn - в проде: предупреждение в лог и метрика; off - запросы не считаются
+    query_budget_mode: Literal['raise', 'warn', 'off'] = 'warn'
+
+    @property
+    def replica_urls(self) -> list[str]:
+        return [url.strip() for url in self.database_replica_urls.split(',') if url.strip()]
+
+    @property
+    def pool_prewarm(self) -> int:
+        prewarm = self.db_pool_size if self.db_pool_prewarm is None else self.db_pool_prewarm
+        return min(prewarm, self.db_pool_size + self.db_max_overflow)
+
+
+settings = Settings()
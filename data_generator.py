@@ -0,0 +1,230 @@
+"""
+Генератор синтетических данных для нагрузочных проверок вместо трёх строк из seed.py.
+
+    python -m data_generator --profile medium
+    python -m data_generator --buildings 400000 --organizations 2000000 --workers 8 --seed 7
+
+Одинаковый seed и одинаковые размеры дают одинаковые данные: у каждой пачки свой генератор
+случайных чисел, поэтому результат не зависит от того, в каком порядке пачки допишутся в базу.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from database.models import Activity, Building, Organization, OrganizationActivity
+from seed import clear_tables, finish_load, reset_caches
+from services.cluster_service import GeoClusterService
+from services.facet_service import ActivityFacetService
+from services.document_service import OrganizationDocumentService
+from utils import geohash
+from utils.repository import SQLAlchemyRepository
+from utils.unitofwork import UnitOfWork
+
+
+PROFILES = {
+    'small': {'buildings': 2_000, 'organizations': 10_000, 'root_activities': 10},
+    'medium': {'buildings': 50_000, 'organizations': 250_000, 'root_activities': 20},
+    'large': {'buildings': 300_000, 'organizations': 1_000_000, 'root_activities': 30},
+    'xlarge': {'buildings': 1_000_000, 'organizations': 5_000_000, 'root_activities': 40},
+}
+
+# Название, центр, разброс в градусах, доля зданий
+CITIES = [
+    ('Москва', 55.7558, 37.6173, 0.12, 30),
+    ('Санкт-Петербург', 59.9343, 30.3351, 0.09, 15),
+    ('Новосибирск', 55.0084, 82.9357, 0.07, 6),
+    ('Екатеринбург', 56.8389, 60.6057, 0.06, 6),
+    ('Казань', 55.7963, 49.1088, 0.06, 5),
+    ('Нижний Новгород', 56.3269, 44.0059, 0.06, 5),
+    ('Краснодар', 45.0355, 38.9753, 0.05, 4),
+    ('Самара', 53.1959, 50.1002, 0.05, 4),
+    ('Калининград', 54.7104, 20.4522, 0.05, 3),
+    ('Владивосток', 43.1155, 131.8855, 0.04, 2),
+]
+DISTRICTS_PER_CITY = 12
+
+STREETS = ['ул. Ленина', 'ул. Пушкина', 'ул. Гагарина', 'пр. Мира', 'ул. Советская', 'ул. Садовая',
+           'ул. Молодёжная', 'ул. Школьная', 'ул. Лесная', 'ул. Центральная', 'ул. Победы', 'наб. Набережная']
+
+ROOT_ACTIVITIES = ['Еда', 'Автомобили', 'IT Services', 'Consulting', 'Marketing', 'Finance', 'Медицина',
+                   'Образование', 'Строительство', 'Логистика', 'Красота', 'Спорт', 'Туризм', 'Недвижимость',
+                   'Юридические услуги', 'Производство', 'Сельское хозяйство', 'Развлечения', 'Торговля', 'Связь']
+
+LEGAL_FORMS = ['ООО', 'АО', 'ИП', 'ПАО', 'НКО']
+NAME_WORDS = ['Рога и копыта', 'Вектор', 'Альфа', 'Меридиан', 'Гранит', 'Северный ветер', 'Солнечный',
+              'Технопарк', 'Восход', 'Прогресс', 'Лидер', 'Орион', 'Балтика', 'Сфера', 'Импульс']
+
+
+def batch_random(seed: int, entity: str, batch_no: int) -> random.Random:
+    return random.Random(f'{seed}:{entity}:{batch_no}')
+
+
+def make_districts(seed: int):
+    rnd = batch_random(seed, 'districts', 0)
+    districts = []
+    for _, lat, lon, spread, weight in CITIES:
+        for _ in range(DISTRICTS_PER_CITY):
+            # Районы тяготеют к центру, здания - к центру своего района
+            districts.append((rnd.gauss(lat, spread / 2), rnd.gauss(lon, spread), spread / 6,
+                              weight / DISTRICTS_PER_CITY))
+    cum_weights = list(itertools.accumulate(weight for *_, weight in districts))
+    return districts, cum_weights
+
+
+def make_activities(seed: int, root_count: int) -> list[tuple]:
+    """Дерево до 3 уровней с перекошенным числом потомков: (id, name, parent_id, level)."""
+    rnd = batch_random(seed, 'activities', 0)
+    rows = []
+    next_id = itertools.count(1)
+    roots = []
+    for i in range(root_count):
+        name = ROOT_ACTIVITIES[i % len(ROOT_ACTIVITIES)]
+        if i >= len(ROOT_ACTIVITIES):
+            name = f'{name} {i // len(ROOT_ACTIVITIES) + 1}'
+        roots.append((next(next_id), name))
+        rows.append((roots[-1][0], name, None, 1))
+
+    # Родители идут раньше детей, чтобы внешний ключ parent_id был выполнен внутри одной пачки
+    parents = roots
+    for level, cap in ((2, 15), (3, 8)):
+        children = []
+        for parent_id, parent_name in parents:
+            for k in range(min(cap, int(rnd.paretovariate(1.2)))):
+                activity_id = next(next_id)
+                name = f'{parent_name}: направление {k + 1}'
+                rows.append((activity_id, name, parent_id, level))
+                children.append((activity_id, name))
+        parents = children
+    return rows
+
+
+def make_activity_weights(seed: int, activity_ids: list[int]) -> list[float]:
+    # Закон Ципфа по случайной перестановке: немногие деятельности есть у большинства организаций
+    rnd = batch_random(seed, 'activity_weights', 0)
+    ranks = list(range(1, len(activity_ids) + 1))
+    rnd.shuffle(ranks)
+    return list(itertools.accumulate(1.0 / rank for rank in ranks))
+
+
+def make_buildings(rnd: random.Random, start_id: int, count: int, districts, district_weights) -> list[tuple]:
+    rows = []
+    for building_id in range(start_id, start_id + count):
+        lat, lon, spread, _ = rnd.choices(districts, cum_weights=district_weights)[0]
+        lat = round(rnd.gauss(lat, spread), 6)
+        lon = round(rnd.gauss(lon, spread * 1.7), 6)
+        address = f'{rnd.choice(STREETS)}, д.{rnd.randint(1, 250)}'
+        rows.append((building_id, address, {'lat': lat, 'lon': lon}, lat, lon, geohash.encode(lat, lon)))
+    return rows
+
+
+def make_organizations(rnd: random.Random, start_id: int, count: int, building_count: int,
+                       activity_ids: list[int], activity_weights: list[float]) -> tuple[list[tuple], list[tuple]]:
+    organizations = []
+    relations = []
+    for organization_id in range(start_id, start_id + count):
+        # Квадрат равномерного распределения: часть зданий - бизнес-центры с десятками организаций
+        building_id = 1 + int(building_count * rnd.random() ** 2)
+        phones = [f'+7{rnd.randrange(9_000_000_000, 10_000_000_000)}' for _ in range(rnd.choice((1, 1, 1, 2, 3)))]
+        name = f'{rnd.choice(LEGAL_FORMS)} «{rnd.choice(NAME_WORDS)}» №{organization_id}'
+        organizations.append((organization_id, name, phones, building_id))
+
+        k = rnd.choices((1, 2, 3, 4), weights=(50, 30, 15, 5))[0]
+        for activity_id in set(rnd.choices(activity_ids, cum_weights=activity_weights, k=k)):
+            relations.append((organization_id, activity_id))
+    return organizations, relations
+
+
+async def load_in_batches(total: int, batch_size: int, workers: int, write_batch):
+    """Каждая пачка - своя единица работы и своё соединение; одновременно не больше workers пачек."""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(batch_no: int, start_id: int):
+        async with semaphore:
+            async with UnitOfWork() as uow:
+                await write_batch(uow, batch_no, start_id, min(batch_size, total - start_id + 1))
+                await uow.commit()
+
+    await asyncio.gather(*(run(batch_no, start_id)
+                           for batch_no, start_id in enumerate(range(1, total + 1, batch_size))))
+
+
+async def generate(profile: str = 'small', seed: int = 42, workers: int = 4, batch_size: int = 10_000,
+                   **overrides) -> dict:
+    sizes = {**PROFILES[profile], **{key: value for key, value in overrides.items() if value is not None}}
+    started = time.perf_counter()
+    report = {'profile': profile, 'seed': seed, **sizes}
+
+    activities = make_activities(seed, sizes['root_activities'])
+    async with UnitOfWork() as uow:
+        await clear_tables(uow)
+        await SQLAlchemyRepository(Activity, uow).copy_rows(Activity, ['id', 'name', 'parent_id', 'level'], activities)
+        await uow.commit()
+    report['activities'] = len(activities)
+
+    districts, district_weights = make_districts(seed)
+
+    async def write_buildings(uow, batch_no, start_id, count):
+        rows = make_buildings(batch_random(seed, 'buildings', batch_no), start_id, count, districts, district_weights)
+        await SQLAlchemyRepository(Building, uow).copy_rows(
+            Building, ['id', 'address', 'coordinates', 'lat', 'lon', 'geohash'], rows)
+
+    await load_in_batches(sizes['buildings'], batch_size, workers, write_buildings)
+
+    activity_ids = [row[0] for row in activities]
+    activity_weights = make_activity_weights(seed, activity_ids)
+    relation_count = 0
+
+    async def write_organizations(uow, batch_no, start_id, count):
+        nonlocal relation_count
+        organizations, relations = make_organizations(batch_random(seed, 'organizations', batch_no), start_id, count,
+                                                      sizes['buildings'], activity_ids, activity_weights)
+        repository = SQLAlchemyRepository(Organization, uow)
+        await repository.copy_rows(Organization, ['id', 'name', 'phones', 'building_id'], organizations)
+        await repository.copy_rows(OrganizationActivity, ['organization_id', 'activity_id'], relations)
+        relation_count += len(relations)
+
+    await load_in_batches(sizes['organizations'], batch_size, workers, write_organizations)
+    report['organization_activities'] = relation_count
+
+    async def write_documents(uow, batch_no, start_id, count):
+        await OrganizationDocumentService(uow).refresh(range(start_id, start_id + count), bulk=True)
+
+    # Документы read-модели собираются теми же параллельными пачками, когда здания и связи уже записаны.
+    # Агрегаты карты и счётчики деятельностей - одним пересчётом в конце:
+    # иначе все пачки ждали бы друг друга на крупных ячейках и корневых деятельностях
+    await load_in_batches(sizes['organizations'], batch_size, workers, write_documents)
+
+    async with UnitOfWork() as uow:
+        await finish_load(uow)
+        await GeoClusterService(uow).rebuild()
+        await ActivityFacetService(uow).rebuild()
+        await uow.commit()
+    await reset_caches()
+
+    elapsed = time.perf_counter() - started
+    report['elapsed_sec'] = round(elapsed, 3)
+    report['rows_per_sec'] = round((sizes['buildings'] + sizes['organizations'] + relation_count) / elapsed, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=4, help='параллельных пачек, не больше размера пула')
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--buildings', type=int)
+    parser.add_argument('--organizations', type=int)
+    parser.add_argument('--root-activities', type=int)
+    args = parser.parse_args()
+
+    report = asyncio.run(generate(args.profile, args.seed, args.workers, args.batch_size,
+                                  buildings=args.buildings, organizations=args.organizations,
+                                  root_activities=args.root_activities))
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,40 @@
 from typing import AsyncGenerator
-import os
+import asyncio
+import itertools
+import math
+import time
+from contextvars import ContextVar
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.pool import NullPool
 from sqlalchemy import text
-from dotenv import load_dotenv
 from contextlib import asynccontextmanager
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
 
-load_dotenv()
+from config import settings
+from utils.metrics import TimedQueuePool
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = settings.database_url
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True, # Показывает в логах все SQL-запросы
-    future=True,
-    pool_size=5,
-    max_overflow=10,
-)
+
+def make_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=settings.sql_echo,
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+
+
+engine = make_engine(DATABASE_URL)
+# У каждой реплики свой пул: чтения не занимают соединения основной базы
+replica_engines = [make_engine(url) for url in settings.replica_urls]
 
 class Base(DeclarativeBase):
     pass
@@ -25,9 +42,123 @@ class Base(DeclarativeBase):
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     class_=AsyncSession,
+    expire_on_commit=False,
 )
 
+
+class ClientWrite:
+    """Когда клиент текущего запроса последний раз писал (по часам сервера) и писал ли в этом запросе."""
+    __slots__ = ('at', 'wrote')
+
+    def __init__(self, at: float = float("-inf")):
+        self.at = at
+        self.wrote = False
+
+
+client_write: ContextVar[ClientWrite | None] = ContextVar('client_write', default=None)
+
+
+class ReplicaRouter:
+    """
+    Выбирает базу для читающей сессии. Без реплик и сразу после записи того же клиента
+    отдаёт сессию основной базы, чтобы только что записанное не читалось с отстающей реплики.
+    Чужие записи на выбор не влияют: остальные клиенты продолжают читать с реплик.
+    """
+
+    def __init__(self, engines, policy: str = "round_robin", max_lag: float = 1.0):
+        self.engines = engines
+        self.policy = policy
+        self.max_lag = max_lag
+        self.sessionmakers = [
+            async_sessionmaker(bind=replica, class_=AsyncSession, expire_on_commit=False) for replica in engines
+        ]
+        self._counter = itertools.count()
+
+    def mark_write(self):
+        # Время стенных часов, а не monotonic: оно уходит клиенту и возвращается в другой процесс
+        state = client_write.get()
+        if state is not None:
+            state.at = time.time()
+            state.wrote = True
+
+    def _choose(self) -> int:
+        if self.policy == "least_load":
+            return min(range(len(self.engines)), key=lambda i: self.engines[i].sync_engine.pool.checkedout())
+        return next(self._counter) % len(self.engines)
+
+    def choose(self) -> async_sessionmaker:
+        state = client_write.get()
+        if not self.engines or (state is not None and time.time() - state.at < self.max_lag):
+            return AsyncSessionLocal
+        return self.sessionmakers[self._choose()]
+
+    def session(self) -> AsyncSession:
+        return self.choose()()
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI-middleware: время последней записи клиента ходит в cookie.
+    Чтения клиента в течение max_lag после его записи идут в основную базу, в каком бы процессе они ни выполнялись.
+    """
+    COOKIE = 'last_write'
+
+    def __init__(self, app, router: ReplicaRouter | None = None):
+        self.app = app
+        self.router = router or replica_router
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.router.engines:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            at = float(HTTPConnection(scope).cookies.get(self.COOKIE, ''))
+        except ValueError:
+            at = float("-inf")
+        # Время из будущего не продлевает чтение с основной базы дольше max_lag
+        state = ClientWrite(min(at, time.time()) if math.isfinite(at) else float("-inf"))
+        token = client_write.set(state)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and state.wrote:
+                MutableHeaders(scope=message).append(
+                    'set-cookie',
+                    f'{self.COOKIE}={state.at:.3f}; Max-Age={math.ceil(self.router.max_lag)}; Path=/; '
+                    f'HttpOnly; SameSite=Lax')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            client_write.reset(token)
+
+
+replica_router = ReplicaRouter(replica_engines, settings.database_replica_policy, settings.database_replica_max_lag)
+
+# Фабрика сессий только для чтения: реплика, если она есть и клиент недавно не писал
+ReadSessionLocal = replica_router.session
+
+
 @asynccontextmanager
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with AsyncSessionLocal() as session:
+async def get_session(readonly: bool = False) -> AsyncGenerator[AsyncSession, None]:
+    session_factory = ReadSessionLocal if readonly else AsyncSessionLocal
+    async with session_factory() as session:
         yield session
+
+
+async def prewarm_pool(database, connections: int, warm=None):
+    """
+    Открывает connections соединений сразу, а не по первым запросам, и прогоняет на каждом warm(session_factory):
+    у asyncpg кэш подготовленных запросов свой у каждого соединения.
+    """
+    held = await asyncio.gather(*(database.connect() for _ in range(connections)))
+    try:
+        for connection in held:
+            await connection.execute(text("SELECT 1"))
+            if warm is not None:
+                await warm(async_sessionmaker(bind=connection, class_=AsyncSession, expire_on_commit=False))
+            await connection.rollback()
+    finally:
+        for connection in held:
+            await connection.close()
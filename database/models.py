@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import ForeignKey, String, Integer, Text, JSON
+from sqlalchemy import ForeignKey, String, Integer, BigInteger, Text, JSON, Float, Index, Sequence
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from database.db import Base
 
@@ -11,6 +11,11 @@ class Building(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     address: Mapped[str] = mapped_column(Text, nullable=False)
     coordinates: Mapped[str] = mapped_column(JSON, nullable=False)
+    # Копия координат из JSON в обычных колонках, чтобы поиск по прямоугольнику шёл по индексу
+    lat: Mapped[float] = mapped_column(Float, nullable=False)
+    lon: Mapped[float] = mapped_column(Float, nullable=False)
+    # Ячейка сетки (utils.geohash): по её префиксам считаются агрегаты для карты
+    geohash: Mapped[str] = mapped_column(String(12), nullable=False, index=True)
 
     organizations: Mapped[list["Organization"]] = relationship(
         "Organization",
@@ -18,6 +23,10 @@ class Building(Base):
         cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        Index("ix_buildings_lat_lon", "lat", "lon"),
+    )
+
 
 class Activity(Base):
     __tablename__ = "activities"
@@ -51,7 +60,13 @@ class Organization(Base):
     name: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     phones: Mapped[list[str]] = mapped_column(JSON, nullable=True)
 
-    building_id: Mapped[int] = mapped_column(ForeignKey("buildings.id"), nullable=False)
+    building_id: Mapped[int] = mapped_column(ForeignKey("buildings.id"), nullable=False, index=True)
+    # Версия документа организации: растёт при каждой его пересборке, из неё строится ETag.
+    # В PostgreSQL это следующее значение общей последовательности (миграция 0010): TRUNCATE и перезаливка
+    # её не сбрасывают, и пересозданная организация с тем же id не получит уже выданную версию.
+    # Отложенная: читается только запросом версии и не попадает в ответы, собранные из модели
+    version: Mapped[int] = mapped_column(BigInteger, Sequence('organization_version_seq'), nullable=False,
+                                         server_default="1", deferred=True)
 
     building: Mapped["Building"] = relationship(
         "Building",
@@ -63,6 +78,12 @@ class Organization(Base):
         back_populates="organizations"
     )
 
+    __table_args__ = (
+        # Триграммный GiST-индекс (pg_trgm): нечёткий поиск по названию с сортировкой по близости прямо из индекса
+        Index("ix_organizations_name_trgm", "name", postgresql_using="gist",
+              postgresql_ops={"name": "gist_trgm_ops"}),
+    )
+
 
 class OrganizationActivity(Base):
     __tablename__ = "organization_activities"
@@ -73,5 +94,66 @@ class OrganizationActivity(Base):
     )
     activity_id: Mapped[int] = mapped_column(
         ForeignKey("activities.id"),
+        primary_key=True,
+        index=True
+    )
+
+
+# Все пары предок-потомок дерева деятельностей, включая саму деятельность (depth = 0)
+class ActivityClosure(Base):
+    __tablename__ = "activity_closure"
+
+    ancestor_id: Mapped[int] = mapped_column(
+        ForeignKey("activities.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    descendant_id: Mapped[int] = mapped_column(
+        ForeignKey("activities.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True
+    )
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+# Счётчики версий сущностей: растут при каждой записи, по ним процессы узнают об устаревших кэшах
+class EntityVersion(Base):
+    __tablename__ = "entity_versions"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+# Read-модель: готовый JSON организации (OrganizationRead) со зданием и деятельностями.
+# Пересобирается сервисами при записи, читается одной строкой или одним диапазоном индекса
+class OrganizationDocument(Base):
+    __tablename__ = "organization_documents"
+
+    organization_id: Mapped[int] = mapped_column(
+        ForeignKey("organizations.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    building_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    document: Mapped[str] = mapped_column(Text, nullable=False)
+
+
+# Сколько организаций под каждой деятельностью вместе с потомками (каждая организация - один раз).
+# Ведётся вместе с документами read-модели; сверка и пересчёт - python -m services.facet_service
+class ActivityFacet(Base):
+    __tablename__ = "activity_facets"
+
+    activity_id: Mapped[int] = mapped_column(
+        ForeignKey("activities.id", ondelete="CASCADE"),
         primary_key=True
     )
+    organizations: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+# Агрегаты для карты: число организаций и суммы координат их зданий в ячейке geohash длины precision.
+# Центр кластера - lat_sum / organizations; ведутся вместе с документами read-модели
+class GeoCluster(Base):
+    __tablename__ = "geo_clusters"
+
+    precision: Mapped[int] = mapped_column(Integer, primary_key=True)
+    cell: Mapped[str] = mapped_column(String(12), primary_key=True)
+    organizations: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    lat_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    lon_sum: Mapped[float] = mapped_column(Float, nullable=False, default=0)
@@ -1,27 +1,139 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse
+from sqlalchemy import text
 
 from api.ogranization_handlers import organization_router
 from api.activity_handlers import activity_router
 from api.buildings_handlers import buildings_router
+from api.import_handlers import import_router
+from api.dependencies import admission
 
+from services.activity_service import ActivityService
+from services.building_service import BuildingService
+from config import settings
+from database.db import ReadYourWritesMiddleware, engine, replica_engines, prewarm_pool
+from database.models import (Activity, ActivityClosure, ActivityFacet, Building, EntityVersion, GeoCluster,
+                             Organization, OrganizationActivity, OrganizationDocument)
+from utils.repository import (SQLAlchemyClusterRepository, SQLAlchemyDocumentRepository, SQLAlchemyFacetRepository,
+                              SQLAlchemyOrganizationRepository, SQLAlchemyRepository, SQLAlchemyVersionRepository)
+from utils.unitofwork import UnitOfWork
+from utils.cache import response_cache
+from utils.singleflight import query_flight
+from utils import metrics
+from utils.query_budget import query_budget, instrument_engine as instrument_query_budget
 from seed import seed_data
+from data_generator import PROFILES, generate
+
+
+async def warm_hot_queries(session_factory):
+    # Те же запросы, что у горячих маршрутов: в кэш подготовленных запросов попадает текст SQL целиком.
+    # Полный include читается из read-модели, карта и фасеты - из своих агрегатов
+    async with UnitOfWork(session_factory) as uow:
+        documents = SQLAlchemyDocumentRepository(OrganizationDocument, uow)
+        buildings = SQLAlchemyRepository(Building, uow)
+        for after_id in (None, 0):
+            await documents.find_documents(after_id, 100)
+            await buildings.find_all(after_id, 100)
+        await documents.find_documents_by_ids([1])
+        await documents.find_documents_by_building_ids([1])
+        await documents.find_documents_by_activity_ids([1], OrganizationActivity, ActivityClosure)
+        await documents.find_documents_in_box(Building, 0, 0, 0, 0)
+        await documents.find_document_by_name(Organization, '')
+        await documents.search_documents(Organization, 'prewarm', 20)
+        await SQLAlchemyOrganizationRepository(Organization, uow).find_version(1)
+        await SQLAlchemyVersionRepository(EntityVersion, uow).get_version(BuildingService.VERSION_NAME)
+        await SQLAlchemyClusterRepository(GeoCluster, uow).find_clusters(1, ['u'])
+        await SQLAlchemyFacetRepository(ActivityFacet, uow).find_facets()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    # Дерево деятельностей читается один раз при старте, дальше обслуживается из памяти
+    async with UnitOfWork() as uow:
+        await ActivityService(Activity, uow).activity_tree()
+    # Соединения открываются до первого запроса, а не за его счёт
+    for database in (engine, *replica_engines):
+        await prewarm_pool(database, settings.pool_prewarm, warm_hot_queries)
+    app.state.ready = True
+    yield
 
 
 app = FastAPI(
     openapi_url="/api/v1/moon/openapi.json",
-    docs_url="/api/v1/moon/docs"
+    docs_url="/api/v1/moon/docs",
+    lifespan=lifespan
 )
 
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.instrument_engine(engine)
+instrument_query_budget(engine)
+for number, replica in enumerate(replica_engines):
+    metrics.instrument_engine(replica, f'replica{number}')
+    instrument_query_budget(replica)
+metrics.CollectedCounter('response_cache_hits_total', 'Попадания в кэш ответов', lambda: {(): response_cache.hits})
+metrics.CollectedCounter('response_cache_misses_total', 'Промахи кэша ответов', lambda: {(): response_cache.misses})
+metrics.CollectedCounter('singleflight_executed_total', 'Запросов к БД, выполненных single-flight',
+                         lambda: {(): query_flight.executed})
+metrics.CollectedCounter('singleflight_coalesced_total', 'Чтений, дождавшихся чужого запроса',
+                         lambda: {(): query_flight.coalesced})
+
 app.include_router(organization_router, prefix='/api/v1/organizations', tags=['organizations'])
 app.include_router(activity_router, prefix='/api/v1/activities', tags=['activities'])
 app.include_router(buildings_router, prefix='/api/v1/buildings', tags=['buildings'])
+app.include_router(import_router, prefix='/api/v1/import', tags=['import'])
 
 
-@app.post("/api/v1/init_db")
-async def init_db():
+@app.post("/api/v1/init_db", dependencies=[admission('bulk')])
+@query_budget(None)
+async def init_db(profile: Literal['demo', *PROFILES] = 'demo', seed: int = 42):
+    # demo - три организации из seed.py, остальные профили заполняет генератор синтетических данных
     try:
-        await seed_data()
-        return {"ok": True, "message": "База данных успешно созданна!"}
+        if profile == 'demo':
+            await seed_data()
+            return {"ok": True, "message": "База данных успешно созданна!"}
+        report = await generate(profile, seed)
+        return {"ok": True, "message": "База данных успешно созданна!", "report": report}
     except Exception as e:
-        return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
+
+
+@app.get("/api/v1/cache/stats")
+@query_budget(0)
+async def cache_stats():
+    return response_cache.stats()
+
+
+@app.get("/api/v1/singleflight/stats")
+@query_budget(0)
+async def singleflight_stats():
+    return query_flight.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+@query_budget(0)
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/v1/health/ready")
+@query_budget(lambda request: 1 + len(replica_engines))
+async def readiness(request: Request):
+    # Воркер готов, когда пулы прогреты и каждая база отвечает
+    ready = request.app.state.ready
+    databases = {}
+    for name, database in (('primary', engine), *((f'replica{i}', r) for i, r in enumerate(replica_engines))):
+        try:
+            async with database.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+            databases[name] = 'ok'
+        except Exception as e:
+            databases[name] = str(e)
+            ready = False
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"ready": ready, "databases": databases, "pools": metrics.pool_stats()})
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 class ActivityCreate(BaseModel):
     name: str
@@ -15,9 +15,11 @@ class ActivityRead(BaseModel):
     parent_id: int | None
     level: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ActivityUpdate(BaseModel):
-    name: str
\ No newline at end of file
+    name: str
+
+class ActivityFacet(ActivityRead):
+    organizations: int = Field(..., description="Организаций с этой деятельностью или её потомками")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 class Coordinates(BaseModel):
     lat: float = Field(..., description="Широта")
@@ -23,5 +23,4 @@ class BuildingRead(BaseModel):
     address: str
     coordinates: Coordinates
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
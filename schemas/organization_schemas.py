@@ -1,7 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from schemas.activity_schemas import ActivityRead
 from schemas.buildings_schemas import BuildingRead
 
+# Связи, которые можно запросить через include=
+ORGANIZATION_RELATIONS = ('activities', 'building')
+
+
 class OrganizationCreate(BaseModel):
     name: str
     phones: list[str] | None
@@ -9,12 +13,53 @@ class OrganizationCreate(BaseModel):
     activity_ids: list[int]
 
 
-class OrganizationRead(BaseModel):
+class OrganizationBatchUpdate(OrganizationCreate):
+    id: int
+
+
+class OrganizationShort(BaseModel):
     id: int
     name: str
     phones: list[str] | None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrganizationWithBuilding(OrganizationShort):
     building: BuildingRead
+
+
+class OrganizationWithActivities(OrganizationShort):
     activities: list[ActivityRead]
 
-    class Config:
-        orm_mode = True
+
+class OrganizationRead(OrganizationShort):
+    building: BuildingRead
+    activities: list[ActivityRead]
+
+
+class OrganizationSparse(OrganizationShort):
+    """Модель ответа для эндпоинтов с include=: незапрошенных связей в ответе нет."""
+    building: BuildingRead | None = None
+    activities: list[ActivityRead] | None = None
+
+
+ORGANIZATION_SCHEMAS: dict[tuple[str, ...], type[OrganizationShort]] = {
+    (): OrganizationShort,
+    ('building',): OrganizationWithBuilding,
+    ('activities',): OrganizationWithActivities,
+    ('activities', 'building'): OrganizationRead,
+}
+
+
+class OrganizationCluster(BaseModel):
+    geohash: str
+    count: int
+    lat: float
+    lon: float
+
+
+class OrganizationClusters(BaseModel):
+    """Организации на карте, сгруппированные по ячейкам geohash длины precision; lat/lon - центр кластера."""
+    precision: int
+    clusters: list[OrganizationCluster]
@@ -1,18 +1,58 @@
 import asyncio
 from sqlalchemy import text
-from database.db import get_session
-from database.models import Building, Activity, Organization, OrganizationActivity
+from database.models import Building, Activity, ActivityClosure, EntityVersion, Organization, OrganizationActivity
+from utils.repository import SQLAlchemyRepository, SQLAlchemyActivityRepository, SQLAlchemyVersionRepository
+from utils.unitofwork import UnitOfWork
+from utils.activity_tree import activity_tree
+from utils.spatial_index import building_index
+from utils.cache import response_cache
+from services.cluster_service import GeoClusterService
+from services.facet_service import ActivityFacetService
+from services.document_service import OrganizationDocumentService
+from utils import geohash
+
+
+async def clear_tables(uow):
+    session = uow.session
+    if session.bind.dialect.name == 'postgresql':
+        await session.execute(text(
+            "TRUNCATE activity_facets, geo_clusters, organization_documents, organization_activities, activity_closure, "
+            "organizations, activities, buildings;"))
+        return
+    await session.execute(text("DELETE FROM activity_facets;"))
+    await session.execute(text("DELETE FROM geo_clusters;"))
+    await session.execute(text("DELETE FROM organization_documents;"))
+    await session.execute(text("DELETE FROM organization_activities;"))
+    await session.execute(text("DELETE FROM activity_closure;"))
+    await session.execute(text("DELETE FROM organizations;"))
+    await session.execute(text("DELETE FROM activities;"))
+    await session.execute(text("DELETE FROM buildings;"))
+
+
+async def finish_load(uow):
+    """Общий хвост после заливки данных с явными id: замыкание, счётчики id, версии деревьев и зданий."""
+    await SQLAlchemyActivityRepository(Activity, uow).rebuild_closure(ActivityClosure)
+    for model in (Building, Activity, Organization):
+        await SQLAlchemyRepository(model, uow).reset_id_sequence()
+    versions_repository = SQLAlchemyVersionRepository(EntityVersion, uow)
+    await versions_repository.bump('activities')
+    await versions_repository.bump('buildings')
+
+
+async def reset_caches():
+    activity_tree.invalidate()
+    building_index.invalidate()
+    await response_cache.clear()
+
 
 async def seed_data():
-    async with get_session() as session:
-        await session.execute(text("DELETE FROM organization_activities;"))
-        await session.execute(text("DELETE FROM organizations;"))
-        await session.execute(text("DELETE FROM activities;"))
-        await session.execute(text("DELETE FROM buildings;"))
-
-        building1 = Building(id=1, address="ул. Ленина, д.1", coordinates={"lat": 54.7104, "lon": 20.5110})
-        building2 = Building(id=2, address="ул. Пушкина, д.5", coordinates={"lat": 54.7200, "lon": 20.5200})
-        building3 = Building(id=3, address="ул. Гагарина, д.10", coordinates={"lat": 54.7300, "lon": 20.5300})
+    async with UnitOfWork() as uow:
+        session = uow.session
+        await clear_tables(uow)
+
+        building1 = Building(id=1, address="ул. Ленина, д.1", coordinates={"lat": 54.7104, "lon": 20.5110}, lat=54.7104, lon=20.5110, geohash=geohash.encode(54.7104, 20.5110))
+        building2 = Building(id=2, address="ул. Пушкина, д.5", coordinates={"lat": 54.7200, "lon": 20.5200}, lat=54.7200, lon=20.5200, geohash=geohash.encode(54.7200, 20.5200))
+        building3 = Building(id=3, address="ул. Гагарина, д.10", coordinates={"lat": 54.7300, "lon": 20.5300}, lat=54.7300, lon=20.5300, geohash=geohash.encode(54.7300, 20.5300))
         session.add_all([building1, building2, building3])
 
         activity1 = Activity(id=1, name="IT Services", level=1)
@@ -28,8 +68,15 @@ async def seed_data():
         org2 = Organization(id=2, name="Орг2", phones=["+70004445566"], building=building2, activities=[activity2])
         org3 = Organization(id=3, name="Орг3", phones=["+70007778899"], building=building3, activities=[activity4, activity5, activity6])
         session.add_all([org1, org2, org3])
+        await session.flush()
+
+        await finish_load(uow)
+        await OrganizationDocumentService(uow).rebuild()
+        await GeoClusterService(uow).rebuild()
+        await ActivityFacetService(uow).rebuild()
+        await uow.commit()
 
-        await session.commit()
+    await reset_caches()
 
 if __name__ == "__main__":
     asyncio.run(seed_data())
@@ -1,22 +1,39 @@
 from fastapi import HTTPException
 
 from schemas.activity_schemas import ActivityCreate, ActivityUpdate
-from utils.repository import SQLAlchemyRepository
+from utils.repository import SQLAlchemyActivityRepository, SQLAlchemyFacetRepository, SQLAlchemyVersionRepository
+from utils.activity_tree import ActivityNode, activity_tree
+from utils.cache import response_cache
+from utils.query_budget import query_budget
+from services.document_service import OrganizationDocumentService
+from services.organization_service import ORGANIZATION_BY_ID, ORGANIZATION_COLLECTIONS, ORGANIZATION_FACETS
+from database.models import (ActivityClosure, ActivityFacet, Building, EntityVersion, OrganizationActivity,
+                             OrganizationDocument)
 
 class ActivityService:
-    def __init__(self, model):
-        self.activities_repository = SQLAlchemyRepository(model)
+    VERSION_NAME = 'activities'
+
+    def __init__(self, model, uow):
+        self.uow = uow
+        self.activities_repository = SQLAlchemyActivityRepository(model, uow)
+        self.versions_repository = SQLAlchemyVersionRepository(EntityVersion, uow)
+        self.documents = OrganizationDocumentService(uow)
+        self.facets_repository = SQLAlchemyFacetRepository(ActivityFacet, uow)
+
+    @query_budget(2)
+    async def activity_tree(self):
+        return await activity_tree.ensure_fresh(
+            lambda: self.versions_repository.get_version(self.VERSION_NAME),
+            lambda: self.activities_repository.find_columns('id', 'name', 'parent_id', 'level'))
     
-    async def find_activities(self):
-        activities_all = await self.activities_repository.find_all()
-        return activities_all
+    async def find_activities(self, after_id: int | None = None, limit: int | None = None):
+        tree = await self.activity_tree()
+        activities = [a for a in tree.all() if after_id is None or a.id > after_id]
+        return activities[:limit] if limit is not None else activities
 
     async def find_one_activity(self, filter):
-        obj = {}
-        obj['filter_key'] = 'id'
-        obj['filter_value'] = filter
-        activity = await self.activities_repository.find_one_with_filter(obj)
-        return activity
+        tree = await self.activity_tree()
+        return tree.get(filter)
     
     async def add_activity(self, activity: ActivityCreate) -> int:
         level = 1
@@ -31,33 +48,81 @@ class ActivityService:
         activity_dict = activity.model_dump()
         activity_dict['level'] = level
         activity_id = await self.activities_repository.add_one(activity_dict)
+        await self.activities_repository.add_closure(ActivityClosure, activity_id, activity.parent_id)
+
+        version = await self.versions_repository.bump(self.VERSION_NAME)
+        await self.uow.commit()
+        activity_tree.put(ActivityNode(activity_id, activity.name, activity.parent_id, level), version)
         return activity_id
 
     async def update_activity(self, activity_id: int, activity: ActivityUpdate) -> int:
         try:
-            return await self.activities_repository.update_one(activity_id, activity.model_dump())
+            updated_id = await self.activities_repository.update_one(activity_id, activity.model_dump())
         except ValueError as e:
             raise HTTPException(status_code=404, detail=str(e))
+
+        # Деятельности встроены в документы и ответы по организациям
+        await self.documents.refresh(await self.documents.organization_ids_by_activity(activity_id))
+        version = await self.versions_repository.bump(self.VERSION_NAME)
+        await self.uow.commit()
+        await response_cache.invalidate_namespace(ORGANIZATION_BY_ID, *ORGANIZATION_COLLECTIONS)
+        node = activity_tree.get(activity_id)
+        if node is not None:
+            activity_tree.put(ActivityNode(activity_id, activity.name, node.parent_id, node.level), version)
+        else:
+            activity_tree.invalidate()
+        return updated_id
     
     async def delete_activity(self, activity_id: int):
+        tree = await self.activity_tree()
+        if tree.children_ids(activity_id):
+            raise HTTPException(status_code=400, detail=f"У деятельности с id {activity_id} есть дочерние деятельности")
+
+        # organization_activities.activity_id без ON DELETE: деятельность организаций удалить нельзя
+        if await self.documents.organization_ids_by_activity(activity_id):
+            raise HTTPException(status_code=400, detail=f"У деятельности с id {activity_id} есть организации")
+
+        # Строки activity_closure удаляются каскадом по внешнему ключу
         try:
             await self.activities_repository.delete_one(activity_id)
         except ValueError as e:
             raise HTTPException(status_code=404, detail=str(e))
+
+        version = await self.versions_repository.bump(self.VERSION_NAME)
+        await self.uow.commit()
+        activity_tree.remove(activity_id, version)
         
+    @response_cache.cached(ORGANIZATION_FACETS, None)
+    @query_budget(3)
+    async def find_facets(self, lat_min: float | None = None, lon_min: float | None = None,
+                          lat_max: float | None = None, lon_max: float | None = None) -> list[dict]:
+        box = (lat_min, lon_min, lat_max, lon_max)
+        if any(value is None for value in box) and any(value is not None for value in box):
+            raise HTTPException(status_code=400, detail="Прямоугольник задаётся всеми четырьмя координатами")
+
+        tree = await self.activity_tree()
+        if lat_min is None:
+            rows = await self.facets_repository.find_facets()
+        else:
+            rows = await self.facets_repository.find_facets_in_box(
+                OrganizationActivity, ActivityClosure, OrganizationDocument, Building, *box)
+        return [
+            {'id': node.id, 'name': node.name, 'parent_id': node.parent_id, 'level': node.level,
+             'organizations': organizations}
+            for activity_id, organizations in rows
+            if (node := tree.get(activity_id)) is not None
+        ]
+
     async def find_activities_by_name(self, filter):
-        obj = {}
-        obj['filter_key'] = 'name'
-        obj['filter_value'] = filter
-        activities = await self.activities_repository.find_all_with_filter(obj)
-        return activities
+        tree = await self.activity_tree()
+        return tree.find_by_name(filter)
 
     async def find_activities_by_ids(self, ids: list[int]):
         if not ids:
             return []
-        activities = await self.activities_repository.find_all_with_filter_in(
-            column_name="id",
-            values=set(ids),
-            table=self.activities_repository.model
-        )
-        return activities
\ No newline at end of file
+        tree = await self.activity_tree()
+        return tree.find_by_ids(set(ids))
+
+    async def find_descendant_ids(self, activity_ids: list[int]) -> set[int]:
+        tree = await self.activity_tree()
+        return tree.descendant_ids(activity_ids)
@@ -1,16 +1,39 @@
 from fastapi import HTTPException
 
-from schemas.buildings_schemas import BuildingCreate
-from utils.repository import SQLAlchemyRepository
+from schemas.buildings_schemas import BuildingCreate, BuildingRead
+from utils.repository import SQLAlchemyRepository, SQLAlchemyVersionRepository
+from utils.cache import response_cache
+from utils.spatial_index import building_index
+from utils import geohash
+from utils.query_budget import query_budget
+from services.document_service import OrganizationDocumentService
+from database.models import EntityVersion
+
+BUILDING_LIST = 'buildings:list'
+
 
 class BuildingService:
-    def __init__(self, model):
-        self.buildings_repository = SQLAlchemyRepository(model)
+    VERSION_NAME = 'buildings'
+
+    def __init__(self, model, uow):
+        self.uow = uow
+        self.buildings_repository = SQLAlchemyRepository(model, uow)
+        self.versions_repository = SQLAlchemyVersionRepository(EntityVersion, uow)
+
+    @query_budget(1)
+    async def version(self) -> int:
+        # Одна строка по первичному ключу, сколько бы ни было зданий
+        return await self.versions_repository.get_version(self.VERSION_NAME)
     
-    async def find_buildings(self):
-        buildings_all = await self.buildings_repository.find_all()
+    @response_cache.cached(BUILDING_LIST, list[BuildingRead])
+    async def find_buildings(self, after_id: int | None = None, limit: int | None = None, version: int | None = None):
+        # version - только часть ключа кэша: список, закэшированный до записи, не отдадут под новым ETag
+        buildings_all = await self.buildings_repository.find_all(after_id, limit)
         return buildings_all
 
+    def stream_buildings(self, after_id: int | None = None):
+        return self.buildings_repository.stream_all(after_id)
+
     async def find_one_building(self, filter):
         obj = {}
         obj['filter_key'] = 'id'
@@ -18,13 +41,54 @@ class BuildingService:
         building = await self.buildings_repository.find_one_with_filter(obj)
         return building
     
+    async def find_buildings_by_ids(self, ids: list[int]):
+        if not ids:
+            return []
+        return await self.buildings_repository.find_all_with_filter_in(
+            column_name="id",
+            values=set(ids),
+            table=self.buildings_repository.model
+        )
+
     async def add_building(self, building: BuildingCreate) -> int:
         building_dict = building.model_dump()
+        building_dict['lat'] = building.coordinates.lat
+        building_dict['lon'] = building.coordinates.lon
+        building_dict['geohash'] = geohash.encode(building.coordinates.lat, building.coordinates.lon)
         building_id = await self.buildings_repository.add_one(building_dict)
+        version = await self.versions_repository.bump(self.VERSION_NAME)
+        await self.uow.commit()
+        await response_cache.invalidate_namespace(BUILDING_LIST)
+        building_index.put(building_id, building.coordinates.lat, building.coordinates.lon, version)
         return building_id
     
     async def delete_building(self, building_id: int):
+        # organizations.building_id без ON DELETE: здание с организациями удалить нельзя
+        if await OrganizationDocumentService(self.uow).organization_ids_by_building(building_id):
+            raise HTTPException(status_code=400, detail=f"В здании с id {building_id} есть организации")
         try:
             await self.buildings_repository.delete_one(building_id)
         except ValueError as e:
-            raise HTTPException(status_code=404, detail=str(e))
\ No newline at end of file
+            raise HTTPException(status_code=404, detail=str(e))
+        version = await self.versions_repository.bump(self.VERSION_NAME)
+        await self.uow.commit()
+        await response_cache.invalidate_namespace(BUILDING_LIST)
+        building_index.discard(building_id, version)
+
+    @query_budget(2)
+    async def spatial_index(self):
+        return await building_index.ensure_fresh(
+            lambda: self.versions_repository.get_version(self.VERSION_NAME),
+            lambda: self.buildings_repository.find_columns('id', 'lat', 'lon'))
+
+    async def find_building_ids_in_box(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float):
+        index = await self.spatial_index()
+        return index.query_box(lat_min, lon_min, lat_max, lon_max)
+
+    async def find_building_ids_in_radius(self, lat: float, lon: float, meters: float):
+        index = await self.spatial_index()
+        return index.query_radius(lat, lon, meters)
+
+    async def iter_nearest_buildings(self, lat: float, lon: float):
+        index = await self.spatial_index()
+        return index.iter_nearest(lat, lon)
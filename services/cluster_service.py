@@ -0,0 +1,136 @@
+"""
+Агрегаты для карты: сколько организаций в ячейке geohash и где их центр, для длин 1..CLUSTER_PRECISION.
+Ведутся вместе с документами read-модели: каждая пересборка документов сдвигает счётчики ячеек
+на разницу между старыми и новыми зданиями организаций.
+
+Сверка с пересчётом по документам (расхождения исправляются, --check - только отчёт):
+
+    python -m services.cluster_service
+    python -m services.cluster_service --check
+"""
+import argparse
+import asyncio
+import math
+import sys
+
+from utils import geohash
+from utils.repository import SQLAlchemyClusterRepository
+from utils.unitofwork import UnitOfWork
+from utils.cache import response_cache
+from database.models import Building, GeoCluster, OrganizationDocument
+
+# Ячейка не уже 1/CELLS_PER_TILE тайла карты (256 px): кластер занимает от 32 px
+CELLS_PER_TILE = 8
+# Столько ячеек ответ перебирает самое большее; на большом экране с крупным zoom точность понижается
+MAX_CELLS = 2048
+
+
+def cluster_precision(zoom: int, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> int:
+    """Длина geohash для zoom веб-карты, не больше MAX_CELLS ячеек на прямоугольник."""
+    tile_width = 360.0 / (1 << zoom)
+    precision = 1
+    while (precision < geohash.CLUSTER_PRECISION
+           and geohash.cell_size(precision + 1)[1] >= tile_width / CELLS_PER_TILE):
+        precision += 1
+    while precision > 1 and geohash.count_cells_in_box(lat_min, lon_min, lat_max, lon_max, precision) > MAX_CELLS:
+        precision -= 1
+    return precision
+
+
+def building_changes(old_documents: list[dict], organizations) -> dict[int, list]:
+    """
+    Разница между старыми документами и новыми организациями по зданиям:
+    building_id -> [lat, lon, geohash, приращение числа организаций].
+    Удалённого здания в базе уже может не быть, его координаты берутся из старого документа.
+    """
+    changes = {}
+    for organization in organizations:
+        building = organization.building
+        if building is None:
+            continue
+        item = changes.setdefault(building.id, [building.lat, building.lon, building.geohash, 0])
+        item[3] += 1
+    for document in old_documents:
+        building = document['building']
+        item = changes.get(building['id'])
+        if item is None:
+            lat, lon = building['coordinates']['lat'], building['coordinates']['lon']
+            item = changes[building['id']] = [lat, lon, geohash.encode(lat, lon), 0]
+        item[3] -= 1
+    return changes
+
+
+class GeoClusterService:
+    def __init__(self, uow):
+        self.uow = uow
+        self.clusters_repository = SQLAlchemyClusterRepository(GeoCluster, uow)
+
+    async def apply(self, changes: dict[int, list]):
+        deltas = {}
+        for lat, lon, cell, delta in changes.values():
+            if not delta:
+                continue
+            for precision in range(1, geohash.CLUSTER_PRECISION + 1):
+                item = deltas.setdefault((precision, cell[:precision]), [0, 0.0, 0.0])
+                item[0] += delta
+                item[1] += lat * delta
+                item[2] += lon * delta
+        # Ячейки по порядку ключа: параллельные транзакции блокируют строки в одном порядке и не ждут друг друга по кругу
+        await self.clusters_repository.add_deltas([
+            {'precision': precision, 'cell': cell, 'organizations': count, 'lat_sum': lat_sum, 'lon_sum': lon_sum}
+            for (precision, cell), (count, lat_sum, lon_sum) in sorted(deltas.items())
+        ])
+
+    async def check(self, fix: bool = True) -> dict:
+        """Сравнивает агрегаты с пересчётом по документам; при fix=True пересчитывает их заново."""
+        expected = {}
+        for _, cell, count, lat_sum, lon_sum in await self.clusters_repository.count_clusters(
+                OrganizationDocument, Building, geohash.CLUSTER_PRECISION):
+            for precision in range(1, geohash.CLUSTER_PRECISION + 1):
+                item = expected.setdefault((precision, cell[:precision]), [0, 0.0, 0.0])
+                item[0] += count
+                item[1] += lat_sum
+                item[2] += lon_sum
+        # Все строки, включая опустевшие ячейки: у них должно быть по нулям
+        actual = {(precision, cell): values for precision, cell, *values in await self.clusters_repository.find_columns(
+            'precision', 'cell', 'organizations', 'lat_sum', 'lon_sum')}
+
+        def matches(key) -> bool:
+            count, lat_sum, lon_sum = expected.get(key, (0, 0.0, 0.0))
+            actual_count, actual_lat, actual_lon = actual.get(key, (0, 0.0, 0.0))
+            # Суммы координат копятся приращениями, точного равенства у float нет
+            return (count == actual_count and math.isclose(lat_sum, actual_lat, rel_tol=1e-9, abs_tol=1e-6)
+                    and math.isclose(lon_sum, actual_lon, rel_tol=1e-9, abs_tol=1e-6))
+
+        mismatched = sorted(key for key in expected.keys() | actual.keys() if not matches(key))
+        if fix and mismatched:
+            await self.rebuild()
+        return {'cells': len(expected), 'mismatched': len(mismatched),
+                'mismatched_cells': [cell for _, cell in mismatched[:100]]}
+
+    async def rebuild(self):
+        await self.clusters_repository.rebuild(OrganizationDocument, Building, geohash.CLUSTER_PRECISION)
+
+
+async def check_clusters(fix: bool = True) -> dict:
+    async with UnitOfWork() as uow:
+        report = await GeoClusterService(uow).check(fix)
+        await uow.commit()
+    if fix and report['mismatched']:
+        await response_cache.clear()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true', help='только сверить, ничего не исправлять')
+    args = parser.parse_args()
+
+    report = asyncio.run(check_clusters(fix=not args.check))
+    print(report)
+    if args.check and report['mismatched']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
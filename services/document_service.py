@@ -0,0 +1,122 @@
+"""
+Read-модель организаций: готовый JSON каждой организации (OrganizationRead) в organization_documents.
+Пишущие сценарии пересобирают документы затронутых организаций в своей транзакции, до commit().
+
+Полная пересборка после миграции 0006 на заполненной базе:
+
+    python -m services.document_service
+"""
+import asyncio
+import json
+
+from pydantic import TypeAdapter
+
+from schemas.organization_schemas import OrganizationRead
+from services.cluster_service import GeoClusterService, building_changes
+from services.facet_service import ActivityFacetService, activity_changes
+from utils.repository import SQLAlchemyDocumentRepository, SQLAlchemyOrganizationRepository
+from utils.unitofwork import UnitOfWork
+from utils.cache import response_cache
+from utils.query_budget import SELECTIN_CHUNK, query_budget
+from database.models import Organization, OrganizationActivity, OrganizationDocument
+
+DOCUMENT_ADAPTER = TypeAdapter(OrganizationRead)
+DOCUMENT_COLUMNS = ['organization_id', 'building_id', 'document']
+
+
+def render_document(organization) -> str:
+    return DOCUMENT_ADAPTER.dump_json(DOCUMENT_ADAPTER.validate_python(organization, from_attributes=True)).decode()
+
+
+class OrganizationDocumentService:
+    def __init__(self, uow):
+        self.uow = uow
+        self.organizations_repository = SQLAlchemyOrganizationRepository(Organization, uow)
+        self.documents_repository = SQLAlchemyDocumentRepository(OrganizationDocument, uow)
+        self.clusters = GeoClusterService(uow)
+        self.facets = ActivityFacetService(uow)
+
+    async def _write(self, organizations):
+        # Организация без здания бывает только там, где внешние ключи не проверяются (SQLite): документа у неё нет
+        await self.documents_repository.copy_rows(
+            OrganizationDocument, DOCUMENT_COLUMNS,
+            [(o.id, o.building_id, render_document(o)) for o in organizations if o.building is not None])
+
+    # Организации и по запросу на здания и деятельности, удаление старых документов,
+    # запись новых (COPY в asyncpg, INSERT в остальных драйверах), версии документов, сдвиг агрегатов карты,
+    # предки изменившихся деятельностей и сдвиг их счётчиков
+    @query_budget(9)
+    async def _refresh_chunk(self, organization_ids: list[int], bulk: bool = False):
+        # Строки организаций блокируются до конца транзакции: параллельная пересборка тех же документов
+        # ждёт commit() и удаляет уже наш документ, а не тот же старый - без повторной вставки и двойных сдвигов
+        organizations = await self.organizations_repository.find_by_ids_with_relations(
+            organization_ids, for_update=True)
+        old_rows = await self.documents_repository.delete_documents(organization_ids)
+        await self._write(organizations)
+        # Документ мог измениться - прежний ETag организации больше не действителен.
+        # При заливке тоже: организация с тем же id могла существовать до перезаливки
+        await self.organizations_repository.bump_versions(organization_ids)
+        if not bulk:
+            await self._apply_aggregates(old_rows, organizations)
+
+    async def _apply_aggregates(self, old_rows, organizations):
+        # Старые документы - состояние до записи: из каких зданий и деятельностей ушли организации
+        old_documents = [json.loads(document) for _, document in old_rows]
+        await self.clusters.apply(building_changes(old_documents, organizations))
+        await self.facets.apply(activity_changes(old_documents, organizations))
+
+    async def refresh(self, organization_ids, bulk: bool = False):
+        """
+        Пересобирает документы организаций; документы удалённых организаций исчезают.
+        bulk=True - для массовой заливки новых организаций:
+        агрегаты карты и счётчики деятельностей после заливки пересчитываются целиком.
+        """
+        organization_ids = sorted(set(organization_ids))
+        for start in range(0, len(organization_ids), SELECTIN_CHUNK):
+            await self._refresh_chunk(organization_ids[start:start + SELECTIN_CHUNK], bulk)
+
+    # Блокировка организаций, удаление документов, сдвиг агрегатов карты, предки деятельностей и сдвиг их счётчиков
+    @query_budget(5)
+    async def remove(self, organization_ids: list[int]):
+        """
+        Убирает документы организаций до удаления их строк: каскад по внешнему ключу удалил бы документы
+        раньше, и агрегаты карты и счётчики деятельностей не узнали бы, из чего вычитать.
+        """
+        # Та же блокировка, что при пересборке: иначе документ, записанный параллельной пересборкой,
+        # удалится каскадом мимо агрегатов
+        await self.organizations_repository.find_by_ids_with_relations(organization_ids, include=(), for_update=True)
+        old_rows = await self.documents_repository.delete_documents(organization_ids)
+        await self._apply_aggregates(old_rows, [])
+
+    async def organization_ids_by_building(self, building_id: int) -> list[int]:
+        return await self.documents_repository.find_organization_ids(
+            Organization.id, Organization.building_id, building_id)
+
+    async def organization_ids_by_activity(self, activity_id: int) -> list[int]:
+        # Деятельность встроена в документ каждой своей организации: у популярной их тысячи
+        return await self.documents_repository.find_organization_ids(
+            OrganizationActivity.organization_id, OrganizationActivity.activity_id, activity_id)
+
+    async def rebuild(self):
+        """Все документы заново, пачками по первичному ключу."""
+        await self.documents_repository.delete_documents()
+        after_id = None
+        while True:
+            organizations = await self.organizations_repository.find_all_with_relations(after_id, SELECTIN_CHUNK)
+            if not organizations:
+                break
+            await self._write(organizations)
+            after_id = organizations[-1].id
+            # Загруженные организации больше не нужны: память не растёт с размером таблицы
+            self.uow.session.expunge_all()
+
+
+async def rebuild_documents():
+    async with UnitOfWork() as uow:
+        await OrganizationDocumentService(uow).rebuild()
+        await uow.commit()
+    await response_cache.clear()
+
+
+if __name__ == '__main__':
+    asyncio.run(rebuild_documents())
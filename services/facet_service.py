@@ -0,0 +1,114 @@
+"""
+Счётчики для фасетной навигации: сколько организаций под каждой деятельностью вместе с потомками.
+Ведутся вместе с документами read-модели: каждая пересборка документов сравнивает старые
+и новые деятельности организаций и сдвигает счётчики их предков.
+
+Сверка с пересчётом по organization_activities (расхождения исправляются, --check - только отчёт):
+
+    python -m services.facet_service
+    python -m services.facet_service --check
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+from utils.repository import SQLAlchemyFacetRepository
+from utils.unitofwork import UnitOfWork
+from utils.cache import response_cache
+from database.models import ActivityClosure, ActivityFacet, OrganizationActivity, OrganizationDocument
+
+
+def activity_changes(old_documents: list[dict], organizations) -> dict[int, tuple[dict, dict]]:
+    """
+    Организации, у которых поменялся набор деятельностей:
+    organization_id -> (старые {activity_id: parent_id}, новые {activity_id: parent_id}).
+    """
+    changes = {}
+    for document in old_documents:
+        changes[document['id']] = ({a['id']: a['parent_id'] for a in document['activities']}, {})
+    for organization in organizations:
+        # Без здания документа нет - как и в счётчиках
+        if organization.building is None:
+            continue
+        old = changes.get(organization.id, ({}, {}))[0]
+        changes[organization.id] = (old, {a.id: a.parent_id for a in organization.activities})
+    return {organization_id: (old, new) for organization_id, (old, new) in changes.items() if old.keys() != new.keys()}
+
+
+class ActivityFacetService:
+    def __init__(self, uow):
+        self.uow = uow
+        self.facets_repository = SQLAlchemyFacetRepository(ActivityFacet, uow)
+
+    async def apply(self, changes: dict[int, tuple[dict, dict]]):
+        if not changes:
+            return
+        activity_ids = set()
+        for old, new in changes.values():
+            for activities in (old, new):
+                activity_ids.update(activities)
+                activity_ids.update(parent_id for parent_id in activities.values() if parent_id is not None)
+        ancestors = await self.facets_repository.find_ancestors(ActivityClosure, activity_ids)
+
+        def covered(activities: dict) -> set[int]:
+            result = set()
+            for activity_id, parent_id in activities.items():
+                # Удалённой деятельности в замыкании уже нет, её строка счётчика удалена каскадом:
+                # остаются её предки, то есть родитель с его предками
+                result |= ancestors.get(activity_id) or ancestors.get(parent_id, set())
+            return result
+
+        deltas = Counter()
+        for old, new in changes.values():
+            old_ids, new_ids = covered(old), covered(new)
+            deltas.update(new_ids - old_ids)
+            deltas.subtract(old_ids - new_ids)
+        # По порядку ключа: параллельные транзакции блокируют строки в одном порядке
+        await self.facets_repository.add_deltas([
+            {'activity_id': activity_id, 'organizations': delta}
+            for activity_id, delta in sorted(deltas.items()) if delta
+        ])
+
+    async def check(self, fix: bool = True) -> dict:
+        """Сравнивает счётчики с пересчётом по связям; при fix=True заменяет их пересчитанными."""
+        expected = dict(await self.facets_repository.count_facets(
+            OrganizationActivity, ActivityClosure, OrganizationDocument))
+        # Все строки, включая нулевые и отрицательные: они тоже расхождения
+        actual = dict(await self.facets_repository.find_columns('activity_id', 'organizations'))
+        mismatched = sorted(activity_id for activity_id in expected.keys() | actual.keys()
+                            if expected.get(activity_id, 0) != actual.get(activity_id, 0))
+        if fix and mismatched:
+            await self.rebuild(expected)
+        return {'activities': len(expected), 'mismatched': len(mismatched), 'mismatched_ids': mismatched[:100]}
+
+    async def rebuild(self, expected: dict | None = None):
+        if expected is None:
+            expected = dict(await self.facets_repository.count_facets(
+                OrganizationActivity, ActivityClosure, OrganizationDocument))
+        await self.facets_repository.replace_all(
+            [{'activity_id': activity_id, 'organizations': count} for activity_id, count in expected.items()])
+
+
+async def check_facets(fix: bool = True) -> dict:
+    async with UnitOfWork() as uow:
+        report = await ActivityFacetService(uow).check(fix)
+        await uow.commit()
+    if fix and report['mismatched']:
+        await response_cache.clear()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true', help='только сверить, ничего не исправлять')
+    args = parser.parse_args()
+
+    report = asyncio.run(check_facets(fix=not args.check))
+    print(report)
+    if args.check and report['mismatched']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
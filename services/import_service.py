@@ -0,0 +1,249 @@
+import codecs
+import csv
+import json
+import time
+
+from pydantic import BaseModel, ValidationError
+
+from schemas.activity_schemas import ActivityCreate
+from schemas.buildings_schemas import BuildingCreate
+from schemas.organization_schemas import OrganizationCreate
+from services.activity_service import ActivityService
+from services.building_service import BUILDING_LIST, BuildingService
+from services.document_service import OrganizationDocumentService
+from services.organization_service import ORGANIZATION_BY_ID, ORGANIZATION_COLLECTIONS
+from utils.cache import response_cache
+from utils.repository import SQLAlchemyRepository, SQLAlchemyActivityRepository, SQLAlchemyVersionRepository
+from utils.activity_tree import activity_tree
+from utils import geohash
+from utils.spatial_index import building_index
+from database.models import Activity, ActivityClosure, Building, EntityVersion, Organization, OrganizationActivity
+
+
+def split_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(';') if item.strip()] if value else []
+
+
+# Преобразование строки CSV (словарь по заголовку) к виду схемы *Create
+CSV_CONVERTERS = {
+    'buildings': lambda row: {
+        'address': row.get('address'),
+        'coordinates': {'lat': row.get('lat'), 'lon': row.get('lon')},
+    },
+    'activities': lambda row: {
+        'name': row.get('name'),
+        'parent_id': row.get('parent_id') or None,
+    },
+    'organizations': lambda row: {
+        'name': row.get('name'),
+        'phones': split_list(row.get('phones', '')) or None,
+        'building_id': row.get('building_id'),
+        'activity_ids': split_list(row.get('activity_ids', '')),
+    },
+}
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportService:
+    SCHEMAS: dict[str, type[BaseModel]] = {
+        'buildings': BuildingCreate,
+        'activities': ActivityCreate,
+        'organizations': OrganizationCreate,
+    }
+    MAX_REPORTED_ERRORS = 1000
+
+    def __init__(self, uow):
+        self.uow = uow
+        self.buildings_repository = SQLAlchemyRepository(Building, uow)
+        self.activities_repository = SQLAlchemyActivityRepository(Activity, uow)
+        self.organizations_repository = SQLAlchemyRepository(Organization, uow)
+        self.versions_repository = SQLAlchemyVersionRepository(EntityVersion, uow)
+        self.activity_service = ActivityService(Activity, uow)
+        self.documents = OrganizationDocumentService(uow)
+
+    async def import_stream(self, entity: str, file_format: str, chunks, chunk_size: int = 1000) -> dict:
+        started = time.perf_counter()
+        report = {'entity': entity, 'processed': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+        writer = getattr(self, f'_write_{entity}')
+        self.entity = entity
+        schema = self.SCHEMAS[entity]
+
+        batch = []
+        async for line_number, payload in self._iter_records(entity, file_format, chunks):
+            report['processed'] += 1
+            try:
+                if isinstance(payload, Exception):
+                    raise RowError(str(payload))
+                batch.append((line_number, schema.model_validate(payload)))
+            except ValidationError as e:
+                self._add_error(report, line_number, self._format_validation_error(e))
+            except RowError as e:
+                self._add_error(report, line_number, str(e))
+
+            if len(batch) >= chunk_size:
+                await self._flush(writer, batch, report)
+                batch = []
+        if batch:
+            await self._flush(writer, batch, report)
+
+        elapsed = time.perf_counter() - started
+        report['elapsed_sec'] = round(elapsed, 3)
+        report['rows_per_sec'] = round(report['inserted'] / elapsed, 1) if elapsed > 0 else None
+        report['ok'] = report['failed'] == 0
+        return report
+
+    async def _flush(self, writer, batch, report):
+        errors = []
+        try:
+            inserted = await writer(batch, errors)
+            await self.uow.commit()
+        except Exception as e:
+            await self.uow.rollback()
+            first_line, last_line = batch[0][0], batch[-1][0]
+            self._add_error(report, first_line, f"Пачка строк {first_line}-{last_line} не записана: {e}")
+            report['failed'] += len(batch) - 1
+            await self._after_chunk()
+            return
+
+        report['inserted'] += inserted
+        for line_number, message in errors:
+            self._add_error(report, line_number, message)
+        await self._after_chunk()
+
+    async def _after_chunk(self):
+        # Пачка записана одним INSERT/COPY мимо сервисов: локальные кэши перечитаются при следующем обращении
+        self.uow.session.expunge_all()
+        if self.entity == 'activities':
+            activity_tree.invalidate()
+        elif self.entity == 'buildings':
+            building_index.invalidate()
+            await response_cache.invalidate_namespace(BUILDING_LIST)
+        else:
+            # Новые id могли быть закэшированы как отсутствующие
+            await response_cache.invalidate_namespace(ORGANIZATION_BY_ID, *ORGANIZATION_COLLECTIONS)
+
+    def _add_error(self, report, line_number: int, message: str):
+        report['failed'] += 1
+        if len(report['errors']) < self.MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_number, 'error': message})
+
+    @staticmethod
+    def _format_validation_error(error: ValidationError) -> str:
+        return '; '.join(
+            f"{'.'.join(map(str, item['loc']))}: {item['msg']}" if item['loc'] else item['msg']
+            for item in error.errors(include_url=False)
+        )
+
+    async def _iter_lines(self, chunks):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buffer = ''
+        line_number = 0
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split('\n')
+            for line in lines:
+                line_number += 1
+                yield line_number, line.rstrip('\r')
+        buffer += decoder.decode(b'', final=True)
+        if buffer:
+            yield line_number + 1, buffer.rstrip('\r')
+
+    async def _iter_records(self, entity: str, file_format: str, chunks):
+        header = None
+        async for line_number, line in self._iter_lines(chunks):
+            if not line.strip():
+                continue
+            if file_format == 'ndjson':
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, RowError(f"Некорректный JSON: {e.msg}")
+                continue
+
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, RowError(f"Ожидалось колонок: {len(header)}, получено: {len(values)}")
+                continue
+            yield line_number, CSV_CONVERTERS[entity](dict(zip(header, values)))
+
+    async def _write_buildings(self, batch, errors) -> int:
+        rows = [
+            {
+                'address': item.address,
+                'coordinates': item.coordinates.model_dump(),
+                'lat': item.coordinates.lat,
+                'lon': item.coordinates.lon,
+                'geohash': geohash.encode(item.coordinates.lat, item.coordinates.lon),
+            }
+            for _, item in batch
+        ]
+        ids = await self.buildings_repository.add_many(rows)
+        if ids:
+            await self.versions_repository.bump(BuildingService.VERSION_NAME)
+        return len(ids)
+
+    async def _write_activities(self, batch, errors) -> int:
+        tree = await self.activity_service.activity_tree()
+        valid = []
+        for line_number, item in batch:
+            level = 1
+            if item.parent_id is not None:
+                parent = tree.get(item.parent_id)
+                if parent is None:
+                    errors.append((line_number, f"Родитель активности с id {item.parent_id} не найден"))
+                    continue
+                if parent.level >= 3:
+                    errors.append((line_number, "Превышен уровень вложенности"))
+                    continue
+                level = parent.level + 1
+            valid.append((item, level))
+
+        ids = await self.activities_repository.add_many(
+            [{'name': item.name, 'parent_id': item.parent_id, 'level': level} for item, level in valid])
+
+        closure = []
+        for activity_id, (item, _) in zip(ids, valid):
+            closure.append((activity_id, activity_id, 0))
+            depth, node = 1, tree.get(item.parent_id) if item.parent_id is not None else None
+            while node is not None:
+                closure.append((node.id, activity_id, depth))
+                depth, node = depth + 1, tree.get(node.parent_id) if node.parent_id is not None else None
+        await self.activities_repository.copy_rows(ActivityClosure, ['ancestor_id', 'descendant_id', 'depth'], closure)
+
+        if ids:
+            await self.versions_repository.bump(ActivityService.VERSION_NAME)
+        return len(ids)
+
+    async def _write_organizations(self, batch, errors) -> int:
+        tree = await self.activity_service.activity_tree()
+        building_ids = {item.building_id for _, item in batch}
+        buildings = await self.buildings_repository.find_all_with_filter_in('id', building_ids, Building)
+        known_buildings = {b.id for b in buildings}
+
+        valid = []
+        for line_number, item in batch:
+            if item.building_id not in known_buildings:
+                errors.append((line_number, f"Здание с таким id: {item.building_id} не найдено"))
+                continue
+            missing_ids = {activity_id for activity_id in item.activity_ids if tree.get(activity_id) is None}
+            if missing_ids:
+                errors.append((line_number, f"Активность с таким id: {missing_ids} не найдена"))
+                continue
+            valid.append(item)
+
+        ids = await self.organizations_repository.add_many(
+            [item.model_dump(exclude={'activity_ids'}) for item in valid])
+        relations = [
+            (organization_id, activity_id)
+            for organization_id, item in zip(ids, valid)
+            for activity_id in set(item.activity_ids)
+        ]
+        await self.organizations_repository.copy_rows(OrganizationActivity, ['organization_id', 'activity_id'], relations)
+        await self.documents.refresh(ids)
+        return len(ids)
@@ -1,73 +1,238 @@
-from fastapi import HTTPException
+import asyncio
+import json
 
-from schemas.organization_schemas import OrganizationCreate
-from utils.repository import SQLAlchemyOrganizationRepository, SQLAlchemyRepository
-from database.models import OrganizationActivity
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+
+from schemas.organization_schemas import (OrganizationCreate, OrganizationBatchUpdate,
+                                          ORGANIZATION_RELATIONS, ORGANIZATION_SCHEMAS)
+from services.cluster_service import cluster_precision
+from services.document_service import OrganizationDocumentService
+from utils import geohash
+from utils.repository import (SQLAlchemyClusterRepository, SQLAlchemyDocumentRepository,
+                              SQLAlchemyOrganizationRepository, SQLAlchemyRepository)
+from utils.cache import response_cache
+from utils.dataloader import DataLoader
+from utils.query_budget import SELECTIN_CHUNK, query_budget
+from database.models import (ActivityClosure, Building, GeoCluster, Organization, OrganizationActivity,
+                             OrganizationDocument)
+
+
+ORGANIZATION_BY_ID = 'organizations:by_id'
+ORGANIZATION_BY_NAME = 'organizations:by_name'
+ORGANIZATION_LIST = 'organizations:list'
+ORGANIZATION_BY_ACTIVITY = 'organizations:by_activity'
+ORGANIZATION_BY_GEO = 'organizations:by_geo'
+ORGANIZATION_SEARCH = 'organizations:search'
+ORGANIZATION_CLUSTERS = 'organizations:clusters'
+ORGANIZATION_FACETS = 'organizations:facets'
+# Выборки, в которые организация может попасть или из которых может выпасть после любой записи
+ORGANIZATION_COLLECTIONS = (ORGANIZATION_BY_NAME, ORGANIZATION_LIST, ORGANIZATION_BY_ACTIVITY, ORGANIZATION_BY_GEO,
+                            ORGANIZATION_SEARCH, ORGANIZATION_CLUSTERS, ORGANIZATION_FACETS)
+
+ORGANIZATION_ADAPTERS = {include: TypeAdapter(list[schema]) for include, schema in ORGANIZATION_SCHEMAS.items()}
+
+
+def dump_organizations(organizations, include=ORGANIZATION_RELATIONS) -> list[dict]:
+    """Сериализует организации схемой, в которой есть только связи из include."""
+    adapter = ORGANIZATION_ADAPTERS[include]
+    return adapter.dump_python(adapter.validate_python(organizations, from_attributes=True), mode='json')
+
+
+def project_organization(organization: str, include=ORGANIZATION_RELATIONS):
+    # Полное представление - документ read-модели; без части связей он разбирается и урезается
+    if include == ORGANIZATION_RELATIONS:
+        return organization
+    organization = json.loads(organization)
+    return {key: value for key, value in organization.items() if key not in ORGANIZATION_RELATIONS or key in include}
 
 
 class OrganizationService:
-    def __init__(self, model):
-        self.organizations_repository = SQLAlchemyOrganizationRepository(model)
-        self.organizations_repository_for_action = SQLAlchemyRepository(model)
+    def __init__(self, model, uow):
+        self.uow = uow
+        self.organizations_repository = SQLAlchemyOrganizationRepository(model, uow)
+        self.organizations_repository_for_action = SQLAlchemyRepository(model, uow)
+        self.documents_repository = SQLAlchemyDocumentRepository(OrganizationDocument, uow)
+        self.documents = OrganizationDocumentService(uow)
+        self.clusters_repository = SQLAlchemyClusterRepository(GeoCluster, uow)
+        self.organization_loader = DataLoader(self._load_organizations)
+
+    # Полный include читается из read-модели готовыми JSON-документами одним запросом,
+    # урезанный - собирается из таблиц только с нужными связями
+
+    @query_budget(1)
+    async def _load_organizations(self, organization_ids: list[int]) -> dict:
+        rows = await self.documents_repository.find_documents_by_ids(organization_ids)
+        return {row.organization_id: row.document for row in rows}
     
-    async def find_organizations(self):
-        return await self.organizations_repository.find_all_with_relations()
-
-    async def find_one_organization(self, filter):
-        obj = {}
+    @response_cache.cached(ORGANIZATION_LIST, None)
+    @query_budget(3, per_rows=SELECTIN_CHUNK)
+    async def find_organizations(self, after_id: int | None = None, limit: int | None = None,
+                                 include=ORGANIZATION_RELATIONS):
+        if include == ORGANIZATION_RELATIONS:
+            return [row.document for row in await self.documents_repository.find_documents(after_id, limit)]
+        organizations = await self.organizations_repository.find_all_with_relations(after_id, limit, include=include)
+        return dump_organizations(organizations, include)
+
+    def stream_organizations(self, after_id: int | None = None, include=ORGANIZATION_RELATIONS):
+        return self.organizations_repository.stream_all_with_relations(after_id, include=include)
+
+    async def find_one_organization(self, filter, include=ORGANIZATION_RELATIONS, version: int | None = None):
         if isinstance(filter, int):
-            obj['filter_key'] = 'id'
+            # Без версии - ключ кэша, который сбрасывает evict_cache; с версией ключ после записи меняется сам
+            organization = await (self.find_organization_by_id(filter) if version is None
+                                  else self.find_organization_by_id(filter, version))
+            return project_organization(organization, include) if organization is not None else None
         elif isinstance(filter, str):
-            obj['filter_key'] = 'name'
+            return await self.find_organization_by_name(filter, include)
         else:
             raise ValueError("Invalid filter type")
-        obj['filter_value'] = filter
-        return await self.organizations_repository.find_one_with_relations(obj)
 
+    @response_cache.cached(ORGANIZATION_BY_ID, None)
+    async def find_organization_by_id(self, organization_id: int, version: int | None = None) -> str | None:
+        # version - только часть ключа кэша: документ, закэшированный до записи, не отдадут под новым ETag.
+        # Записи кэша прежних версий не сбрасываются по id и уходят по TTL или со всем пространством имён.
+        # Промахи кэша, случившиеся одновременно, уходят в базу одним запросом
+        return await self.organization_loader.load(organization_id)
+
+    @query_budget(1)
+    async def find_organization_version(self, organization_id: int) -> int | None:
+        # Без загрузки и сериализации документа: для If-None-Match
+        return await self.organizations_repository.find_version(organization_id)
+
+    async def find_organizations_by_ids(self, organization_ids: list[int], include=ORGANIZATION_RELATIONS):
+        organizations = await asyncio.gather(
+            *(self.find_organization_by_id(organization_id) for organization_id in dict.fromkeys(organization_ids)))
+        return [project_organization(organization, include) for organization in organizations if organization is not None]
+
+    @response_cache.cached(ORGANIZATION_BY_NAME, None)
+    @query_budget(3)
+    async def find_organization_by_name(self, name: str, include=ORGANIZATION_RELATIONS):
+        if include == ORGANIZATION_RELATIONS:
+            return await self.documents_repository.find_document_by_name(Organization, name)
+        obj = {}
+        obj['filter_key'] = 'name'
+        obj['filter_value'] = name
+        organization = await self.organizations_repository.find_one_with_relations(obj, include=include)
+        return dump_organizations([organization], include)[0] if organization is not None else None
+
+    @response_cache.cached(ORGANIZATION_SEARCH, None)
+    @query_budget(3)
+    async def search_organizations(self, query: str, limit: int = 20, offset: int = 0,
+                                   include=ORGANIZATION_RELATIONS):
+        if include == ORGANIZATION_RELATIONS:
+            return await self.documents_repository.search_documents(Organization, query, limit, offset)
+        organizations = await self.organizations_repository.search_by_name(query, limit, offset, include=include)
+        return dump_organizations(organizations, include)
+
+    @query_budget(1)
     async def find_organizations_by_building_id(self, building_id: int):
         obj = {}
         obj['filter_key'] = 'building_id'
         obj['filter_value'] = building_id
         return await self.organizations_repository.find_all_with_filter(obj)
 
-    async def find_organizations_by_activity_ids(self, activity_ids: list[int]):
-        return await self.organizations_repository.find_by_activity_ids(activity_ids, OrganizationActivity)
+    @response_cache.cached(ORGANIZATION_BY_ACTIVITY, None)
+    @query_budget(3, per_rows=SELECTIN_CHUNK)
+    async def find_organizations_by_activity_ids(self, activity_ids: list[int], include_descendants: bool = False,
+                                                 include=ORGANIZATION_RELATIONS):
+        closure_table = ActivityClosure if include_descendants else None
+        if include == ORGANIZATION_RELATIONS:
+            return await self.documents_repository.find_documents_by_activity_ids(
+                activity_ids, OrganizationActivity, closure_table)
+        organizations = await self.organizations_repository.find_by_activity_ids(
+            activity_ids, OrganizationActivity, closure_table, include=include)
+        return dump_organizations(organizations, include)
     
-    async def find_organizations_in_buildings(self, building_ids: list[int]):
-        return await self.organizations_repository.find_organizations_with_building_and_activities_by_building_ids(building_ids)
-
+    @query_budget(3, per_rows=SELECTIN_CHUNK)
+    async def find_organizations_in_buildings(self, building_ids: list[int], include=ORGANIZATION_RELATIONS):
+        # Для полного include - строки (building_id, document), иначе ORM-объекты; у тех и других есть building_id
+        if include == ORGANIZATION_RELATIONS:
+            return await self.documents_repository.find_documents_by_building_ids(building_ids)
+        return await self.organizations_repository.find_organizations_with_building_and_activities_by_building_ids(
+            building_ids, include=include)
+
+    @response_cache.cached(ORGANIZATION_BY_GEO, None)
+    @query_budget(3, per_rows=SELECTIN_CHUNK)
+    async def find_organizations_in_box(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float,
+                                        include=ORGANIZATION_RELATIONS):
+        if include == ORGANIZATION_RELATIONS:
+            return await self.documents_repository.find_documents_in_box(Building, lat_min, lon_min, lat_max, lon_max)
+        organizations = await self.organizations_repository.find_organizations_in_box(
+            Building, lat_min, lon_min, lat_max, lon_max, include=include)
+        return dump_organizations(organizations, include)
+
+    @response_cache.cached(ORGANIZATION_CLUSTERS, None)
+    @query_budget(1)
+    async def find_clusters(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float, zoom: int) -> dict:
+        # Размер ответа зависит от числа ячеек в прямоугольнике, а не от числа организаций в нём
+        precision = cluster_precision(zoom, lat_min, lon_min, lat_max, lon_max)
+        rows = await self.clusters_repository.find_clusters(
+            precision, geohash.cells_in_box(lat_min, lon_min, lat_max, lon_max, precision))
+        return {
+            'precision': precision,
+            'clusters': [
+                {'geohash': row.cell, 'count': row.organizations,
+                 'lat': round(row.lat_sum / row.organizations, 6), 'lon': round(row.lon_sum / row.organizations, 6)}
+                for row in rows
+            ],
+        }
+
+    async def evict_cache(self, *organization_ids: int):
+        for organization_id in organization_ids:
+            await response_cache.invalidate(ORGANIZATION_BY_ID, organization_id)
+        await response_cache.invalidate_namespace(*ORGANIZATION_COLLECTIONS)
+
+    # Запись и пересборка документа с версией, агрегатами карты и счётчиками деятельностей (до 9 запросов)
+    @query_budget(11)
     async def add_organization_with_activities(self, organization: OrganizationCreate):
         organization_id = await self.organizations_repository_for_action.add_one(
             organization.model_dump(exclude={"activity_ids"}))
-        
-        for activity_id in organization.activity_ids:
-            await self.organizations_repository.add_relation(
-                table=OrganizationActivity,
-                organization_id=organization_id,
-                activity_id=activity_id)
 
+        await self.organizations_repository.add_relations(
+            table=OrganizationActivity,
+            rows=[{"organization_id": organization_id, "activity_id": activity_id}
+                  for activity_id in set(organization.activity_ids)])
+
+        await self.documents.refresh([organization_id])
+        await self.uow.commit()
+        await self.evict_cache(organization_id)
         return organization_id
 
 
-    async def update_organization(self, organization_id: int, organization: OrganizationCreate):
-        await self.organizations_repository_for_action.update_one(
-            organization_id,
-            organization.model_dump(exclude={"activity_ids"}))
+    @query_budget(4)
+    async def _update_organization(self, organization_id: int, organization: OrganizationCreate):
+        try:
+            await self.organizations_repository_for_action.update_one(
+                organization_id,
+                organization.model_dump(exclude={"activity_ids", "id"}))
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
 
-        await self.organizations_repository_for_action.delete_relations(
+        await self.organizations_repository.sync_relations(
             table=OrganizationActivity,
-            filter_column="organization_id",
-            filter_value=organization_id)
-
-        for activity_id in organization.activity_ids:
-            await self.organizations_repository.add_relation(
-                table=OrganizationActivity,
-                organization_id=organization_id,
-                activity_id=activity_id)
+            owner_column="organization_id",
+            owner_id=organization_id,
+            target_column="activity_id",
+            target_ids=organization.activity_ids)
 
+    async def update_organization(self, organization_id: int, organization: OrganizationCreate):
+        await self._update_organization(organization_id, organization)
+        await self.documents.refresh([organization_id])
+        await self.uow.commit()
+        await self.evict_cache(organization_id)
         return await self.find_one_organization(organization_id)
 
+    async def update_organizations(self, organizations: list[OrganizationBatchUpdate]) -> list[int]:
+        for organization in organizations:
+            await self._update_organization(organization.id, organization)
+        await self.documents.refresh(organization.id for organization in organizations)
+        await self.uow.commit()
+        await self.evict_cache(*(organization.id for organization in organizations))
+        return [organization.id for organization in organizations]
+
 
+    @query_budget(9)
     async def delete_organization(self, organization_id: int):
         organization = await self.organizations_repository_for_action.find_one_with_filter({
             "filter_key": "id",
@@ -80,6 +245,9 @@ class OrganizationService:
             filter_column="organization_id",
             filter_value=organization_id)
 
+        await self.documents.remove([organization_id])
         await self.organizations_repository_for_action.delete_one(organization_id)
+        await self.uow.commit()
+        await self.evict_cache(organization_id)
 
         return {"ok": True, "deleted_id": organization_id}
\ No newline at end of file
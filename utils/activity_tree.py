@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+
+class ActivityNode:
+    __slots__ = ('id', 'name', 'parent_id', 'level')
+
+    def __init__(self, id: int, name: str, parent_id: int | None, level: int):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.level = level
+
+
+class ActivityTreeCache:
+    """
+    Дерево деятельностей целиком в памяти процесса.
+    version совпадает со счётчиком 'activities' в entity_versions на момент загрузки:
+    если в базе он больше, значит дерево менял другой процесс и кэш нужно перечитать.
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self.loaded = False
+        self.version = 0
+        self.checked_at = 0.0
+        self.lock = asyncio.Lock()
+        self.nodes: dict[int, ActivityNode] = {}
+        self.by_name: dict[str, set[int]] = {}
+        self.children: dict[int | None, set[int]] = {}
+
+    def load(self, rows, version: int):
+        self.nodes = {}
+        self.by_name = {}
+        self.children = {}
+        for row in rows:
+            self._put(ActivityNode(row.id, row.name, row.parent_id, row.level))
+        self.version = version
+        self.loaded = True
+        self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        self.loaded = False
+
+    async def ensure_fresh(self, load_version, load_rows):
+        if self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+            return self
+        async with self.lock:
+            if self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+                return self
+            version = await load_version()
+            if not self.loaded or version != self.version:
+                self.load(await load_rows(), version)
+            self.checked_at = time.monotonic()
+        return self
+
+    def _put(self, node: ActivityNode):
+        self.nodes[node.id] = node
+        self.by_name.setdefault(node.name, set()).add(node.id)
+        self.children.setdefault(node.parent_id, set()).add(node.id)
+
+    def _discard(self, activity_id: int):
+        node = self.nodes.pop(activity_id, None)
+        if node is None:
+            return
+        self.by_name[node.name].discard(activity_id)
+        if not self.by_name[node.name]:
+            del self.by_name[node.name]
+        self.children[node.parent_id].discard(activity_id)
+
+    def _apply(self, version: int, patch):
+        # Патчим только если между нашей загрузкой и записью никто другой дерево не менял
+        if self.loaded and version == self.version + 1:
+            patch()
+            self.version = version
+        else:
+            self.invalidate()
+
+    def put(self, node: ActivityNode, version: int):
+        def patch():
+            self._discard(node.id)
+            self._put(node)
+        self._apply(version, patch)
+
+    def remove(self, activity_id: int, version: int):
+        def patch():
+            self._discard(activity_id)
+            self.children.pop(activity_id, None)
+        self._apply(version, patch)
+
+    def get(self, activity_id: int) -> ActivityNode | None:
+        return self.nodes.get(activity_id)
+
+    def all(self) -> list[ActivityNode]:
+        return [self.nodes[activity_id] for activity_id in sorted(self.nodes)]
+
+    def find_by_name(self, name: str) -> list[ActivityNode]:
+        return [self.nodes[activity_id] for activity_id in sorted(self.by_name.get(name, ()))]
+
+    def find_by_ids(self, ids) -> list[ActivityNode]:
+        return [self.nodes[activity_id] for activity_id in ids if activity_id in self.nodes]
+
+    def children_ids(self, activity_id: int) -> set[int]:
+        return self.children.get(activity_id, set())
+
+    def descendant_ids(self, activity_ids) -> set[int]:
+        result = set()
+        stack = [activity_id for activity_id in activity_ids if activity_id in self.nodes]
+        while stack:
+            activity_id = stack.pop()
+            if activity_id in result:
+                continue
+            result.add(activity_id)
+            stack.extend(self.children.get(activity_id, ()))
+        return result
+
+
+activity_tree = ActivityTreeCache()
@@ -0,0 +1,85 @@
+import asyncio
+import math
+import time
+
+from config import settings
+from utils import metrics
+
+
+admission_queued = metrics.Counter('admission_queued_total', 'Запросы, ждавшие места в очереди допуска', ('class',))
+admission_shed = metrics.Counter('admission_shed_total', 'Запросы, отклонённые при перегрузке (503)',
+                                 ('class', 'reason'))
+admission_wait = metrics.Histogram('admission_queue_wait_seconds', 'Ожидание в очереди допуска', ('class',))
+
+
+class Overloaded(Exception):
+    def __init__(self, route_class: str, reason: str, retry_after: int):
+        super().__init__(f"{route_class}: {reason}")
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Не больше concurrency одновременных запросов класса и не больше queue_size ожидающих.
+    Лишние запросы отклоняются сразу, а не копятся в очереди за соединением из пула;
+    ожидающий дольше timeout секунд тоже отклоняется: клиент всё равно уже не дождётся ответа.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.timeout))
+
+    def _shed(self, reason: str):
+        admission_shed.inc(self.name, reason)
+        raise Overloaded(self.name, reason, self.retry_after)
+
+    async def acquire(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_size:
+                self._shed('queue_full')
+            admission_queued.inc(self.name)
+            self.waiting += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except TimeoutError:
+                self._shed('timeout')
+            finally:
+                self.waiting -= 1
+                admission_wait.observe(time.perf_counter() - started, self.name)
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+admission_limiters = {
+    name: AdmissionLimiter(name, concurrency, queue_size, timeout)
+    for name, (concurrency, queue_size, timeout) in settings.admission_limits.items()
+}
+
+metrics.Gauge('admission_in_flight', 'Запросов класса в работе',
+              lambda: {(name,): limiter.active for name, limiter in admission_limiters.items()}, ('class',))
+metrics.Gauge('admission_queue_depth', 'Запросов класса в очереди допуска',
+              lambda: {(name,): limiter.waiting for name, limiter in admission_limiters.items()}, ('class',))
@@ -0,0 +1,199 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import wraps
+
+from pydantic import TypeAdapter
+
+from config import settings
+
+
+MISS = object()
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryCache(CacheBackend):
+    """LRU на OrderedDict с ограничением по количеству записей и TTL на каждую запись."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return MISS
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return MISS
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def delete_prefix(self, prefix: str):
+        for key in [key for key in self._data if key.startswith(prefix)]:
+            del self._data[key]
+
+    async def clear(self):
+        self._data.clear()
+
+
+class RedisCache(CacheBackend):
+    """
+    Общий для всех воркеров кэш. Подходит любой клиент с интерфейсом redis.asyncio
+    (get / set(ex=) / delete / scan_iter), например локальный fakeredis для проверки.
+    """
+
+    def __init__(self, client, prefix: str = 'moon:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        import redis.asyncio as redis  # необязательная зависимость, нужна только для этого бэкенда
+        return cls(redis.from_url(url))
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return MISS
+        return json.loads(raw)
+
+    async def set(self, key: str, value, ttl: float):
+        await self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def delete_prefix(self, prefix: str):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + prefix + '*')]
+        if keys:
+            await self.client.delete(*keys)
+
+    async def clear(self):
+        await self.delete_prefix('')
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, default_ttl: float = 30.0):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        # Поколения пространств имён в этом процессе: растут при каждом сбросе.
+        # Результат, вычисленный через сброс, мог быть прочитан до записи - такой не кэшируется
+        self._generations: dict[str, int] = {}
+        self._cleared = 0
+
+    def _generation(self, namespace: str) -> tuple[int, int]:
+        return self._cleared, self._generations.get(namespace, 0)
+
+    def _bump(self, namespace: str):
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    @staticmethod
+    def make_key(namespace: str, args=(), kwargs=None) -> str:
+        kwargs = sorted((kwargs or {}).items())
+        return f"{namespace}:{args!r}:{kwargs!r}" if kwargs else f"{namespace}:{args!r}"
+
+    def cached(self, namespace: str, schema, ttl: float | None = None):
+        """
+        Кэширует результат метода сервиса в уже сериализованном виде (JSON-совместимые dict/list).
+        Ключ - namespace и аргументы вызова, без self.
+        schema=None - метод сам возвращает JSON-совместимые данные.
+        """
+        adapter = TypeAdapter(schema) if schema is not None else None
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(service, *args, **kwargs):
+                key = self.make_key(namespace, args, kwargs)
+                value = await self.backend.get(key)
+                if value is not MISS:
+                    self.hits += 1
+                    return value
+
+                self.misses += 1
+                generation = self._generation(namespace)
+                result = await func(service, *args, **kwargs)
+                value = result if adapter is None else \
+                    adapter.dump_python(adapter.validate_python(result, from_attributes=True), mode='json')
+                if self._generation(namespace) == generation:
+                    await self.backend.set(key, value, ttl or self.default_ttl)
+                return value
+            return wrapper
+        return decorator
+
+    async def invalidate(self, namespace: str, *args, **kwargs):
+        self._bump(namespace)
+        await self.backend.delete(self.make_key(namespace, args, kwargs))
+
+    async def invalidate_namespace(self, *namespaces: str):
+        for namespace in namespaces:
+            self._bump(namespace)
+            await self.backend.delete_prefix(namespace + ':')
+
+    async def clear(self):
+        self._cleared += 1
+        await self.backend.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        stats = {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else None,
+        }
+        if isinstance(self.backend, InMemoryCache):
+            stats['size'] = len(self.backend)
+            stats['maxsize'] = self.backend.maxsize
+            stats['evictions'] = self.backend.evictions
+        return stats
+
+
+def create_backend() -> CacheBackend:
+    if settings.cache_backend == 'redis':
+        return RedisCache.from_url(settings.cache_url)
+    return InMemoryCache(maxsize=settings.cache_maxsize)
+
+
+response_cache = ResponseCache(create_backend(), default_ttl=settings.cache_ttl)
@@ -0,0 +1,55 @@
+import asyncio
+
+
+class DataLoader:
+    """
+    Собирает ключи, запрошенные через load() за один проход цикла событий,
+    и загружает их одним вызовом batch_load(keys) -> {key: value}.
+    Живёт в пределах одного запроса, готовые результаты не запоминает:
+    склеиваются только одновременные обращения.
+    """
+
+    def __init__(self, batch_load, max_batch_size: int = 1000):
+        self.batch_load = batch_load
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self._pending: dict = {}
+        self._queue: list = []
+
+    def load(self, key) -> asyncio.Future:
+        future = self._pending.get(key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = future
+        if not self._queue:
+            loop.call_soon(self._dispatch)
+        self._queue.append(key)
+        return future
+
+    async def load_many(self, keys) -> list:
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        asyncio.ensure_future(self._run(keys))
+
+    async def _run(self, keys):
+        # Пачки идут последовательно: все они работают в одной сессии запроса
+        for start in range(0, len(keys), self.max_batch_size):
+            batch = keys[start:start + self.max_batch_size]
+            self.batches += 1
+            try:
+                values = await self.batch_load(batch)
+            except Exception as e:
+                for key in batch:
+                    future = self._pending.pop(key)
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for key in batch:
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_result(values.get(key))
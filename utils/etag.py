@@ -0,0 +1,27 @@
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """Сильный ETag из имени ресурса и версии: одинаковая версия - одинаковые байты ответа."""
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match сравнивается слабо (RFC 9110): W/"x" совпадает с "x"
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    response.headers['ETag'] = etag
+    return response
@@ -0,0 +1,84 @@
+"""
+Geohash: ячейка сетки как строка base32, у вложенных ячеек общий префикс.
+Чётные биты делят долготу, нечётные - широту.
+"""
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DECODE = {char: value for value, char in enumerate(BASE32)}
+
+# Длина geohash у здания; агрегаты для карты хранятся по префиксам до CLUSTER_PRECISION
+PRECISION = 12
+CLUSTER_PRECISION = 8
+
+
+def _bits(precision: int) -> tuple[int, int]:
+    """Сколько бит у широты и у долготы при длине precision."""
+    bits = 5 * precision
+    return bits // 2, bits - bits // 2
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """Размер ячейки в градусах: (по широте, по долготе)."""
+    lat_bits, lon_bits = _bits(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _index(value: float, low: float, size: float, count: int) -> int:
+    return min(max(int((value - low) // size), 0), count - 1)
+
+
+def _encode_index(i: int, j: int, precision: int) -> str:
+    # i - номер полосы по широте, j - по долготе; биты перемежаются, начиная с долготы
+    lat_bits, lon_bits = _bits(precision)
+    value = 0
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            value = value << 1 | (j >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (i >> lat_bits) & 1
+    return ''.join(BASE32[value >> shift & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+
+def encode(lat: float, lon: float, precision: int = PRECISION) -> str:
+    lat_bits, lon_bits = _bits(precision)
+    dlat, dlon = cell_size(precision)
+    return _encode_index(_index(lat, -90.0, dlat, 1 << lat_bits), _index(lon, -180.0, dlon, 1 << lon_bits),
+                         precision)
+
+
+def bounds(cell: str) -> tuple[float, float, float, float]:
+    """(lat_min, lon_min, lat_max, lon_max) ячейки."""
+    lat_min, lat_max, lon_min, lon_max = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in cell:
+        value = DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = value >> shift & 1
+            if even:
+                middle = (lon_min + lon_max) / 2
+                lon_min, lon_max = (middle, lon_max) if bit else (lon_min, middle)
+            else:
+                middle = (lat_min + lat_max) / 2
+                lat_min, lat_max = (middle, lat_max) if bit else (lat_min, middle)
+            even = not even
+    return lat_min, lon_min, lat_max, lon_max
+
+
+def _box_ranges(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precision: int):
+    lat_bits, lon_bits = _bits(precision)
+    dlat, dlon = cell_size(precision)
+    rows = range(_index(lat_min, -90.0, dlat, 1 << lat_bits), _index(lat_max, -90.0, dlat, 1 << lat_bits) + 1)
+    columns = range(_index(lon_min, -180.0, dlon, 1 << lon_bits), _index(lon_max, -180.0, dlon, 1 << lon_bits) + 1)
+    return rows, columns
+
+
+def count_cells_in_box(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precision: int) -> int:
+    rows, columns = _box_ranges(lat_min, lon_min, lat_max, lon_max, precision)
+    return len(rows) * len(columns)
+
+
+def cells_in_box(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precision: int) -> list[str]:
+    """Все ячейки длины precision, пересекающие прямоугольник."""
+    rows, columns = _box_ranges(lat_min, lon_min, lat_max, lon_max, precision)
+    return [_encode_index(i, j, precision) for i in rows for j in columns]
@@ -0,0 +1,247 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Значение снимается при каждом чтении /metrics функцией collect() -> {labels: value}."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in self.collect().items()]
+
+
+class CollectedCounter(Gauge):
+    """Счётчик, который ведёт другой объект (кэш, single-flight); значение снимается при чтении /metrics."""
+    type = 'counter'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (без накопления) + переполнение, сумма, количество]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        samples = metric.samples()
+        if samples:
+            lines.extend(metric.header())
+            lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Статистика текущего HTTP-запроса; запросы к БД вне HTTP (старт, генератор данных) сюда не попадают
+current_request: ContextVar[RequestStats | None] = ContextVar('current_request', default=None)
+
+
+http_requests = Counter('http_requests_total', 'HTTP-запросы', ('method', 'route', 'status'))
+http_request_duration = Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса',
+                                  ('method', 'route'))
+db_queries_per_request = Histogram('db_queries_per_request', 'Запросов к БД на один HTTP-запрос',
+                                   ('method', 'route'), buckets=QUERY_COUNT_BUCKETS)
+db_time_per_request = Histogram('db_time_per_request_seconds', 'Суммарное время запросов к БД на один HTTP-запрос',
+                                ('method', 'route'))
+db_query_duration = Histogram('db_query_duration_seconds', 'Время выполнения одного SQL-запроса')
+db_pool_checkout_wait = Histogram('db_pool_checkout_wait_seconds', 'Ожидание соединения из пула')
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который замеряет, сколько ждали соединение (включая открытие нового)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    db_query_duration.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+# Пулы соединений по имени базы: primary и replica0, replica1, ...
+_pools: dict[str, object] = {}
+
+
+def _pool_values(read) -> dict:
+    return {(name,): read(pool) for name, pool in _pools.items()}
+
+
+Gauge('db_pool_size', 'Постоянных соединений в пуле (pool_size)', lambda: _pool_values(lambda pool: pool.size()),
+      ('database',))
+Gauge('db_pool_checked_out', 'Соединений выдано', lambda: _pool_values(lambda pool: pool.checkedout()), ('database',))
+Gauge('db_pool_checked_in', 'Свободных соединений в пуле', lambda: _pool_values(lambda pool: pool.checkedin()),
+      ('database',))
+# overflow() отрицателен, пока пул не заполнен до pool_size
+Gauge('db_pool_overflow', 'Соединений сверх pool_size', lambda: _pool_values(lambda pool: max(pool.overflow(), 0)),
+      ('database',))
+
+
+def pool_stats() -> dict:
+    return {
+        name: {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        }
+        for name, pool in _pools.items()
+    }
+
+
+def instrument_engine(engine, name: str = 'primary'):
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+    pool = sync_engine.pool
+    if hasattr(pool, 'checkedout'):
+        _pools[name] = pool
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время запроса, число и время запросов к БД по шаблону маршрута."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = scope.get('route')
+            # Шаблон пути, а не сам путь: иначе по метке на каждый id
+            route = route.path if route is not None else 'unmatched'
+            method = scope['method']
+            http_requests.inc(method, route, status)
+            http_request_duration.observe(elapsed, method, route)
+            db_queries_per_request.observe(stats.queries, method, route)
+            db_time_per_request.observe(stats.db_time, method, route)
@@ -0,0 +1,49 @@
+import json
+from typing import Annotated
+
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+
+
+Limit = Annotated[int | None, Query(ge=1, le=1000)]
+
+DEFAULT_LIMIT = 100
+
+NEXT_CURSOR_HEADER = 'X-Next-After-Id'
+NEXT_OFFSET_HEADER = 'X-Next-Offset'
+
+
+def page_limit(after_id: int | None, limit: int | None) -> int | None:
+    """Без after_id и limit - весь список, как до появления пагинации; с after_id без limit - DEFAULT_LIMIT."""
+    if limit is None and after_id is not None:
+        return DEFAULT_LIMIT
+    return limit
+
+
+def set_next_cursor(response: Response, items, limit: int):
+    # Полная страница: клиент продолжает с after_id из заголовка, неполная или весь список - данных больше нет
+    if limit is not None and len(items) == limit:
+        last = items[-1]
+        if isinstance(last, str):
+            # Готовый JSON-документ read-модели
+            last = json.loads(last)
+        response.headers[NEXT_CURSOR_HEADER] = str(last['id'] if isinstance(last, dict) else last.id)
+
+
+def set_next_offset(response: Response, items, limit: int, offset: int):
+    # Для выдачи, отсортированной не по id (например, по релевантности), курсор - смещение
+    if len(items) == limit:
+        response.headers[NEXT_OFFSET_HEADER] = str(offset + limit)
+
+
+def ndjson_response(items, schema) -> StreamingResponse:
+    """Отдаёт объекты построчно в NDJSON по мере чтения, не собирая весь ответ в памяти."""
+    async def lines():
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                yield schema.model_validate(item, from_attributes=True).model_dump_json() + '\n'
+        else:
+            for item in items:
+                yield schema.model_validate(item, from_attributes=True).model_dump_json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
@@ -0,0 +1,97 @@
+import logging
+import math
+from contextvars import ContextVar
+from functools import wraps
+
+from sqlalchemy import event
+
+from config import settings
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# raise, warn или off - см. config.Settings.query_budget_mode
+QUERY_BUDGET_MODE = settings.query_budget_mode
+
+query_budget_exceeded = metrics.Counter('query_budget_exceeded_total', 'Превышения бюджета запросов к БД', ('budget',))
+
+_active: ContextVar[tuple] = ContextVar('query_budgets', default=())
+
+# selectinload подгружает связи пачками по 500 ключей родителя
+SELECTIN_CHUNK = 500
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    """
+    Ограничение на число SQL-запросов внутри блока. Бюджеты вкладываются:
+    запрос засчитывается всем открытым бюджетам текущего контекста, включая дочерние задачи.
+    """
+
+    def __init__(self, max_queries: int | None, name: str):
+        self.max_queries = max_queries
+        self.name = name
+        self.statements: list[str] = []
+
+    def __enter__(self):
+        self._token = _active.set(_active.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.reset(self._token)
+        if exc_type is None:
+            self.check()
+
+    def check(self):
+        if self.max_queries is None or len(self.statements) <= self.max_queries:
+            return
+        query_budget_exceeded.inc(self.name)
+        listing = '\n'.join(f'{i}. {" ".join(statement.split())[:300]}' for i, statement in enumerate(self.statements, 1))
+        message = f"Превышен бюджет запросов {self.name}: {len(self.statements)} > {self.max_queries}\n{listing}"
+        if QUERY_BUDGET_MODE == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def query_budget(max_queries, name: str | None = None, per_rows: int | None = None):
+    """
+    Декоратор для асинхронных маршрутов и методов сервисов. Бюджет объявляет каждый маршрут:
+    - число - потолок, если число запросов не зависит от объёма данных;
+    - функция от аргументов вызова - для пакетных операций, где запросов столько, сколько пачек во входе;
+    - None - бюджет объявлен, но не ограничен: число запросов растёт с объёмом данных (выборка без пагинации,
+      пересборка документов организаций, импорт файла). Такой маршрут ограничивают бюджеты методов сервиса,
+      которые он вызывает: на каждую пачку или через per_rows.
+    per_rows - бюджет выдаётся на каждые per_rows строк результата: так выборка без пагинации
+    может грузить связи пачками, а запрос на каждую строку (N+1) всё равно не пройдёт.
+    """
+    def decorator(func):
+        budget_name = name or func.__qualname__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            limit = max_queries(*args, **kwargs) if callable(max_queries) else max_queries
+            budget = QueryBudget(None if per_rows else limit, budget_name)
+            with budget:
+                result = await func(*args, **kwargs)
+            if per_rows and limit is not None:
+                budget.max_queries = limit * max(1, math.ceil(len(result) / per_rows))
+                budget.check()
+            return result
+
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for budget in _active.get():
+        budget.statements.append(statement)
+
+
+def instrument_engine(engine):
+    if QUERY_BUDGET_MODE != 'off':
+        event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
@@ -1,9 +1,30 @@
+import json
 from abc import ABC, abstractmethod
 
-from sqlalchemy import insert, select, update, delete
+from sqlalchemy import JSON, Float, func, insert, select, update, delete, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload
 
-from database.db import get_session
+from utils.singleflight import coalesced
+
+
+def name_search(stmt, organization_table, query: str, dialect_name: str):
+    """Условие и порядок нечёткого поиска по названию организации, самые похожие - первыми."""
+    name = organization_table.name
+    if dialect_name == 'postgresql':
+        # query <% name - в названии есть фрагмент, похожий на запрос (word_similarity не ниже
+        # pg_trgm.word_similarity_threshold): находит префиксы и опечатки без учёта регистра.
+        # query <<-> name - расстояние 1 - word_similarity, ближайшие GiST-индекс отдаёт без сортировки
+        return (
+            stmt.where(literal(query).bool_op('<%')(name))
+            .order_by(literal(query).op('<<->', return_type=Float)(name), organization_table.id)
+        )
+    # Без pg_trgm - только подстрока; lower() в SQLite не знает кириллицы
+    return (
+        stmt.where(name.icontains(query, autoescape=True))
+        .order_by(name.istartswith(query, autoescape=True).desc(), name, organization_table.id)
+    )
+
 
 class AbstractRepository(ABC):
     @abstractmethod
@@ -40,118 +61,571 @@ class AbstractRepository(ABC):
 
 
 class SQLAlchemyRepository(AbstractRepository):
-    def __init__(self, model):
+    def __init__(self, model, uow):
         self.model = model
+        self.uow = uow
+
+    @property
+    def session(self):
+        return self.uow.session
+
+    def _keyset(self, stmt, after_id: int | None = None, limit: int | None = None):
+        # Постраничная выдача по первичному ключу: WHERE id > after_id ORDER BY id LIMIT limit
+        stmt = stmt.order_by(self.model.id)
+        if after_id is not None:
+            stmt = stmt.where(self.model.id > after_id)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
 
-    async def find_all(self):
-        async with get_session() as session:
-            stmt = select(self.model)
-            res = await session.execute(stmt)
-            return res.scalars().all()
+    async def find_all(self, after_id: int | None = None, limit: int | None = None):
+        session = self.session
+        stmt = self._keyset(select(self.model), after_id, limit)
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    async def stream_all(self, after_id: int | None = None, yield_per: int = 500):
+        session = self.session
+        stmt = self._keyset(select(self.model), after_id).execution_options(yield_per=yield_per)
+        res = await session.stream_scalars(stmt)
+        async for obj in res:
+            yield obj
         
+    async def find_columns(self, *column_names: str):
+        session = self.session
+        stmt = select(*(getattr(self.model, name) for name in column_names))
+        res = await session.execute(stmt)
+        return res.all()
+
     async def find_one_with_filter(self, obj):
-        async with get_session() as session:
-            key_filter = obj['filter_key']
-            value_filter = obj['filter_value']
-            stmt = select(self.model).where(getattr(self.model, key_filter) == value_filter)
-            res = await session.execute(stmt)
-            return res.scalar_one_or_none()
+        session = self.session
+        key_filter = obj['filter_key']
+        value_filter = obj['filter_value']
+        # Значение может быть неуникальным (например, название): берётся запись с наименьшим id
+        stmt = select(self.model).where(getattr(self.model, key_filter) == value_filter).order_by(self.model.id).limit(1)
+        res = await session.execute(stmt)
+        return res.scalars().first()
 
     async def find_all_with_filter(self, obj: dict):
-        async with get_session() as session:
-            key_filter = obj['filter_key']
-            value_filter = obj['filter_value']
-            stmt = select(self.model).where(getattr(self.model, key_filter) == value_filter)
-            res = await session.execute(stmt)
-            return res.scalars().all()
+        session = self.session
+        key_filter = obj['filter_key']
+        value_filter = obj['filter_value']
+        stmt = select(self.model).where(getattr(self.model, key_filter) == value_filter)
+        res = await session.execute(stmt)
+        return res.scalars().all()
 
     async def find_all_with_filter_in(self, column_name: str, values: set, table):
-        async with get_session() as session:
-            stmt = select(table).where(getattr(table, column_name).in_(values))
-            res = await session.execute(stmt)
-            return res.scalars().all()
+        session = self.session
+        stmt = select(table).where(getattr(table, column_name).in_(values))
+        res = await session.execute(stmt)
+        return res.scalars().all()
 
     async def add_one(self, data: dict) -> int:
-        async with get_session() as session:
-            stmt = insert(self.model).values(**data).returning(self.model.id)
-            res = await session.execute(stmt)
-            await session.commit()
-            return res.scalar_one()
+        session = self.session
+        stmt = insert(self.model).values(**data).returning(self.model.id)
+        res = await session.execute(stmt)
+        return res.scalar_one()
         
+    async def add_many(self, rows: list[dict]) -> list[int]:
+        if not rows:
+            return []
+        session = self.session
+        stmt = insert(self.model).returning(self.model.id, sort_by_parameter_order=True)
+        res = await session.execute(stmt, rows)
+        return res.scalars().all()
+
+    async def copy_rows(self, table, columns: list[str], records: list[tuple]):
+        if not records:
+            return
+        session = self.session
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        if hasattr(driver_connection, 'copy_records_to_table'):
+            # asyncpg: COPY в той же транзакции, что и остальные запросы сессии.
+            # Адаптер SQLAlchemy шлёт BEGIN только перед первым запросом через него, а COPY идёт мимо:
+            # без этого COPY в ещё не начатой транзакции зафиксируется сам, и rollback его не отменит
+            if not driver_connection.is_in_transaction():
+                await session.execute(select(literal(1)))
+            # JSON-колонки COPY принимает только строкой
+            json_positions = [i for i, column in enumerate(columns) if isinstance(table.__table__.c[column].type, JSON)]
+            if json_positions:
+                records = [
+                    tuple(json.dumps(value, ensure_ascii=False) if i in json_positions and value is not None else value
+                          for i, value in enumerate(record))
+                    for record in records
+                ]
+            await driver_connection.copy_records_to_table(table.__tablename__, records=records, columns=columns)
+        else:
+            await session.execute(insert(table), [dict(zip(columns, record)) for record in records])
+
+    async def reset_id_sequence(self):
+        # После вставки с явными id счётчик serial-колонки нужно догнать до max(id)
+        session = self.session
+        if session.bind.dialect.name != 'postgresql':
+            return
+        table = self.model.__tablename__
+        await session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT max(id) FROM {table}), 1), (SELECT max(id) FROM {table}) IS NOT NULL)"))
+
     async def add_relation(self, table, **kwargs):
-        async with get_session() as session:
-            stmt = insert(table).values(**kwargs)
-            await session.execute(stmt)
-            await session.commit()
+        session = self.session
+        stmt = insert(table).values(**kwargs)
+        await session.execute(stmt)
+
+    async def add_relations(self, table, rows: list[dict]):
+        if not rows:
+            return
+        session = self.session
+        stmt = insert(table).values(rows)
+        await session.execute(stmt)
+
+    async def sync_relations(self, table, owner_column: str, owner_id: int, target_column: str, target_ids) -> tuple[set, set]:
+        session = self.session
+        owner = getattr(table, owner_column)
+        target = getattr(table, target_column)
+        res = await session.execute(select(target).where(owner == owner_id))
+        existing = set(res.scalars().all())
+        target_ids = set(target_ids)
+
+        added = target_ids - existing
+        removed = existing - target_ids
+        if removed:
+            await session.execute(delete(table).where(owner == owner_id, target.in_(removed)))
+        await self.add_relations(table, [{owner_column: owner_id, target_column: target_id} for target_id in added])
+        return added, removed
 
     async def delete_relations(self, table, filter_column, filter_value):
-        async with get_session() as session:
-            stmt = delete(table).where(getattr(table, filter_column) == filter_value)
-            await session.execute(stmt)
-            await session.commit()
+        session = self.session
+        stmt = delete(table).where(getattr(table, filter_column) == filter_value)
+        await session.execute(stmt)
             
     async def update_one(self, obj_id: int, data: dict) -> int:
-        async with get_session() as session:
-            exists = await session.execute(select(self.model).where(self.model.id == obj_id))
-            if not exists.scalar():
-                raise ValueError(f"Объект с id {obj_id} не найден")
-            stmt = update(self.model).where(self.model.id == obj_id).values(**data).returning(self.model.id)
-            res = await session.execute(stmt)
-            await session.commit()
-            return res.scalar_one()
+        session = self.session
+        stmt = update(self.model).where(self.model.id == obj_id).values(**data).returning(self.model.id)
+        res = await session.execute(stmt)
+        updated_id = res.scalar_one_or_none()
+        if updated_id is None:
+            raise ValueError(f"Объект с id {obj_id} не найден")
+        return updated_id
         
     async def delete_one(self, obj_id: int):
-        async with get_session() as session:
-            exists = await session.execute(select(self.model).where(self.model.id == obj_id))
-            if not exists.scalar():
-                raise ValueError(f"Объект с id {obj_id} не найден")
-            stmt = delete(self.model).where(self.model.id == obj_id)
-            await session.execute(stmt)
-            await session.commit()
+        session = self.session
+        stmt = delete(self.model).where(self.model.id == obj_id).returning(self.model.id)
+        res = await session.execute(stmt)
+        if res.scalar_one_or_none() is None:
+            raise ValueError(f"Объект с id {obj_id} не найден")
         
 
+class SQLAlchemyActivityRepository(SQLAlchemyRepository):
+    REBUILD_CLOSURE_SQL = text(
+        "INSERT INTO activity_closure (ancestor_id, descendant_id, depth) "
+        "WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS ("
+        "    SELECT id, id, 0 FROM activities "
+        "    UNION ALL "
+        "    SELECT tree.ancestor_id, activities.id, tree.depth + 1 "
+        "    FROM tree JOIN activities ON activities.parent_id = tree.descendant_id"
+        ") "
+        "SELECT ancestor_id, descendant_id, depth FROM tree"
+    )
+
+    async def add_closure(self, table, activity_id: int, parent_id: int | None):
+        session = self.session
+        await session.execute(insert(table).values(ancestor_id=activity_id, descendant_id=activity_id, depth=0))
+        if parent_id is not None:
+            ancestors = (
+                select(table.ancestor_id, literal(activity_id), table.depth + 1)
+                .where(table.descendant_id == parent_id)
+            )
+            stmt = insert(table).from_select(['ancestor_id', 'descendant_id', 'depth'], ancestors)
+            await session.execute(stmt)
+
+    async def rebuild_closure(self, table):
+        session = self.session
+        await session.execute(delete(table))
+        await session.execute(self.REBUILD_CLOSURE_SQL)
+
+
+class SQLAlchemyVersionRepository(SQLAlchemyRepository):
+    async def get_version(self, name: str) -> int:
+        session = self.session
+        stmt = select(self.model.version).where(self.model.name == name)
+        res = await session.execute(stmt)
+        return res.scalar_one_or_none() or 0
+
+    async def bump(self, name: str) -> int:
+        session = self.session
+        stmt = (
+            pg_insert(self.model)
+            .values(name=name, version=1)
+            .on_conflict_do_update(index_elements=[self.model.name], set_={'version': self.model.version + 1})
+            .returning(self.model.version)
+        )
+        res = await session.execute(stmt)
+        return res.scalar_one()
+
+
 class SQLAlchemyOrganizationRepository(SQLAlchemyRepository):
-    async def find_all_with_relations(self):
-        async with get_session() as session:
-            stmt = select(self.model).options(
-                selectinload(self.model.building),
-                selectinload(self.model.activities)
+    # Связи организации, которые подгружаются по умолчанию; include=() - только собственные поля
+    RELATIONS = ('activities', 'building')
+
+    def _relation_options(self, include):
+        return [selectinload(getattr(self.model, relation)) for relation in include]
+
+    async def find_all_with_relations(self, after_id: int | None = None, limit: int | None = None,
+                                      include=RELATIONS):
+        session = self.session
+        stmt = select(self.model).options(*self._relation_options(include))
+        stmt = self._keyset(stmt, after_id, limit)
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    async def stream_all_with_relations(self, after_id: int | None = None, yield_per: int = 500,
+                                        include=RELATIONS):
+        session = self.session
+        stmt = select(self.model).options(*self._relation_options(include))
+        stmt = self._keyset(stmt, after_id).execution_options(yield_per=yield_per)
+        res = await session.stream_scalars(stmt)
+        async for obj in res:
+            yield obj
+
+    async def find_one_with_relations(self, obj, include=RELATIONS):
+        session = self.session
+        key_filter = obj['filter_key']
+        value_filter = obj['filter_value']
+        stmt = (
+            select(self.model)
+            .where(getattr(self.model, key_filter) == value_filter)
+            .order_by(self.model.id)
+            .limit(1)
+            .options(*self._relation_options(include))
+            # В рамках одной единицы работы объект мог быть загружен до изменений
+            .execution_options(populate_existing=True)
+        )
+        res = await session.execute(stmt)
+        return res.scalars().first()
+
+    async def find_by_ids_with_relations(self, ids: list[int], include=RELATIONS, for_update: bool = False):
+        # Один IN-запрос на организации и по одному selectin-запросу на здания и деятельности
+        session = self.session
+        stmt = (
+            select(self.model)
+            .where(self.model.id.in_(ids))
+            .options(*self._relation_options(include))
+            .execution_options(populate_existing=True)
+        )
+        if for_update:
+            # Строки блокируются в порядке id: две транзакции с пересекающимися наборами не ждут друг друга по кругу
+            stmt = stmt.order_by(self.model.id).with_for_update(of=self.model)
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    @coalesced
+    async def find_version(self, obj_id: int) -> int | None:
+        session = self.session
+        res = await session.execute(select(self.model.version).where(self.model.id == obj_id))
+        return res.scalar_one_or_none()
+
+    async def bump_versions(self, ids: list[int]):
+        session = self.session
+        version = self.model.version + 1
+        if session.bind.dialect.name == 'postgresql':
+            # Каждой строке - своё значение последовательности версий, а не +1 к своей
+            version = self.model.__table__.c.version.default.next_value()
+        await session.execute(update(self.model).where(self.model.id.in_(ids)).values(version=version))
+
+    async def search_by_name(self, query: str, limit: int, offset: int = 0, include=RELATIONS):
+        session = self.session
+        stmt = select(self.model).options(*self._relation_options(include))
+        stmt = name_search(stmt, self.model, query, session.bind.dialect.name)
+        res = await session.execute(stmt.limit(limit).offset(offset))
+        return res.scalars().all()
+
+    async def find_by_activity_ids(self, activity_ids: list[int], table, closure_table=None,
+                                   include=RELATIONS):
+        session = self.session
+        organization_ids = select(table.organization_id)
+        if closure_table is None:
+            organization_ids = organization_ids.where(table.activity_id.in_(activity_ids))
+        else:
+            # Разворачиваем каждую деятельность во всё её поддерево через таблицу замыкания
+            organization_ids = (
+                organization_ids
+                .join(closure_table, closure_table.descendant_id == table.activity_id)
+                .where(closure_table.ancestor_id.in_(activity_ids))
             )
-            res = await session.execute(stmt)
-            return res.scalars().all()
-
-    async def find_one_with_relations(self, obj):
-        async with get_session() as session:
-            key_filter = obj['filter_key']
-            value_filter = obj['filter_value']
-            stmt = (
-                select(self.model)
-                .where(getattr(self.model, key_filter) == value_filter)
-                .options(
-                    selectinload(self.model.building),
-                    selectinload(self.model.activities)
-                )
+        stmt = (
+            select(self.model)
+            .where(self.model.id.in_(organization_ids))
+            .options(*self._relation_options(include))
+        )
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    async def find_organizations_with_building_and_activities_by_building_ids(self, building_ids: list[int],
+                                                                             include=RELATIONS):
+        session = self.session
+        stmt = select(self.model).where(self.model.building_id.in_(building_ids)) \
+            .options(*self._relation_options(include))
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    async def find_organizations_in_box(self, building_table, lat_min: float, lon_min: float,
+                                        lat_max: float, lon_max: float, include=RELATIONS):
+        session = self.session
+        stmt = (
+            select(self.model)
+            .join(building_table)
+            .where(
+                building_table.lat.between(lat_min, lat_max),
+                building_table.lon.between(lon_min, lon_max)
             )
-            res = await session.execute(stmt)
-            return res.scalar_one_or_none()
-
-    async def find_by_activity_ids(self, activity_ids: list[int], table):
-        async with get_session() as session:
-            stmt = (
-                select(self.model)
-                .join(table)
-                .where(table.activity_id.in_(activity_ids))
-                .options(
-                    selectinload(self.model.building),
-                    selectinload(self.model.activities)
-                )
+            .options(*self._relation_options(include))
+        )
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+
+class SQLAlchemyDocumentRepository(SQLAlchemyRepository):
+    """Документы read-модели организаций: чтения отдают готовый JSON, без сборки из таблиц."""
+
+    @coalesced
+    async def find_documents(self, after_id: int | None = None, limit: int | None = None):
+        session = self.session
+        stmt = select(self.model.organization_id, self.model.document).order_by(self.model.organization_id)
+        if after_id is not None:
+            stmt = stmt.where(self.model.organization_id > after_id)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        res = await session.execute(stmt)
+        return res.all()
+
+    @coalesced
+    async def find_documents_by_ids(self, ids: list[int]):
+        session = self.session
+        stmt = select(self.model.organization_id, self.model.document).where(self.model.organization_id.in_(ids))
+        res = await session.execute(stmt)
+        return res.all()
+
+    @coalesced
+    async def find_documents_by_building_ids(self, building_ids: list[int]):
+        session = self.session
+        stmt = select(self.model.building_id, self.model.document).where(self.model.building_id.in_(building_ids))
+        res = await session.execute(stmt)
+        return res.all()
+
+    @coalesced
+    async def find_documents_in_box(self, building_table, lat_min: float, lon_min: float,
+                                    lat_max: float, lon_max: float):
+        session = self.session
+        stmt = (
+            select(self.model.document)
+            .join(building_table, building_table.id == self.model.building_id)
+            .where(
+                building_table.lat.between(lat_min, lat_max),
+                building_table.lon.between(lon_min, lon_max)
             )
-            res = await session.execute(stmt)
-            return res.scalars().all()
-
-    async def find_organizations_with_building_and_activities_by_building_ids(self, building_ids: list[int]):
-        async with get_session() as session:
-            stmt = select(self.model).where(self.model.building_id.in_(building_ids)) \
-                .options(selectinload(self.model.building), selectinload(self.model.activities))
-            res = await session.execute(stmt)
-            return res.scalars().all()
+        )
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    @coalesced
+    async def find_documents_by_activity_ids(self, activity_ids: list[int], table, closure_table=None):
+        session = self.session
+        organization_ids = select(table.organization_id)
+        if closure_table is None:
+            organization_ids = organization_ids.where(table.activity_id.in_(activity_ids))
+        else:
+            organization_ids = (
+                organization_ids
+                .join(closure_table, closure_table.descendant_id == table.activity_id)
+                .where(closure_table.ancestor_id.in_(activity_ids))
+            )
+        stmt = select(self.model.document).where(self.model.organization_id.in_(organization_ids))
+        res = await session.execute(stmt)
+        return res.scalars().all()
+
+    @coalesced
+    async def find_document_by_name(self, organization_table, name: str):
+        session = self.session
+        stmt = (
+            select(self.model.document)
+            .join(organization_table, organization_table.id == self.model.organization_id)
+            .where(organization_table.name == name)
+            .order_by(organization_table.id)
+            .limit(1)
+        )
+        res = await session.execute(stmt)
+        return res.scalars().first()
+
+    @coalesced
+    async def search_documents(self, organization_table, query: str, limit: int, offset: int = 0):
+        session = self.session
+        stmt = select(self.model.document).join(organization_table,
+                                                organization_table.id == self.model.organization_id)
+        stmt = name_search(stmt, organization_table, query, session.bind.dialect.name)
+        res = await session.execute(stmt.limit(limit).offset(offset))
+        return res.scalars().all()
+
+    async def find_organization_ids(self, id_column, filter_column, value) -> list[int]:
+        # id организаций, чьи документы надо пересобрать: по зданию или по деятельности
+        session = self.session
+        res = await session.execute(select(id_column).where(filter_column == value))
+        return res.scalars().all()
+
+    async def delete_documents(self, organization_ids=None):
+        # None - все документы, перед полной пересборкой. Иначе - удалённые строки (building_id, document):
+        # по старым документам видно, из каких зданий ушли организации
+        session = self.session
+        stmt = delete(self.model)
+        if organization_ids is None:
+            await session.execute(stmt)
+            return []
+        stmt = stmt.where(self.model.organization_id.in_(organization_ids)).returning(
+            self.model.building_id, self.model.document)
+        res = await session.execute(stmt)
+        return res.all()
+
+
+class SQLAlchemyClusterRepository(SQLAlchemyRepository):
+    """Агрегаты организаций по ячейкам geohash для карты."""
+
+    @coalesced
+    async def find_clusters(self, precision: int, cells: list[str]):
+        session = self.session
+        stmt = (
+            select(self.model.cell, self.model.organizations, self.model.lat_sum, self.model.lon_sum)
+            .where(self.model.precision == precision, self.model.cell.in_(cells), self.model.organizations > 0)
+            .order_by(self.model.cell)
+        )
+        res = await session.execute(stmt)
+        return res.all()
+
+    async def add_deltas(self, rows: list[dict]):
+        # Приращения складываются с тем, что уже лежит в ячейке, одним INSERT ... ON CONFLICT DO UPDATE
+        if not rows:
+            return
+        session = self.session
+        stmt = pg_insert(self.model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.model.precision, self.model.cell],
+            set_={
+                'organizations': self.model.organizations + stmt.excluded.organizations,
+                'lat_sum': self.model.lat_sum + stmt.excluded.lat_sum,
+                'lon_sum': self.model.lon_sum + stmt.excluded.lon_sum,
+            })
+        await session.execute(stmt)
+
+    @staticmethod
+    def _count_clusters(document_table, building_table, max_precision: int):
+        # Самые мелкие ячейки: организации с документом по зданиям
+        cell = func.substr(building_table.geohash, 1, max_precision)
+        return (
+            select(literal(max_precision), cell, func.count(), func.sum(building_table.lat),
+                   func.sum(building_table.lon))
+            .select_from(document_table)
+            .join(building_table, building_table.id == document_table.building_id)
+            .group_by(cell)
+        )
+
+    async def count_clusters(self, document_table, building_table, max_precision: int):
+        """Самые мелкие ячейки, посчитанные заново по документам: для сверки с агрегатами."""
+        session = self.session
+        res = await session.execute(self._count_clusters(document_table, building_table, max_precision))
+        return res.all()
+
+    async def rebuild(self, document_table, building_table, max_precision: int):
+        """Все агрегаты заново: самые мелкие ячейки из документов, крупные - из мелких."""
+        session = self.session
+        await session.execute(delete(self.model))
+        columns = ['precision', 'cell', 'organizations', 'lat_sum', 'lon_sum']
+        await session.execute(insert(self.model).from_select(
+            columns, self._count_clusters(document_table, building_table, max_precision)))
+        for precision in range(max_precision - 1, 0, -1):
+            cell = func.substr(self.model.cell, 1, precision)
+            await session.execute(insert(self.model).from_select(columns, (
+                select(literal(precision), cell, func.sum(self.model.organizations), func.sum(self.model.lat_sum),
+                       func.sum(self.model.lon_sum))
+                .where(self.model.precision == precision + 1)
+                .group_by(cell)
+            )))
+
+
+class SQLAlchemyFacetRepository(SQLAlchemyRepository):
+    """Число организаций под каждой деятельностью вместе с потомками."""
+
+    @coalesced
+    async def find_facets(self):
+        session = self.session
+        stmt = (
+            select(self.model.activity_id, self.model.organizations)
+            .where(self.model.organizations > 0)
+            .order_by(self.model.activity_id)
+        )
+        res = await session.execute(stmt)
+        return res.all()
+
+    @staticmethod
+    def _count_facets(relation_table, closure_table):
+        # Организация с деятельностью и её потомком считается у предка один раз
+        return (
+            select(closure_table.ancestor_id, func.count(relation_table.organization_id.distinct()))
+            .join(closure_table, closure_table.descendant_id == relation_table.activity_id)
+            .group_by(closure_table.ancestor_id)
+            .order_by(closure_table.ancestor_id)
+        )
+
+    @coalesced
+    async def find_facets_in_box(self, relation_table, closure_table, document_table, building_table,
+                                 lat_min: float, lon_min: float, lat_max: float, lon_max: float):
+        # Счётчиков по произвольному прямоугольнику нет: считаем по организациям в нём
+        session = self.session
+        stmt = (
+            self._count_facets(relation_table, closure_table)
+            .join(document_table, document_table.organization_id == relation_table.organization_id)
+            .join(building_table, building_table.id == document_table.building_id)
+            .where(
+                building_table.lat.between(lat_min, lat_max),
+                building_table.lon.between(lon_min, lon_max)
+            )
+        )
+        res = await session.execute(stmt)
+        return res.all()
+
+    async def count_facets(self, relation_table, closure_table, document_table):
+        """Счётчики, посчитанные заново по связям: для сверки с теми, что ведутся при записи."""
+        session = self.session
+        stmt = self._count_facets(relation_table, closure_table).join(
+            document_table, document_table.organization_id == relation_table.organization_id)
+        res = await session.execute(stmt)
+        return res.all()
+
+    async def find_ancestors(self, closure_table, activity_ids) -> dict[int, set[int]]:
+        # Деятельность -> она сама и все её предки
+        session = self.session
+        stmt = (
+            select(closure_table.descendant_id, closure_table.ancestor_id)
+            .where(closure_table.descendant_id.in_(activity_ids))
+        )
+        res = await session.execute(stmt)
+        ancestors = {}
+        for descendant_id, ancestor_id in res.all():
+            ancestors.setdefault(descendant_id, set()).add(ancestor_id)
+        return ancestors
+
+    async def add_deltas(self, rows: list[dict]):
+        if not rows:
+            return
+        session = self.session
+        stmt = pg_insert(self.model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.model.activity_id],
+            set_={'organizations': self.model.organizations + stmt.excluded.organizations})
+        await session.execute(stmt)
+
+    async def replace_all(self, rows: list[dict]):
+        session = self.session
+        await session.execute(delete(self.model))
+        if rows:
+            await session.execute(insert(self.model), rows)
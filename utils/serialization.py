@@ -0,0 +1,26 @@
+from fastapi import Response
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+
+def json_response(content, adapter: TypeAdapter | None = None, status_code: int = 200) -> Response:
+    """
+    Кодирует ответ сразу в байты, минуя проверку response_model в FastAPI.
+    Без adapter content должен быть уже JSON-совместимым (например, из кэша ответов),
+    с adapter - ORM-объекты сериализуются заранее собранной схемой.
+    """
+    if adapter is None:
+        body = to_json(content)
+    else:
+        body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+    return Response(content=body, status_code=status_code, media_type='application/json')
+
+
+def raw_json_response(body: str | bytes, status_code: int = 200) -> Response:
+    """Ответ из уже готового JSON, например документа read-модели организаций."""
+    return Response(content=body, status_code=status_code, media_type='application/json')
+
+
+def join_json(documents) -> str:
+    # Элементы - уже JSON, массив из них склеивается без разбора и повторной сериализации
+    return '[' + ','.join(documents) + ']'
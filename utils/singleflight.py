@@ -0,0 +1,87 @@
+import asyncio
+from functools import wraps
+
+
+class SingleFlight:
+    """
+    Склеивает одинаковые одновременные вызовы: первый вызов с данным ключом выполняет запрос,
+    остальные ждут его результат, а не идут в базу сами.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # Лидера отменили вместе с его запросом: выполняем сами или ждём нового лидера
+            return await self.do(key, fn)
+
+        # Лидер выполняет запрос сам, в своей сессии; остальные ждут его результат
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._retrieve)
+        self._calls[key] = future
+        self.executed += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def forget_all(self):
+        """После записи: начатые до неё запросы доработают для своих ожидающих, новые вызовы к ним не присоединятся."""
+        self._calls.clear()
+
+    @staticmethod
+    def _retrieve(future: asyncio.Future):
+        # Ошибку лидер уже получил сам: без ожидающих она не должна попадать в лог как непрочитанная
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls),
+        }
+
+
+query_flight = SingleFlight()
+
+
+def coalesced(func):
+    """
+    Для читающих методов репозитория, которые отдают готовые строки, а не ORM-объекты:
+    результат делят несколько запросов, и он не должен зависеть от сессии, в которой загружен.
+    В читающей единице работы одинаковые одновременные вызовы выполняются одним запросом
+    в сессии первого из них - отдельное соединение из пула под single-flight не берётся.
+    В пишущей единице работы метод всегда работает в своей сессии, чтобы видеть свои изменения.
+    """
+    @wraps(func)
+    async def wrapper(repository, *args, **kwargs):
+        uow = repository.uow
+        if not uow.read_only or uow.written:
+            return await func(repository, *args, **kwargs)
+
+        # Фабрика сессий - часть ключа: чтение с основной базы не ждёт запрос, ушедший на реплику
+        key = (f"{id(uow.session_factory)}:{type(repository).__name__}:{repository.model.__name__}:{func.__name__}:"
+               f"{args!r}:{sorted(kwargs.items())!r}")
+        return await query_flight.do(key, lambda: func(repository, *args, **kwargs))
+    return wrapper
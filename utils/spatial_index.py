@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import math
+import time
+from array import array
+
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_many(lat: float, lon: float, lats, lons) -> list[float]:
+    """Расстояния в метрах от точки (lat, lon) до набора точек за один проход."""
+    lat_rad = math.radians(lat)
+    cos_lat = math.cos(lat_rad)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+
+    def distance(other_lat, other_lon):
+        other_lat_rad = radians(other_lat)
+        sin_dlat = sin((other_lat_rad - lat_rad) / 2)
+        sin_dlon = sin(radians(other_lon - lon) / 2)
+        h = sin_dlat * sin_dlat + cos_lat * cos(other_lat_rad) * sin_dlon * sin_dlon
+        return 2 * EARTH_RADIUS_M * asin(sqrt(min(h, 1.0)))
+
+    return list(map(distance, lats, lons))
+
+
+class BuildingSpatialIndex:
+    """
+    Равномерная сетка по координатам зданий.
+    Координаты лежат в плотных массивах array('d'), ячейка сетки хранит id зданий.
+    version - счётчик 'buildings' в entity_versions на момент загрузки, как у дерева деятельностей:
+    здания, записанные другим процессом, видны по выросшему счётчику.
+    """
+
+    def __init__(self, cell_size: float = 0.01, check_interval: float = 1.0):
+        self.cell_size = cell_size
+        self.check_interval = check_interval
+        self.loaded = False
+        self.version = 0
+        self.checked_at = 0.0
+        self.lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.positions: dict[int, int] = {}
+        self.cells: dict[tuple[int, int], array] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def load(self, rows, version: int = 0):
+        self._reset()
+        for building_id, lat, lon in rows:
+            self.add(building_id, lat, lon)
+        self.version = version
+        self.loaded = True
+        self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        self.loaded = False
+
+    async def ensure_fresh(self, load_version, load_rows):
+        if self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+            return self
+        async with self.lock:
+            if self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+                return self
+            version = await load_version()
+            if not self.loaded or version != self.version:
+                self.load(await load_rows(), version)
+            self.checked_at = time.monotonic()
+        return self
+
+    def _apply(self, version: int, patch):
+        # Патчим только если между нашей загрузкой и записью зданий никто другой не менял
+        if self.loaded and version == self.version + 1:
+            patch()
+            self.version = version
+        else:
+            self.invalidate()
+
+    def put(self, building_id: int, lat: float, lon: float, version: int):
+        self._apply(version, lambda: self.add(building_id, lat, lon))
+
+    def discard(self, building_id: int, version: int):
+        self._apply(version, lambda: self.remove(building_id))
+
+    def add(self, building_id: int, lat: float, lon: float):
+        if building_id in self.positions:
+            self.remove(building_id)
+        self.positions[building_id] = len(self.ids)
+        self.ids.append(building_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.cells.setdefault(self._cell(lat, lon), array('q')).append(building_id)
+
+    def remove(self, building_id: int):
+        position = self.positions.pop(building_id, None)
+        if position is None:
+            return
+        cell = self._cell(self.lats[position], self.lons[position])
+        self.cells[cell].remove(building_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+        # Переносим последний элемент на место удалённого, чтобы массивы оставались плотными
+        last = len(self.ids) - 1
+        if position != last:
+            last_id = self.ids[last]
+            self.ids[position] = last_id
+            self.lats[position] = self.lats[last]
+            self.lons[position] = self.lons[last]
+            self.positions[last_id] = position
+        del self.ids[last], self.lats[last], self.lons[last]
+
+    def _cells_in_box(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float):
+        i_min, j_min = self._cell(lat_min, lon_min)
+        i_max, j_max = self._cell(lat_max, lon_max)
+        if (i_max - i_min + 1) * (j_max - j_min + 1) > len(self.cells):
+            return [cell for cell in self.cells if i_min <= cell[0] <= i_max and j_min <= cell[1] <= j_max]
+        return [(i, j) for i in range(i_min, i_max + 1) for j in range(j_min, j_max + 1) if (i, j) in self.cells]
+
+    def query_box(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> list[int]:
+        result = []
+        positions, lats, lons = self.positions, self.lats, self.lons
+        for cell in self._cells_in_box(lat_min, lon_min, lat_max, lon_max):
+            for building_id in self.cells[cell]:
+                position = positions[building_id]
+                if lat_min <= lats[position] <= lat_max and lon_min <= lons[position] <= lon_max:
+                    result.append(building_id)
+        return result
+
+    def _distances(self, lat: float, lon: float, building_ids) -> list[tuple[float, int]]:
+        positions = [self.positions[building_id] for building_id in building_ids]
+        distances = haversine_many(lat, lon,
+                                   [self.lats[p] for p in positions],
+                                   [self.lons[p] for p in positions])
+        return list(zip(distances, building_ids))
+
+    def query_radius(self, lat: float, lon: float, meters: float) -> list[tuple[float, int]]:
+        """Здания в радиусе meters, отсортированные по расстоянию: [(метры, id), ...]."""
+        dlat = meters / METERS_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+        dlon = 180.0 if cos_lat < 1e-9 else min(meters / (METERS_PER_DEGREE * cos_lat), 180.0)
+        candidates = self.query_box(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        return sorted(item for item in self._distances(lat, lon, candidates) if item[0] <= meters)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            return [(ci, cj)]
+        cells = [(ci - r, cj + d) for d in range(-r, r + 1)]
+        cells += [(ci + r, cj + d) for d in range(-r, r + 1)]
+        cells += [(ci + d, cj - r) for d in range(-r + 1, r)]
+        cells += [(ci + d, cj + r) for d in range(-r + 1, r)]
+        return cells
+
+    def _ring_lower_bound(self, lat: float, r: int) -> float:
+        # Оценка снизу расстояния до любой точки за пределами колец 0..r
+        degrees = r * self.cell_size
+        cos_lat = math.cos(math.radians(min(abs(lat) + (r + 1) * self.cell_size, 90.0)))
+        return degrees * METERS_PER_DEGREE * cos_lat
+
+    def iter_nearest(self, lat: float, lon: float):
+        """Лениво отдаёт (метры, id) зданий в порядке возрастания расстояния."""
+        ci, cj = self._cell(lat, lon)
+        heap: list[tuple[float, int]] = []
+        visited = 0
+        r = 0
+        while visited < len(self.cells):
+            ring = self._ring(ci, cj, r)
+            if len(ring) > len(self.cells) - visited:
+                # Кольцо больше оставшихся ячеек: досчитываем оставшиеся напрямую
+                rest = [building_id for cell, ids in self.cells.items()
+                        if max(abs(cell[0] - ci), abs(cell[1] - cj)) >= r
+                        for building_id in ids]
+                heap.extend(self._distances(lat, lon, rest))
+                break
+            for cell in ring:
+                ids = self.cells.get(cell)
+                if ids:
+                    visited += 1
+                    heap.extend(self._distances(lat, lon, ids))
+            heapq.heapify(heap)
+            bound = self._ring_lower_bound(lat, r)
+            while heap and heap[0][0] <= bound:
+                yield heapq.heappop(heap)
+            r += 1
+
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)
+
+
+building_index = BuildingSpatialIndex()
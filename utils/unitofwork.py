@@ -0,0 +1,41 @@
+from database.db import AsyncSessionLocal, replica_router
+from utils.singleflight import query_flight
+
+
+class UnitOfWork:
+    """
+    Одна сессия и одна транзакция на запрос.
+    Репозитории и сервисы получают один и тот же экземпляр и работают через uow.session,
+    фиксирует изменения сервис вызовом commit() в конце пишущего сценария.
+    Читающие запросы открывают UnitOfWork.readonly(): реплика выбирается один раз,
+    и только такие единицы работы делят результаты single-flight с другими запросами.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, read_only: bool = False):
+        self.session_factory = session_factory
+        self.session = None
+        self.read_only = read_only
+        # После первого commit() чтения этой единицы работы не склеиваются с чужими
+        self.written = False
+
+    @classmethod
+    def readonly(cls):
+        return cls(replica_router.choose(), read_only=True)
+
+    async def __aenter__(self):
+        self.session = self.session_factory()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            await self.rollback()
+        await self.session.close()
+
+    async def commit(self):
+        await self.session.commit()
+        self.written = True
+        replica_router.mark_write()
+        query_flight.forget_all()
+
+    async def rollback(self):
+        await self.session.rollback()